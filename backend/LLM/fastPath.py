@@ -0,0 +1,150 @@
+import re
+import calendar
+import difflib
+from LLM.promptCache import normalize_request
+from LLM.gazetteer import match_at, region_sql
+
+# Rule-based SQL for the request shapes that make up most of the traffic:
+#   "<variable(s)> in <region> [in <month>] [<year> | from <year> to <year>] [at <N> m depth]"
+# Every word of the request must be understood; anything else (aggregates,
+# comparisons, unknown places, extra numbers) returns None and the request
+# goes to the LLM. The SQL follows the prompt rules in agents/Query.py: the
+# requested columns plus "time", depth = 10 unless a depth is given, and the
+# region's box from the gazetteer as latitude/longitude BETWEEN clauses.
+
+DEFAULT_DEPTH = 10
+
+VARIABLES = {
+    "temperature": {"temperature", "temperatures", "temp", "temps"},
+    "salinity": {"salinity", "salinities", "salt", "sal", "psal"},
+}
+_VARIABLE = {word: column for column, words in VARIABLES.items() for word in words}
+
+MONTHS = {name.lower(): i for i, name in enumerate(calendar.month_name) if name}
+MONTHS.update({name.lower(): i for i, name in enumerate(calendar.month_abbr) if name})
+MONTHS["sept"] = 9
+
+DEPTH_UNITS = {"m", "meter", "meters", "metre", "metres", "dbar"}
+RANGE_WORDS = {"to", "between", "until", "till", "through"}
+FILLER = {
+    "a", "an", "the", "me", "us", "i", "we", "my", "please", "pls", "can", "could", "would", "you",
+    "show", "give", "get", "list", "find", "display", "fetch", "plot", "want", "need", "see", "what", "is", "was",
+    "were", "are", "all", "data", "values", "readings", "records", "measurements", "of", "in", "at", "for", "on",
+    "from", "during", "and", "near", "around", "within", "inside", "over", "year", "years", "month", "level",
+    "levels", "deep",
+} | RANGE_WORDS
+
+# Spelling correction ("temprature" -> "temperature", "febuary" -> "february")
+_VOCABULARY = sorted(set(_VARIABLE) | set(MONTHS) | DEPTH_UNITS | {"depth"})
+SPELLING_CUTOFF = 0.8
+
+
+def _correct(word):
+    if word in _VOCABULARY or word in FILLER or len(word) < 5:
+        return word
+    match = difflib.get_close_matches(word, _VOCABULARY, n=1, cutoff=SPELLING_CUTOFF)
+    return match[0] if match else word
+
+
+def _is_year(token):
+    return token is not None and re.fullmatch(r"\d{4}", token) is not None and 1900 <= int(token) <= 2100
+
+
+def _number(token):
+    try:
+        return float(token)
+    except ValueError:
+        return None
+
+
+def parse_request(request: str):
+    """
+    The parts of a request that fits the template, or None if any word is not
+    understood: {"variables", "region" (gazetteer entry), "years", "month", "depth"}.
+    """
+    tokens = normalize_request(request).split()
+    variables, years, regions, months, depths = [], [], set(), [], []
+    matched_region = None
+    ranged = False
+    i = 0
+    while i < len(tokens):
+        region, used = match_at(tokens, i)
+        if region is not None:
+            regions.add(region["name"])
+            matched_region = region
+            i += used
+            continue
+
+        word = _correct(tokens[i])
+        nxt = _correct(tokens[i + 1]) if i + 1 < len(tokens) else None
+        value = _number(word)
+        span = re.fullmatch(r"(\d{4})-(\d{4})", word)
+
+        if word in _VARIABLE:
+            if _VARIABLE[word] not in variables:
+                variables.append(_VARIABLE[word])
+        elif word == "may" and nxt in ("i", "we"):
+            pass  # "may i see ...", not the month
+        elif word in MONTHS:
+            months.append(MONTHS[word])
+        elif span:
+            years.extend(int(y) for y in span.groups())
+            ranged = True
+        elif word == "depth" and nxt is not None and _number(nxt) is not None:
+            # "depth 100", "depth 100 m"
+            depths.append(_number(nxt))
+            i += 2
+            if i < len(tokens) and _correct(tokens[i]) in DEPTH_UNITS:
+                i += 1
+            continue
+        elif value is not None and nxt in DEPTH_UNITS:
+            # "100 m", "100 meters depth"
+            depths.append(value)
+            i += 2
+            if i < len(tokens) and _correct(tokens[i]) == "depth":
+                i += 1
+            continue
+        elif _is_year(word):
+            years.append(int(value))
+        elif (word in RANGE_WORDS or word == "from") and _is_year(nxt):
+            ranged = True
+        elif word not in FILLER:
+            return None
+        i += 1
+
+    if not variables or len(regions) != 1 or len(depths) > 1 or len(months) > 1:
+        return None
+    if depths and depths[0] < 0:
+        return None  # "-100 m" is not a depth in this table (positive down); left to the LLM
+    # a range needs both ends: "until 2023" or "from 2020" alone is left to the LLM
+    if len(years) > 2 or (len(years) == 2) != ranged or (months and len(years) != 1):
+        return None
+    if len(years) == 2 and years[0] > years[1]:
+        return None
+    return {
+        "variables": variables,
+        "region": matched_region,
+        "years": years,
+        "month": months[0] if months else None,
+        "depth": depths[0] if depths else DEFAULT_DEPTH,
+    }
+
+
+def build_sql(spec, table):
+    """SQL for a parsed request, in the shape the LLM prompt asks for."""
+    conditions = [region_sql(spec["region"]), f"depth = {spec['depth']:g}"]
+    years = spec["years"]
+    if spec["month"]:
+        year, month = years[0], spec["month"]
+        end_year, end_month = (year + 1, 1) if month == 12 else (year, month + 1)
+        conditions.append(f"time >= '{year}-{month:02d}-01' AND time < '{end_year}-{end_month:02d}-01'")
+    elif years:
+        conditions.append(f"time >= '{years[0]}-01-01' AND time < '{years[-1] + 1}-01-01'")
+    columns = ", ".join(["time"] + spec["variables"])
+    return f"SELECT {columns} FROM {table} WHERE {' AND '.join(conditions)};"
+
+
+def fast_sql(request: str, table: str):
+    """SQL for `request` if it fits the template, else None (use the LLM)."""
+    spec = parse_request(request)
+    return build_sql(spec, table) if spec else None
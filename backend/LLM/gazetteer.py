@@ -0,0 +1,104 @@
+import json
+import difflib
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+from LLM.promptCache import normalize_request
+
+# Offline place name -> bounding box resolution for ocean basins, seas and
+# regions, from the table bundled in LLM/regions.json. Names and aliases are
+# matched exactly after normalization (case, accents, punctuation, a leading
+# "the"), or fuzzily to absorb typos ("bay of bengl", "arabain sea"): names
+# sharing character trigrams with the phrase are scored with difflib. Results
+# are memoized, so repeated lookups are dictionary hits and always return the
+# same box.
+#
+# Boxes never cross the antimeridian (lon_min < lon_max), because the SQL and
+# MapAgent use plain "longitude BETWEEN lon_min AND lon_max"; basins that do,
+# like the Pacific, are split into western and eastern halves.
+
+REGIONS_PATH = Path(__file__).resolve().parent / "regions.json"
+FUZZY_CUTOFF = 0.85  # difflib ratio for a misspelled name
+MIN_FUZZY_LENGTH = 6  # shorter phrases only match exactly
+
+
+def _key(name):
+    words = normalize_request(name).split()
+    if words and words[0] == "the":
+        words = words[1:]
+    return " ".join(words)
+
+
+def _trigrams(text):
+    padded = f" {text} "
+    return Counter(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def _load(path=REGIONS_PATH):
+    with open(path, encoding="utf-8") as f:
+        regions = json.load(f)
+    names = {}
+    for region in regions:
+        for name in [region["name"], *region["aliases"]]:
+            names[_key(name)] = region
+    return regions, names
+
+
+REGIONS, _NAMES = _load()
+_GRAM_INDEX = {}  # trigram -> names containing it
+for _name in _NAMES:
+    for _gram in _trigrams(_name):
+        _GRAM_INDEX.setdefault(_gram, set()).add(_name)
+MAX_NAME_WORDS = max(len(name.split()) for name in _NAMES)
+
+
+@lru_cache(maxsize=4096)
+def lookup(name: str):
+    """Region dict ({"name", "aliases", "lat_min", "lat_max", "lon_min", "lon_max"}) for a place name, or None."""
+    key = _key(name)
+    region = _NAMES.get(key)
+    if region is not None or len(key) < MIN_FUZZY_LENGTH:
+        return region
+
+    candidates = set()
+    for gram in _trigrams(key):
+        candidates |= _GRAM_INDEX.get(gram, set())
+    best, best_score = None, FUZZY_CUTOFF
+    for candidate in sorted(candidates):  # sorted: ties resolve the same way every run
+        if len(candidate.split()) != len(key.split()):
+            continue
+        score = difflib.SequenceMatcher(None, key, candidate).ratio()
+        if score > best_score or (best is None and score == best_score):
+            best, best_score = candidate, score
+    return _NAMES[best] if best is not None else None
+
+
+def match_at(tokens, i):
+    """(region, number of tokens) of the longest place name starting at tokens[i], or (None, 0)."""
+    start = i + 1 if tokens[i] == "the" else i
+    for length in range(min(MAX_NAME_WORDS, len(tokens) - start), 0, -1):
+        region = lookup(" ".join(tokens[start:start + length]))
+        if region is not None:
+            return region, start - i + length
+    return None, 0
+
+
+def find_regions(request: str):
+    """Regions named in a request, in order of first mention."""
+    tokens = normalize_request(request).split()
+    found, i = [], 0
+    while i < len(tokens):
+        region, used = match_at(tokens, i)
+        if region is None:
+            i += 1
+            continue
+        if region not in found:
+            found.append(region)
+        i += used
+    return found
+
+
+def region_sql(region):
+    """The region's box as the WHERE conditions the generated SQL uses."""
+    return (f"latitude BETWEEN {region['lat_min']:g} AND {region['lat_max']:g} "
+            f"AND longitude BETWEEN {region['lon_min']:g} AND {region['lon_max']:g}")
@@ -0,0 +1,265 @@
+import os
+import re
+import json
+import math
+import time
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+from pathlib import Path
+from dotenv import load_dotenv
+
+# Cache of user request -> SQL pairs that already ran successfully, consulted
+# before asking the LLM. A request matches an earlier one if their normalized
+# text is equal, or if the cosine similarity of their character n-gram TF-IDF
+# vectors (filler words removed, synonyms such as avg/mean/average folded into
+# one term) reaches NL_CACHE_THRESHOLD and they agree on
+# every detail that changes the SQL: numbers, columns, aggregates,
+# comparisons, directions, and place names up to typos.
+# Entries are kept in a JSON file so they survive restarts, evicted least
+# recently used beyond NL_CACHE_MAX_ENTRIES, and dropped after NL_CACHE_TTL_DAYS.
+
+env_path = Path(__file__).resolve().parent.parent / ".env"
+load_dotenv(dotenv_path=env_path)
+
+NL_CACHE = os.getenv("NL_CACHE", "1") == "1"
+NL_CACHE_PATH = os.getenv("NL_CACHE_PATH") or str(Path(__file__).resolve().parent.parent / "nl_sql_cache.json")
+NL_CACHE_THRESHOLD = float(os.getenv("NL_CACHE_THRESHOLD", "0.8"))  # cosine similarity for a near-duplicate
+NL_CACHE_MAX_ENTRIES = int(os.getenv("NL_CACHE_MAX_ENTRIES", "1000"))
+NL_CACHE_TTL_DAYS = float(os.getenv("NL_CACHE_TTL_DAYS", "30"))
+NGRAM_SIZES = (3, 4, 5)
+
+# Words that change the SQL even when the rest of the request is the same,
+# mapped to a canonical term
+SIGNATURE_TERMS = {
+    "temperature": {"temperature", "temperatures", "temp", "temps", "temprature", "sst"},
+    "salinity": {"salinity", "salinities", "sal", "salt", "saltiness", "psal"},
+    "depth": {"depth", "depths", "deep", "pressure"},
+    "avg": {"avg", "average", "averages", "mean", "means"},
+    "max": {"max", "maximum", "highest", "hottest", "warmest", "largest"},
+    "min": {"min", "minimum", "lowest", "coldest", "coolest", "smallest"},
+    "count": {"count", "number", "many"},
+    "above": {"above", "over", "greater", "more", "exceeding", "higher"},
+    "below": {"below", "under", "less", "fewer", "lower"},
+    "not": {"not", "no", "without", "except", "excluding"},
+    # exclusive and inclusive bounds are different SQL (time < / time >=)
+    "before": {"before"},
+    "after": {"after"},
+    "until": {"until", "till", "through"},
+    "from": {"from", "since"},
+    "north": {"north", "northern"},
+    "south": {"south", "southern"},
+    "east": {"east", "eastern"},
+    "west": {"west", "western"},
+    "central": {"central", "middle"},
+}
+_CANONICAL = {word: term for term, words in SIGNATURE_TERMS.items() for word in words}
+
+# Filler words ignored when comparing requests
+STOPWORDS = {
+    "a", "an", "the", "me", "us", "i", "we", "you", "my", "our", "please", "pls", "can", "could", "would", "will",
+    "show", "give", "get", "list", "find", "display", "fetch", "plot", "tell", "want", "need", "see", "let",
+    "all", "any", "some", "data", "values", "value", "readings", "records", "measurements", "year", "years",
+    "of", "in", "at", "for", "on", "to", "near", "around", "within", "inside", "across", "by", "with", "and",
+    "what", "which", "is", "are", "was", "were", "be", "been", "there", "region", "area", "m", "meters", "metres",
+}
+WORD_MATCH = 0.6  # character trigram similarity for two content words to count as the same (typos)
+
+
+def normalize_request(request: str) -> str:
+    """Lower-case, accents folded, punctuation dropped (except in numbers), whitespace collapsed."""
+    text = unicodedata.normalize("NFKD", request).encode("ascii", "ignore").decode().lower()
+    text = re.sub(r"(?<!\d)[.,](?!\d)|[^\w\s.,-]|(?<![\d\s])-|-(?!\d)", " ", text)
+    text = re.sub(r"(?<=\d)(?=[a-z])|(?<=[a-z])(?=\d)", " ", text)  # "100m" -> "100 m"
+    return " ".join(text.split())
+
+
+def request_signature(normalized: str):
+    """Numbers and canonical terms of a normalized request, as a sorted list."""
+    numbers = {f"{float(n.replace(',', '')):g}" for n in re.findall(r"(?:(?<![\w.])-)?\d+(?:[.,]\d+)?", normalized)}
+    terms = {_CANONICAL[word] for word in re.findall(r"[a-z]+", normalized) if word in _CANONICAL}
+    return sorted(numbers) + sorted(terms)
+
+
+def _key_text(normalized: str) -> str:
+    """The request without filler words and with canonical terms, which is what gets vectorized."""
+    return " ".join(_CANONICAL.get(w, w) for w in normalized.split() if w not in STOPWORDS)
+
+
+def _content_words(normalized: str):
+    """Words that are neither filler, signature terms nor numbers: mostly place names."""
+    return {w for w in re.findall(r"[a-z]+", normalized) if w not in STOPWORDS and w not in _CANONICAL}
+
+
+def _word_similarity(a, b):
+    ta, tb = (Counter(f" {w} "[i:i + 3] for i in range(len(w))) for w in (a, b))
+    return 2 * sum((ta & tb).values()) / (sum(ta.values()) + sum(tb.values()))
+
+
+def _same_content(words_a, words_b):
+    """Every content word on either side has a close match (same word or a typo of it) on the other."""
+    return all(any(_word_similarity(a, b) >= WORD_MATCH for b in words_b) for a in words_a) and \
+        all(any(_word_similarity(a, b) >= WORD_MATCH for a in words_a) for b in words_b)
+
+
+def _ngrams(normalized: str) -> Counter:
+    """Character n-grams taken inside each padded word (scikit-learn's "char_wb"), so word order does not matter."""
+    grams = Counter()
+    for word in _key_text(normalized).split():
+        padded = f" {word} "
+        grams.update(padded[i:i + n] for n in NGRAM_SIZES for i in range(max(len(padded) - n + 1, 1)))
+    return grams
+
+
+class PromptCache:
+    """
+    Request -> SQL cache with exact and TF-IDF near-duplicate lookup. An
+    inverted index from n-gram to entries limits each lookup to the entries
+    sharing at least one n-gram with the request.
+    """
+
+    def __init__(self, path=NL_CACHE_PATH, threshold=NL_CACHE_THRESHOLD, max_entries=NL_CACHE_MAX_ENTRIES,
+                 ttl_days=NL_CACHE_TTL_DAYS, enabled=NL_CACHE):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl_days * 86400
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # normalized request -> entry, least recently used first
+        self.grams = {}  # normalized request -> n-gram counts
+        self.postings = {}  # n-gram -> set of normalized requests
+        self.df = Counter()  # n-gram -> number of entries containing it
+        self.counters = {"exact_hits": 0, "similar_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        if self.enabled:
+            self._load()
+
+    # --- index maintenance ---
+    def _index(self, key, entry):
+        self.entries[key] = entry
+        grams = _ngrams(key)
+        self.grams[key] = grams
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(key)
+        self.df.update(grams.keys())
+
+    def _unindex(self, key):
+        self.entries.pop(key, None)
+        for gram in self.grams.pop(key, {}):
+            keys = self.postings.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.postings[gram]
+            self.df[gram] -= 1
+            if self.df[gram] <= 0:
+                del self.df[gram]
+
+    def _idf(self, gram):
+        # smoothed idf, as in scikit-learn's TfidfVectorizer
+        return math.log((1 + len(self.entries)) / (1 + self.df.get(gram, 0))) + 1
+
+    def _weights(self, grams):
+        weights = {gram: count * self._idf(gram) for gram, count in grams.items()}
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        return {gram: w / norm for gram, w in weights.items()}
+
+    def _expired(self, entry, now):
+        return now - entry["last_used"] > self.ttl
+
+    # --- lookup and store ---
+    def lookup(self, request: str, table: str = None):
+        """
+        SQL of a cached request matching `request` (for `table`), or None.
+        Returns (sql, similarity) on a hit, similarity 1.0 for an exact match.
+        """
+        if not self.enabled:
+            return None
+        key = normalize_request(request)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry["table"] == table and not self._expired(entry, now):
+                return self._hit(key, 1.0, now, "exact_hits")
+
+            signature = request_signature(key)
+            words = _content_words(key)
+            query = self._weights(_ngrams(key))
+            candidates = set()
+            for gram in query:
+                candidates |= self.postings.get(gram, set())
+
+            best_key, best_score = None, 0.0
+            for candidate in candidates:
+                entry = self.entries[candidate]
+                if entry["table"] != table or entry["signature"] != signature or self._expired(entry, now):
+                    continue
+                weights = self._weights(self.grams[candidate])
+                score = sum(w * weights.get(gram, 0.0) for gram, w in query.items())
+                if score > best_score and _same_content(words, _content_words(candidate)):
+                    best_key, best_score = candidate, score
+
+            if best_key is not None and best_score >= self.threshold:
+                return self._hit(best_key, best_score, now, "similar_hits")
+            self.counters["misses"] += 1
+            return None
+
+    def _hit(self, key, score, now, counter):
+        entry = self.entries[key]
+        entry["last_used"] = now
+        entry["hits"] += 1
+        self.entries.move_to_end(key)
+        self.counters[counter] += 1
+        return entry["sql"], score
+
+    def store(self, request: str, sql: str, table: str = None):
+        """Remember a request whose SQL ran successfully."""
+        if not self.enabled:
+            return
+        key = normalize_request(request)
+        now = time.time()
+        with self.lock:
+            self._unindex(key)
+            self._index(key, {"request": request, "sql": sql, "table": table, "signature": request_signature(key),
+                              "created": now, "last_used": now, "hits": 0})
+            self.counters["stores"] += 1
+            while len(self.entries) > self.max_entries:
+                self._unindex(next(iter(self.entries)))
+                self.counters["evictions"] += 1
+            self._save()
+
+    def forget(self, request: str):
+        """Drop a request, e.g. when its cached SQL turned out to be wrong."""
+        with self.lock:
+            self._unindex(normalize_request(request))
+            self._save()
+
+    def stats(self):
+        with self.lock:
+            return {**self.counters, "entries": len(self.entries)}
+
+    # --- persistence ---
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for entry in sorted(saved.get("entries", []), key=lambda e: e["last_used"]):
+            if not self._expired(entry, now):
+                key = normalize_request(entry["request"])
+                entry["signature"] = request_signature(key)  # entries saved under older signature rules
+                self._index(key, entry)
+
+    def _save(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump({"entries": list(self.entries.values())}, f, indent=1)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"⚠️ Could not save the SQL cache: {e}")
+
+
+prompt_cache = PromptCache()
@@ -1,146 +1,158 @@
-import re
-from typing import Optional, Tuple, List
-import pandas as pd
+import os
+import asyncio
+from typing import Optional, Tuple
 import folium
+import pandas as pd
+import psycopg2
 from folium.plugins import MarkerCluster
-from database.postgres import run_query
+from database.postgres import stream_query, explain_query, downsample_query, sample_query, QUERY_DOWNSAMPLE
+from database.asyncPostgres import run_query_async, estimate_rows_async
+from database.sqlParser import parse_sql, to_sql, walk, conjuncts, number_value, AGGREGATES
 
+MAP_MAX_POINTS = int(os.getenv("MAP_MAX_POINTS", "5000"))  # markers before the points are downsampled
 
-def _parse_latlon_ranges(sql: str) -> Optional[Tuple[float, float, float, float]]:
-    """Return (lat_min, lat_max, lon_min, lon_max) if found, else None."""
-    lat_pat = r"latitude\s+BETWEEN\s*([+-]?\d+(?:\.\d+)?)\s+AND\s*([+-]?\d+(?:\.\d+)?)"
-    lon_pat = r"longitude\s+BETWEEN\s*([+-]?\d+(?:\.\d+)?)\s+AND\s*([+-]?\d+(?:\.\d+)?)"
 
-    lat_m = re.search(lat_pat, sql, flags=re.IGNORECASE)
-    lon_m = re.search(lon_pat, sql, flags=re.IGNORECASE)
+COORDINATES = ["time", "latitude", "longitude"]  # one map point per profile
 
-    if not lat_m or not lon_m:
+
+def _box(statement) -> Optional[Tuple[float, float, float, float]]:
+    """
+    The latitude/longitude BETWEEN box among the top-level AND conditions of
+    a parsed query's WHERE, as (lat_min, lat_max, lon_min, lon_max), or None.
+    NOTE: a box inside an OR is not found.
+    """
+    bounds = {}
+    for condition in conjuncts(statement["where"]):
+        column = condition["expr"] if condition["type"] == "between" and not condition["not"] else None
+        if column is not None and column["type"] == "column" and column["name"] in ("latitude", "longitude") \
+                and column["name"] not in bounds:
+            low, high = number_value(condition["low"]), number_value(condition["high"])
+            if low is not None and high is not None:
+                bounds[column["name"]] = (min(low, high), max(low, high))  # normalize
+    if len(bounds) < 2:
         return None
+    return (*bounds["latitude"], *bounds["longitude"])
 
-    lat_min, lat_max = map(float, lat_m.groups())
-    lon_min, lon_max = map(float, lon_m.groups())
 
-    # normalize
-    if lat_min > lat_max:
-        lat_min, lat_max = lat_max, lat_min
-    if lon_min > lon_max:
-        lon_min, lon_max = lon_max, lon_min
+def has_coordinates(statement) -> bool:
+    """Whether the result of a parsed query has latitude and longitude columns (judged from its SELECT list)."""
+    names = set()
+    for item in statement["columns"]:
+        expr = item["expr"]
+        if expr["type"] == "star":
+            return True
+        if item["alias"]:
+            names.add(item["alias"])
+        elif expr["type"] == "column":
+            names.add(expr["name"])
+    return {"latitude", "longitude"} <= names
 
-    return lat_min, lat_max, lon_min, lon_max
 
+def coordinate_query(statement) -> str:
+    """
+    Minimal query for the map when the result has no coordinates: the
+    distinct (time, latitude, longitude) profiles of the rows the query reads,
+    under the same WHERE. ORDER BY/LIMIT are kept when they pick rows of the
+    table; after GROUP BY, aggregates or DISTINCT the map shows every profile
+    that went into the result.
+    """
+    if statement["from"] is None or statement["from"]["type"] != "table":
+        raise ValueError("The map needs a query that reads directly from a table.")
+
+    aggregated = bool(statement["group_by"] or statement["having"] or statement["distinct"]) or any(
+        node["type"] == "function" and node["name"] in AGGREGATES
+        for item in statement["columns"] for node in walk(item["expr"]))
+    aliases = {item["alias"] for item in statement["columns"] if item["alias"]}
+    order_on_output = any(  # ORDER BY an output alias or position would not mean the same on the new columns
+        (node["type"] == "column" and node["table"] is None and node["name"] in aliases) or node["type"] == "literal"
+        for item in statement["order_by"] for node in walk(item["expr"]))
+    keep_limit = statement["limit"] is not None and not aggregated and not order_on_output
+
+    columns = ", ".join(COORDINATES)
+    points = {**statement, "distinct": not keep_limit, "distinct_on": None, "group_by": [], "having": None,
+              "columns": [{"expr": {"type": "column", "table": None, "name": name}, "alias": None}
+                          for name in COORDINATES]}
+    if not keep_limit:
+        return to_sql({**points, "order_by": [], "limit": None, "offset": None}) + ";"
+    # the limit counts rows, so deduplicate after it
+    return f"SELECT DISTINCT {columns} FROM ({to_sql(points)}) AS result;"
+
+
+def _downsampled(final_query: str, estimated_rows: Optional[int]) -> str:
+    """
+    The map query, aggregated on the grid or sampled when it matches more
+    than MAP_MAX_POINTS points; a grid with too many cells is replaced by a
+    sample.
+    """
+    if QUERY_DOWNSAMPLE == "off" or estimated_rows is None or estimated_rows <= MAP_MAX_POINTS:
+        return final_query
+    rewritten, how = downsample_query(final_query, estimated_rows, target_rows=MAP_MAX_POINTS)
+    if how == "grid" and explain_query(rewritten)["rows"] > MAP_MAX_POINTS:
+        rewritten = sample_query(final_query, estimated_rows, MAP_MAX_POINTS)
+    return rewritten or final_query
 
-def _extract_table_and_where(sql: str) -> Tuple[Optional[str], str]:
-    """Extract first table after FROM (simple heuristic) and the WHERE clause body (if any)."""
-    from_m = re.search(r"FROM\s+([^\s;]+)", sql, flags=re.IGNORECASE)
-    table = from_m.group(1) if from_m else None
 
-    where_m = re.search(r"WHERE\s+(.*?)(?:GROUP\s+BY|ORDER\s+BY|LIMIT\b|;|$)",
-                        sql, flags=re.IGNORECASE | re.DOTALL)
-    where_clause = where_m.group(1).strip() if where_m else ""
-    return table, where_clause
+def _result_points(result: pd.DataFrame) -> pd.DataFrame:
+    """Rows of an already-fetched result to mark on the map, sampled down to MAP_MAX_POINTS."""
+    if len(result) > MAP_MAX_POINTS:
+        return result.sample(n=MAP_MAX_POINTS, random_state=0)
+    return result
 
 
-def _clean_leftover_where(where_clause: str) -> List[str]:
-    """
-    Remove latitude/longitude BETWEEN clauses from the WHERE text and
-    return a list of remaining conditions split by AND.
-    NOTE: This preserves simple AND-separated conditions. Complex boolean logic (OR, nested parentheses)
-    may not be reconstructed perfectly.
-    """
-    if not where_clause:
-        return []
-
-    # remove latitude/longitude between patterns
-    without_box = re.sub(
-        r"latitude\s+BETWEEN\s*[+-]?\d+(?:\.\d+)?\s+AND\s*[+-]?\d+(?:\.\d+)?",
-        "",
-        where_clause, flags=re.IGNORECASE)
-    without_box = re.sub(
-        r"longitude\s+BETWEEN\s*[+-]?\d+(?:\.\d+)?\s+AND\s*[+-]?\d+(?:\.\d+)?",
-        "",
-        without_box, flags=re.IGNORECASE)
-
-    # split on AND and keep non-empty parts (trim whitespace)
-    parts = [p.strip() for p in re.split(r"\bAND\b", without_box, flags=re.IGNORECASE) if p.strip()]
-
-    # remove stray leading/trailing AND/OR tokens if any
-    cleaned = []
-    for p in parts:
-        p = re.sub(r"(^\s*AND\s+)|(\s+AND\s*$)", "", p, flags=re.IGNORECASE).strip()
-        if p:
-            cleaned.append(p)
-    return cleaned
+def _usable(result) -> bool:
+    return result is not None and {"latitude", "longitude"} <= set(result.columns)
 
 
-def generateMap(
-        original_sql: str,
-        padding: float = 1.0
-) -> str:
+def render_map(frames, ranges: Optional[Tuple[float, float, float, float]], padding: float = 1.0) -> str:
     """
-    Generate a Folium map from SQL and return HTML as a string.
+    Add a marker per row of each DataFrame in `frames` and return the map as
+    HTML. The popup lists the row's other columns; the frames are not modified.
     """
-    # 1) parse ranges
-    ranges = _parse_latlon_ranges(original_sql)
-    if not ranges:
-        raise ValueError("No latitude/longitude BETWEEN ... AND ... clauses found in provided SQL.")
-    lat_min, lat_max, lon_min, lon_max = ranges
-
-    # 2) extract table & leftover conditions
-    table_name, where_clause = _extract_table_and_where(original_sql)
-    leftover_conditions = _clean_leftover_where(where_clause)
-
-    # build final WHERE
-    where_parts = [
-        f"latitude BETWEEN {lat_min} AND {lat_max}",
-        f"longitude BETWEEN {lon_min} AND {lon_max}"
-    ]
-    if leftover_conditions:
-        where_parts.extend(leftover_conditions)
-    final_where = " AND ".join(where_parts)
-
-    # build SELECT
-    select_cols = "time, latitude, longitude, depth, temperature, salinity"
-    final_query = f"SELECT {select_cols} FROM {table_name} WHERE {final_where};"
-
-    # run query
-    result = run_query(final_query, return_columns=True)
-    if isinstance(result, str) and result.startswith("PostgreSQL Error"):
-        raise RuntimeError(result)
-    rows, columns = result
-    df = pd.DataFrame(rows, columns=columns)
-    df["latitude"] = df["latitude"].astype(float)
-    df["longitude"] = df["longitude"].astype(float)
-
-    if df.empty:
-        # fallback: empty map centered on lat/lon box
+    m = folium.Map()
+    cluster = MarkerCluster().add_to(m)
+    n = 0
+    lat_sum = lon_sum = 0.0
+    min_lat = min_lon = float("inf")
+    max_lat = max_lon = float("-inf")
+    for df in frames:
+        df = df.dropna(subset=["latitude", "longitude"])  # rows without a position cannot be marked
+        lats = df["latitude"].astype(float)
+        lons = df["longitude"].astype(float)
+
+        if df.empty:
+            continue
+        n += len(df)
+        lat_sum += lats.sum()
+        lon_sum += lons.sum()
+        min_lat = min(min_lat, lats.min())
+        max_lat = max(max_lat, lats.max())
+        min_lon = min(min_lon, lons.min())
+        max_lon = max(max_lon, lons.max())
+
+        labels = [c for c in df.columns if c not in ("latitude", "longitude")]
+        details = df[labels].itertuples(index=False, name=None)
+        for lat, lon, values in zip(lats, lons, details):
+            popup_html = "<br>".join(f"{label}: {value}" for label, value in zip(labels, values))
+            folium.Marker(location=[lat, lon], popup=popup_html or None).add_to(cluster)
+
+    if n == 0:
+        # fallback: empty map centered on lat/lon box, or the whole world without one
+        if ranges is None:
+            return folium.Map(location=[0, 0], zoom_start=2)._repr_html_()
+        lat_min, lat_max, lon_min, lon_max = ranges
         center_lat = (lat_min + lat_max) / 2
         center_lon = (lon_min + lon_max) / 2
         m = folium.Map(location=[center_lat, center_lon], zoom_start=6)
         return m._repr_html_()
 
     # compute bounds of points with padding
-    min_lat = df["latitude"].min() - padding
-    max_lat = df["latitude"].max() + padding
-    min_lon = df["longitude"].min() - padding
-    max_lon = df["longitude"].max() + padding
+    min_lat -= padding
+    max_lat += padding
+    min_lon -= padding
+    max_lon += padding
 
     # center map at mean
-    center_lat = df["latitude"].mean()
-    center_lon = df["longitude"].mean()
-
-    m = folium.Map(location=[center_lat, center_lon])
-    cluster = MarkerCluster().add_to(m)
-
-    for _, row in df.iterrows():
-        lat = float(row["latitude"])
-        lon = float(row["longitude"])
-        popup_html = (
-            f"time: {row.get('time')}<br>"
-            f"depth: {row.get('depth')}<br>"
-            f"temperature: {row.get('temperature')}<br>"
-            f"salinity: {row.get('salinity')}"
-        )
-        folium.Marker(location=[lat, lon], popup=popup_html).add_to(cluster)
+    m.location = [lat_sum / n, lon_sum / n]
 
     # fit map to bounds
     m.fit_bounds([[min_lat, min_lon], [max_lat, max_lon]])
@@ -149,6 +161,68 @@ def generateMap(
     return m._repr_html_()
 
 
+def fallback_map(statement) -> str:
+    """Empty map centered on the query's latitude/longitude box (or the world), for when no points can be shown."""
+    return render_map([], _box(statement))
+
+
+def generateMap(
+        original_sql: str,
+        padding: float = 1.0,
+        statement: Optional[dict] = None,
+        result: Optional[pd.DataFrame] = None
+) -> str:
+    """
+    Generate a Folium map for a query and return HTML as a string. `result`
+    is the query's already-fetched DataFrame: when it has latitude and
+    longitude, the markers come from it without touching the database.
+    Otherwise only the profiles' coordinates are queried (coordinate_query),
+    using the query's AST when the caller already has it. Above
+    MAP_MAX_POINTS points, the markers show a sample or a grid aggregate.
+    """
+    if statement is None:
+        statement = parse_sql(original_sql)
+    ranges = _box(statement)
+    if _usable(result):
+        return render_map([_result_points(result)], ranges, padding)
+
+    # run query, adding markers one fetched batch at a time
+    final_query = coordinate_query(statement)
+    try:
+        final_query = _downsampled(final_query, explain_query(final_query)["rows"])
+        return render_map(stream_query(final_query, as_frame=True), ranges, padding)
+    except psycopg2.Error as e:
+        raise RuntimeError(f"PostgreSQL Error: {e}")
+
+
+async def generateMapAsync(
+        original_sql: str,
+        padding: float = 1.0,
+        timeout_ms: Optional[int] = None,
+        statement: Optional[dict] = None,
+        result: Optional[pd.DataFrame] = None
+) -> str:
+    """
+    generateMap for asyncio callers: the coordinates, when they have to be
+    queried, are fetched on the async pool, so the query overlaps with other
+    work, and the markers are built in a worker thread.
+    """
+    if statement is None:
+        statement = parse_sql(original_sql)
+    ranges = _box(statement)
+    if _usable(result):
+        return await asyncio.to_thread(render_map, [_result_points(result)], ranges, padding)
+
+    final_query = coordinate_query(statement)
+    final_query = await asyncio.to_thread(_downsampled, final_query, await estimate_rows_async(final_query))
+    fetched = await run_query_async(final_query, return_columns=True, timeout_ms=timeout_ms)
+    if isinstance(fetched, str):
+        raise RuntimeError(fetched)
+    rows, columns = fetched
+    frames = [pd.DataFrame(rows, columns=columns)] if rows else []
+    return await asyncio.to_thread(render_map, frames, ranges, padding)
+
+
 # =========================
 # Example usage (drop into your module)
 # =========================
@@ -156,8 +230,7 @@ if __name__ == "__main__":
     example_sql = """
                   SELECT *
                   FROM floatchat.argo_data
-                  WHERE
-                    AND latitude BETWEEN 8
+                  WHERE latitude BETWEEN 8
                     AND 30
                     AND longitude BETWEEN 50
                     AND 75
@@ -0,0 +1,75 @@
+import asyncio
+from agents.Query import generate_sql, execute_sql, remember_sql
+from agents.MapAgent import generateMapAsync, has_coordinates, fallback_map
+from database.postgres import check_query, QUERY_TIMEOUT_MS
+from database.asyncPostgres import run_sync
+
+
+def _discard(task):
+    """Cancel a task whose result is no longer needed, without leaving its exception unretrieved."""
+    if not task.done():
+        task.cancel()
+    else:
+        if not task.cancelled():
+            task.exception()
+
+
+async def answerRequestAsync(request):
+    """
+    Answer a user request with the database stages overlapping: once the SQL
+    is generated, the cost guard and the main result run in worker threads.
+    The map is drawn from that result when it has latitude and longitude;
+    otherwise the profiles' coordinates are fetched on the async pool while
+    the main query runs.
+    Returns execute_sql's dict plus "sql_source" (see generate_sql) and
+    "map_html" when there are results, or None if no SQL could be generated
+    or the query failed.
+    """
+    try:
+        sql_query, source, statement = await asyncio.to_thread(generate_sql, request)
+    except Exception as e:
+        print("Error:", e)
+        return None
+
+    map_task = None
+    if not has_coordinates(statement):
+        map_task = asyncio.create_task(
+            generateMapAsync(sql_query, timeout_ms=QUERY_TIMEOUT_MS, statement=statement))
+    try:
+        guard = await asyncio.to_thread(check_query, sql_query)
+        if guard["decision"] == "reject" and map_task is not None:
+            _discard(map_task)  # the map query would be just as expensive
+        result = await asyncio.to_thread(execute_sql, sql_query, guard)
+    except Exception as e:
+        print("Error:", e)  # e.g. the connection pool is unavailable
+        result = None
+    except BaseException:
+        if map_task is not None:
+            _discard(map_task)
+        raise
+    if result is None:
+        if map_task is not None:
+            _discard(map_task)
+        return None
+    result["sql_source"] = source
+
+    if not result["result"]:
+        if map_task is not None:
+            _discard(map_task)
+        return result
+    await asyncio.to_thread(remember_sql, request, result)
+    if map_task is None:
+        map_task = generateMapAsync(sql_query, timeout_ms=QUERY_TIMEOUT_MS, statement=statement,
+                                    result=result["data"])
+    try:
+        result["map_html"] = await map_task
+    except Exception as e:
+        # keep the fetched result; only the markers are missing
+        print(f"⚠️ Map could not be drawn: {e}")
+        result["map_html"] = await asyncio.to_thread(fallback_map, statement)
+    return result
+
+
+def answerRequest(request):
+    """Blocking wrapper around answerRequestAsync for the Streamlit script."""
+    return run_sync(answerRequestAsync(request))
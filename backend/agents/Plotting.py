@@ -1,4 +1,3 @@
-import os
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
@@ -15,22 +14,22 @@ def style_time_axis(ax):
     plt.setp(ax.xaxis.get_majorticklabels(), rotation=45, ha="right", fontsize=8)
     ax.grid(True, linestyle="--", alpha=0.5)
 
-def plotGraphs(csv_file, visualizations_info):
+def plotGraphs(df, visualizations_info):
     """
-    Generate figures based on visualization instructions (JSON).
+    Generate figures from a query result (DataFrame) based on visualization instructions (JSON).
     """
-    if not os.path.exists(csv_file):
-        print(f"❌ File not found: {csv_file}")
+    if df is None:
+        print("❌ No result to plot.")
         return []
 
     try:
         print("visualizations_info in plotting: ", visualizations_info)
-        df = pd.read_csv(csv_file)
         figures = []
 
-        # Convert time column if exists
+        # Convert time column if exists (on a new frame; the result is shared)
         if "time" in df.columns:
-            df["time"] = pd.to_datetime(df["time"], errors="coerce")
+            if not pd.api.types.is_datetime64_any_dtype(df["time"]):
+                df = df.assign(time=pd.to_datetime(df["time"], errors="coerce"))
             df = df.dropna(subset=["time"])
 
         for viz in visualizations_info:
@@ -1,7 +1,12 @@
 import os
 import pandas as pd
-from database.postgres import run_query
+import psycopg2
+from database.postgres import stream_query, fetch_frame, check_query, query_cache, QUERY_TIMEOUT_MS
+from database.sqlParser import validate_sql, to_sql
 from LLM.llmHelper import llm_model
+from LLM.promptCache import prompt_cache
+from LLM.fastPath import fast_sql
+from LLM.gazetteer import find_regions, region_sql
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -10,73 +15,263 @@ env_path = Path(__file__).resolve().parent.parent / ".env"
 load_dotenv(dotenv_path=env_path)
 
 tableName = os.getenv("TABLE_NAME")
+TABLE_COLUMNS = ["time", "latitude", "longitude", "depth", "temperature", "salinity"]
+SQL_REPAIR_ATTEMPTS = int(os.getenv("SQL_REPAIR_ATTEMPTS", "1"))  # LLM calls to fix SQL that fails validation
 
-def SQLagent(request):
+# Where the SQL of a request came from, as reported in the result's "sql_source"
+SQL_SOURCES = {
+    "rules": "⚡ SQL built by the rule-based fast path (no LLM call)",
+    "cache": "♻️ SQL reused from an earlier request (no LLM call)",
+    "llm": "🤖 SQL generated by the LLM",
+}
+
+
+def _write_batches(query, output_path, timeout_ms=None):
     """
-    Generate a SQL query using Gemini models and execute it on PostgreSQL.
-    Save results as a CSV file in the project root with correct column names.
+    Write the result of `query` to output_path one fetched batch at a time. Returns the row count.
+    Results that fit the result cache are kept there as a DataFrame and written from it next time.
     """
-    try:
-        # Step 1: Get LLM model
-        llm = llm_model(50, 0.2)
+    cached = query_cache.get(query, kind="frame")
+    if cached is not None:
+        print("♻️ Result served from the query cache.")
+        cached.to_csv(output_path, index=False, date_format="%Y-%m-%d %H:%M:%S")
+        return len(cached)
 
-        prompt = f"""
-        You are an AI that writes SQL queries for a PostgreSQL table called "{tableName}".
-        Columns: time, latitude, longitude, depth, temperature, salinity.
+    n_rows = 0
+    kept, kept_bytes = ([] if query_cache.accepts(query) else None), 0
+    for i, df in enumerate(stream_query(query, as_frame=True, timeout_ms=timeout_ms)):
+        try:
+            df["time"] = pd.to_datetime(df["time"])
+        except Exception:
+            if i == 0:
+                print("⚠️ Could not convert 'time' column to datetime.")
+        df.to_csv(output_path, mode="w" if i == 0 else "a", header=i == 0, index=False,
+                  date_format="%Y-%m-%d %H:%M:%S")
+        n_rows += len(df)
+        if kept is not None:
+            kept.append(df)
+            kept_bytes += int(df.memory_usage(deep=True).sum())
+            if kept_bytes > query_cache.max_bytes:
+                kept = None  # too large to cache; keep streaming with bounded memory
+    if kept:
+        query_cache.put(query, pd.concat(kept, ignore_index=True), kind="frame")
+    return n_rows
 
-        Instructions:
-        1. Always include the "time" column in the SELECT query.
-        2. Only include the columns explicitly requested by the user, plus "time". Do not add extra columns.
-        3. If the user does not mention depth, assume depth = 10 and add it as a filter in the WHERE clause.
-        4. Ensure the query is syntactically correct PostgreSQL.
-        5. Correct any user spelling mistakes in column names (e.g., "temprature" → "temperature").
-        6. When using aggregation functions, name the columns as "avg_columnname", "max_columnname", "min_columnname", etc. (e.g., avg_temperature, max_salinity).
-        7. If the user provides a place name instead of coordinates (latitude, longitude), convert the place name into its corresponding coordinates and use those in the WHERE clause.
-        8. Return only the SQL query, without explanation or formatting.
 
-        User request: {request}
-        """
+def stream_to_csv(sql_query, output_path, timeout_ms=None):
+    """
+    Stream a query result into a CSV file with bounded memory, sorted by time
+    on the server. Queries without a usable "time" column are written unsorted.
+    Returns the number of rows written.
+    """
+    ordered = f"SELECT * FROM ({sql_query.strip().rstrip(';')}) AS result ORDER BY time"
+    try:
+        return _write_batches(ordered, output_path, timeout_ms)
+    except psycopg2.errors.QueryCanceled:
+        raise  # statement_timeout: retrying unsorted would just time out again
+    except psycopg2.Error:
+        print("⚠️ Could not sort the result by 'time'; saving it unsorted.")
+        return _write_batches(sql_query, output_path, timeout_ms)
 
-        # Step 3: Generate SQL query
-        response = llm.invoke(prompt)
-        sql_query = response.content.strip()
-        sql_query = sql_query.replace("```sql", "").replace("```", "").strip()
 
-        print("Generated SQL Query:\n", sql_query)
+def _ask_llm(llm, prompt):
+    response = llm.invoke(prompt)
+    return response.content.strip().replace("```sql", "").replace("```", "").strip()
 
-        # Step 4: Execute SQL query (with column names)
-        result, columns = run_query(sql_query, return_columns=True)
 
-        # Step 5: Save result as CSV in project root
-        if result:
-            # Project root = one level up from agents/
-            project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-            output_path = os.path.join(project_root, "dataExtracted.csv")
+def _validate(sql_query):
+    """AST of a query checked against the table's schema (see database/sqlParser.py); raises ValueError."""
+    return validate_sql(sql_query, tableName, TABLE_COLUMNS)
 
-            # Delete existing file if present
-            if os.path.exists(output_path):
-                os.remove(output_path)
-                print("🗑️ Old query_result.csv deleted.")
 
-            df = pd.DataFrame(result, columns=columns)
+def generate_sql(request, use_cache=True):
+    """
+    Build a PostgreSQL query answering `request`. Returns (SQL text, source,
+    AST): requests fitting the common templates are translated by rules
+    (LLM/fastPath.py, source "rules"); with use_cache, SQL that already
+    answered the same or a near-identical request is reused (LLM/promptCache.py,
+    source "cache"); anything else is sent to the LLM (source "llm").
+    Every query is parsed and checked against the schema before it is
+    returned; LLM output that fails the check is sent back for at most
+    SQL_REPAIR_ATTEMPTS repairs, then ValueError is raised. LLM output is
+    returned as rendered from its validated AST; the AST itself is returned
+    for downstream stages to reuse.
+    """
+    sql_query = fast_sql(request, tableName)
+    if sql_query is not None:
+        print("⚡ Fast path SQL Query:\n", sql_query)
+        return sql_query, "rules", _validate(sql_query)
 
+    if use_cache:
+        cached = prompt_cache.lookup(request, tableName)
+        if cached is not None:
+            sql_query, score = cached
             try:
-                df["time"] = pd.to_datetime(df["time"])
-                df = df.sort_values("time")
-            except Exception:
-                print("⚠️ Could not convert 'time' column to datetime.")
+                statement = _validate(sql_query)
+                print(f"♻️ SQL reused from an earlier request (similarity {score:.2f}):\n", sql_query)
+                return sql_query, "cache", statement
+            except ValueError as e:
+                print(f"⚠️ Cached SQL no longer valid ({e}); asking the LLM.")
+                prompt_cache.forget(request)
+
+    # Step 1: Get LLM model
+    llm = llm_model(50, 0.2)
+
+    # Places the gazetteer knows get their exact box instead of the LLM's guess
+    regions = find_regions(request)
+    known_regions = "".join(f"\n    - {region['name']}: {region_sql(region)}" for region in regions)
+    if known_regions:
+        known_regions = f"\n    Known regions (use these conditions exactly):{known_regions}\n"
+
+    prompt = f"""
+    You are an AI that writes SQL queries for a PostgreSQL table called "{tableName}".
+    Columns: {", ".join(TABLE_COLUMNS)}.
+
+    Instructions:
+    1. Always include the "time" column in the SELECT query.
+    2. Only include the columns explicitly requested by the user, plus "time". Do not add extra columns.
+    3. If the user does not mention depth, assume depth = 10 and add it as a filter in the WHERE clause.
+    4. Ensure the query is syntactically correct PostgreSQL.
+    5. Correct any user spelling mistakes in column names (e.g., "temprature" → "temperature").
+    6. When using aggregation functions, name the columns as "avg_columnname", "max_columnname", "min_columnname", etc. (e.g., avg_temperature, max_salinity).
+    7. If the user provides a place name instead of coordinates (latitude, longitude), convert the place name into its corresponding coordinates and use those in the WHERE clause as "latitude BETWEEN ... AND ..." and "longitude BETWEEN ... AND ...". For places listed under "Known regions", use the given conditions exactly.
+    8. Return only the SQL query, without explanation or formatting.
+    {known_regions}
+    User request: {request}
+    """
+
+    # Step 2: Generate SQL query, and repair it if it fails validation
+    sql_query = _ask_llm(llm, prompt)
+    print("Generated SQL Query:\n", sql_query)
+    for attempt in range(SQL_REPAIR_ATTEMPTS + 1):
+        try:
+            statement = _validate(sql_query)
+            break
+        except ValueError as e:
+            if attempt == SQL_REPAIR_ATTEMPTS:
+                raise ValueError(f"Generated SQL is invalid: {e}") from e
+            print(f"🔧 Generated SQL rejected: {e} Asking the LLM to repair it.")
+            sql_query = _ask_llm(llm, f"""{prompt}
+    Your previous answer was:
+    {sql_query}
+
+    It was rejected before execution: {e}
+    Return the corrected SQL query only.
+    """)
+            print("Repaired SQL Query:\n", sql_query)
+    return to_sql(statement), "llm", statement
+
+
+def fetch_result(query, timeout_ms=None):
+    """
+    The result of `query` as a typed DataFrame (see fetch_frame), sorted by
+    time when it has a "time" column. Results that fit the result cache are
+    kept there and served from it next time, so callers must not modify it.
+    """
+    cached = query_cache.get(query, kind="frame")
+    if cached is not None:
+        print("♻️ Result served from the query cache.")
+        return cached
+    df = fetch_frame(query, timeout_ms)
+    if "time" in df.columns:
+        df = df.sort_values("time", kind="stable", ignore_index=True)
+    query_cache.put(query, df, kind="frame")
+    return df
 
-            # Save new file
-            df.to_csv(output_path, index=False)
-            print(f"✅ Results saved to: {output_path}")
-        else:
-            print("⚠️ No results to save.")
 
+def execute_sql(sql_query, guard=None):
+    """
+    Run a generated query through the cost guard (check_query, unless its
+    decision is passed in as `guard`) and fetch the admitted query's result
+    into a typed DataFrame (fetch_result), which is handed to the preview,
+    summary, plots and download as is.
+    Returns {"sql_query", "result" (row count), "guard", "data" (DataFrame, or None if not run)},
+    or None if the query failed.
+    """
+    # Step 3: Check the planner's estimates before running anything
+    if guard is None:
+        guard = check_query(sql_query)
+    print(f"🛡️ Cost guard: {guard['message']}")
+    if guard["decision"] == "reject":
         return {
             "sql_query": sql_query,
-            "result": result,
+            "result": 0,
+            "guard": guard,
+            "data": None,
         }
 
+    # Step 4: Execute SQL query into a DataFrame
+    try:
+        df = fetch_result(guard["query"], guard["timeout_ms"])
+    except psycopg2.errors.QueryCanceled:
+        guard.update(decision="reject",
+                     message=f"Query cancelled after the {guard['timeout_ms'] / 1000:g} s timeout. "
+                             "Narrow it down with a depth, latitude/longitude or time filter.")
+        print(f"⏱️ {guard['message']}")
+        return {
+            "sql_query": sql_query,
+            "result": 0,
+            "guard": guard,
+            "data": None,
+        }
+    except psycopg2.Error as e:
+        print(f"❌ PostgreSQL Error: {e}")
+        return None
+    if len(df):
+        print(f"✅ {len(df)} rows fetched.")
+    else:
+        print("⚠️ No results.")
+
+    return {
+        "sql_query": sql_query,
+        "result": len(df),
+        "guard": guard,
+        "data": df,
+    }
+
+
+def remember_sql(request, result):
+    """Keep the request -> SQL pair in the prompt cache if the LLM wrote it and it ran and returned rows."""
+    if result and result["result"] and result["guard"]["decision"] != "reject" and result["sql_source"] == "llm":
+        prompt_cache.store(request, result["sql_query"], tableName)
+
+
+def export_full_csv(full_query, output_path=None):
+    """
+    Stream the full, not downsampled result of a query into a CSV file
+    (dataFull.csv in the project root unless `output_path` is given), for
+    downloads of a result that was shown aggregated.
+    Returns the file's path, or None if the query failed.
+    """
+    if output_path is None:
+        project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output_path = os.path.join(project_root, "dataFull.csv")
+    try:
+        n_rows = stream_to_csv(full_query, output_path, QUERY_TIMEOUT_MS)
+    except psycopg2.Error as e:
+        print(f"❌ Full export failed: {e}")
+        return None
+    print(f"✅ {n_rows} rows of the full result saved to: {output_path}")
+    return output_path
+
+
+def SQLagent(request):
+    """
+    Generate a SQL query using Gemini models and execute it on PostgreSQL.
+    The result is returned as a DataFrame in "data"; "result" is the row count.
+    The query first passes the cost guard (check_query): "guard" holds its
+    decision and explanation, and a rejected query is not executed.
+    Requests answered before are served from the prompt cache and common
+    templates skip the LLM; "sql_source" tells which path built the SQL.
+    """
+    try:
+        sql_query, source, _ = generate_sql(request)
+        result = execute_sql(sql_query)
+        if result is None:
+            return None
+        result["sql_source"] = source
+        remember_sql(request, result)
+        return result
     except Exception as e:
         print("Error:", e)
 
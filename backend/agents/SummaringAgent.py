@@ -1,4 +1,3 @@
-import os
 import json
 import re
 import pandas as pd
@@ -136,18 +135,15 @@ def get_visualizations_from_summary(summary_text, user_request):
 
 
 # === Main summary + visualization generator ===
-def summarizeTable(userPrompt, csv_file=None):
+def summarizeTable(userPrompt, df):
+    """Summary and suggested visualizations for a query result (DataFrame)."""
     try:
-        if csv_file is None:
-            project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-            csv_file = os.path.join(project_root, "dataExtracted.csv")
-
-        if not os.path.exists(csv_file):
-            print(f"⚠️ CSV file not found: {csv_file}")
+        if df is None:
+            print("⚠️ No result to summarize.")
             return None, []
 
-        df = pd.read_csv(csv_file)
-        data_as_list = df.to_dict(orient='records')
+        # timestamps as ISO strings and NULLs as null, so every row is JSON
+        data_as_list = json.loads(df.to_json(orient="records", date_format="iso", date_unit="s"))
 
         if not data_as_list:
             print("⚠️ No data to summarize.")
@@ -219,7 +215,8 @@ def summarizeTable(userPrompt, csv_file=None):
 
 # === Main entry point ===
 if __name__ == "__main__":
-    summary, visualizations = summarizeTable()
+    import sys
+    summary, visualizations = summarizeTable("General summary", pd.read_csv(sys.argv[1]))
     print("\n=== Final Summary ===")
     print(summary)
     print("\n=== Visualization Recommendations ===")
@@ -0,0 +1,226 @@
+import time
+import atexit
+import asyncio
+import threading
+import weakref
+from contextlib import asynccontextmanager
+import psycopg2
+import psycopg2.extensions
+from database.postgres import (DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_POOL_MIN, DB_POOL_MAX,
+                               DB_POOL_CHECK_AFTER, query_cache, plan_summary)
+
+# asyncio access to PostgreSQL next to the blocking run_query/stream_query.
+# Built on psycopg2's asynchronous connections: a query is sent without
+# blocking and the event loop is woken through add_reader/add_writer when the
+# socket is ready, so many queries can be in flight from one thread. Async
+# connections are always in autocommit mode and do not support named cursors
+# or COPY; use stream_query/fetch_columns for those.
+#
+# Each event loop gets its own pool. Synchronous code reaches the async API
+# through run_sync, which runs coroutines on one background loop (and pool)
+# shared by every Streamlit session of the process.
+
+_pools = weakref.WeakKeyDictionary()  # event loop -> AsyncPool
+_bridge_loop = None
+_bridge_lock = threading.Lock()
+
+
+async def _wait(conn):
+    """Drive an asynchronous connection until its current operation completes."""
+    loop = asyncio.get_running_loop()
+    while True:
+        state = conn.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            return
+        ready = loop.create_future()
+
+        def wake():
+            if not ready.done():
+                ready.set_result(None)
+
+        if state == psycopg2.extensions.POLL_READ:
+            loop.add_reader(conn.fileno(), wake)
+            try:
+                await ready
+            finally:
+                loop.remove_reader(conn.fileno())
+        elif state == psycopg2.extensions.POLL_WRITE:
+            loop.add_writer(conn.fileno(), wake)
+            try:
+                await ready
+            finally:
+                loop.remove_writer(conn.fileno())
+        else:
+            raise psycopg2.OperationalError(f"Unexpected poll state {state}")
+
+
+class AsyncPool:
+    """
+    Pool of asynchronous connections for one event loop, with the same limits
+    as the blocking pool (DB_POOL_MIN idle, DB_POOL_MAX open). Connections
+    idle for longer than DB_POOL_CHECK_AFTER are pinged before reuse; one
+    whose query failed or was cancelled is closed instead of being reused.
+    """
+
+    def __init__(self, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX):
+        self.minconn = minconn
+        self.slots = asyncio.Semaphore(maxconn)
+        self.idle = []  # (connection, last used)
+        self.closed = False
+
+    async def _connect(self):
+        conn = psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST, port=DB_PORT,
+                                async_=True)
+        try:
+            await _wait(conn)
+        except BaseException:
+            conn.close()
+            raise
+        return conn
+
+    async def _healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < DB_POOL_CHECK_AFTER:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1;")
+            await _wait(conn)
+            cur.close()
+            return True
+        except psycopg2.Error:
+            conn.close()
+            return False
+
+    @asynccontextmanager
+    async def connection(self):
+        async with self.slots:
+            conn = None
+            while self.idle and conn is None:
+                candidate, last_used = self.idle.pop()
+                if await self._healthy(candidate, last_used):
+                    conn = candidate
+            if conn is None:
+                conn = await self._connect()
+            reusable = False
+            try:
+                yield conn
+                reusable = True
+            finally:
+                if reusable and not conn.closed and not self.closed and len(self.idle) < self.minconn:
+                    self.idle.append((conn, time.monotonic()))
+                else:
+                    if not reusable and not conn.closed:
+                        try:
+                            conn.cancel()  # stop a query still running on the server
+                        except psycopg2.Error:
+                            pass
+                    conn.close()
+
+    def close(self):
+        self.closed = True
+        while self.idle:
+            conn, _ = self.idle.pop()
+            conn.close()
+
+
+def get_pool():
+    """The pool of the running event loop, created on first use."""
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        pool = _pools[loop] = AsyncPool()
+    return pool
+
+
+async def _execute(query, timeout_ms=None):
+    async with get_pool().connection() as conn:
+        cur = conn.cursor()
+        if timeout_ms:
+            cur.execute("SET statement_timeout = %s;", (int(timeout_ms),))
+            await _wait(conn)
+        try:
+            cur.execute(query)
+            await _wait(conn)
+            rows = cur.fetchall() if cur.description else []
+            columns = [desc[0] for desc in cur.description] if cur.description else []
+            # only after the query finished: on an error or cancellation the connection may still be
+            # busy, and the pool cancels the query on the server and closes the connection instead
+            if timeout_ms:
+                cur.execute("RESET statement_timeout;")
+                await _wait(conn)
+        finally:
+            cur.close()
+        return rows, columns
+
+
+async def run_query_async(query: str, return_columns: bool = False, use_cache: bool = True, timeout_ms: int = None):
+    """
+    Execute a SQL query without blocking the event loop. Same contract as
+    run_query: rows (or (rows, columns)), or a "PostgreSQL Error: ..." string.
+    """
+    if use_cache:
+        cached = await asyncio.to_thread(query_cache.get, query)
+        if cached is not None:
+            rows, columns = cached
+            return (list(rows), columns) if return_columns else list(rows)
+
+    try:
+        rows, columns = await _execute(query, timeout_ms)
+    except Exception as e:
+        return f"PostgreSQL Error: {e}"
+
+    if use_cache:
+        await asyncio.to_thread(query_cache.put, query, (rows, columns))
+        rows = list(rows)
+    return (rows, columns) if return_columns else rows
+
+
+async def explain_async(query: str):
+    """Planner estimates for a query without running it (see explain_query). Raises psycopg2.Error."""
+    rows, _ = await _execute(f"EXPLAIN (FORMAT JSON) {query.strip().rstrip(';')};")
+    return plan_summary(rows[0][0])
+
+
+async def estimate_rows_async(query: str):
+    """Planner's estimate of the number of rows a query returns, or None if it cannot be planned."""
+    try:
+        return (await explain_async(query))["rows"]
+    except psycopg2.Error:
+        return None
+
+
+async def gather_queries(*queries, return_columns: bool = False):
+    """Run several queries concurrently; results are in the order of `queries`."""
+    return await asyncio.gather(*(run_query_async(q, return_columns) for q in queries))
+
+
+# === Sync bridge ===
+def _get_bridge_loop():
+    global _bridge_loop
+    if _bridge_loop is None:
+        with _bridge_lock:
+            if _bridge_loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="async-postgres", daemon=True).start()
+                _bridge_loop = loop
+    return _bridge_loop
+
+
+def run_sync(coro, timeout: float = None):
+    """Run a coroutine on the shared background loop and wait for its result (for synchronous callers)."""
+    return asyncio.run_coroutine_threadsafe(coro, _get_bridge_loop()).result(timeout)
+
+
+def run_queries(*queries, return_columns: bool = False):
+    """Blocking wrapper around gather_queries."""
+    return run_sync(gather_queries(*queries, return_columns=return_columns))
+
+
+def close_async_pools():
+    for pool in list(_pools.values()):
+        pool.close()
+
+
+atexit.register(close_async_pools)
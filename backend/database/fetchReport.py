@@ -0,0 +1,103 @@
+import os
+import sys
+import json
+import time
+import resource
+import subprocess
+import pandas as pd
+from database.postgres import connection, run_query, fetch_frame, fetch_arrow
+
+# Benchmark of fetching a large result into a DataFrame:
+#   rows     - run_query (tuples of Decimal/datetime) + pd.DataFrame + astype(float)
+#   columnar - fetch_frame (binary COPY decoded into NumPy arrays)
+#   arrow    - fetch_arrow (the same arrays as a pyarrow Table)
+# Each mode runs in its own process so its peak memory is measured separately.
+# Run from backend/:  python -m database.fetchReport
+
+BENCHMARK_ROWS = int(os.getenv("FETCH_BENCHMARK_ROWS", "5000000"))
+BENCHMARK_TABLE = "floatchat.fetch_benchmark"
+QUERY = f"SELECT time, latitude, longitude, depth, temperature, salinity FROM {BENCHMARK_TABLE}"
+REPORT_PATH = "fetch_report.json"
+MODES = ["rows", "columnar", "arrow"]
+
+
+def fetch_rows():
+    rows, columns = run_query(QUERY, return_columns=True, use_cache=False)
+    df = pd.DataFrame(rows, columns=columns)
+    for col in columns[1:]:
+        df[col] = df[col].astype(float)
+    df["time"] = pd.to_datetime(df["time"])
+    return df
+
+
+FETCHERS = {
+    "rows": fetch_rows,
+    "columnar": lambda: fetch_frame(QUERY),
+    "arrow": lambda: fetch_arrow(QUERY),
+}
+
+
+def run_mode(mode):
+    """Runs in a child process: fetch once and report time and peak RSS."""
+    started = time.perf_counter()
+    result = FETCHERS[mode]()
+    seconds = time.perf_counter() - started
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+    return {"seconds": round(seconds, 2), "peak_rss_mb": round(peak_mb, 1), "rows": len(result)}
+
+
+def create_benchmark_table(n_rows):
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"DROP TABLE IF EXISTS {BENCHMARK_TABLE};")
+        cur.execute(f"""
+        CREATE UNLOGGED TABLE {BENCHMARK_TABLE} AS
+        SELECT timestamp '2000-01-01' + (i / 50) * interval '6 hours' AS time,
+               round((random() * 180 - 90)::numeric, 4)::NUMERIC(10,4) AS latitude,
+               round((random() * 360 - 180)::numeric, 4)::NUMERIC(10,4) AS longitude,
+               ((i %% 50) * 10)::NUMERIC(10,4) AS depth,
+               round((random() * 30)::numeric, 4)::NUMERIC(10,4) AS temperature,
+               round((30 + random() * 10)::numeric, 4)::NUMERIC(10,4) AS salinity
+        FROM generate_series(1, %s) AS i;
+        """, (n_rows,))
+        cur.execute(f"ANALYZE {BENCHMARK_TABLE};")
+        conn.commit()
+
+
+def drop_benchmark_table():
+    with connection() as conn:
+        conn.cursor().execute(f"DROP TABLE IF EXISTS {BENCHMARK_TABLE};")
+        conn.commit()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        print(json.dumps(run_mode(sys.argv[1])))
+        sys.exit(0)
+
+    print(f"⏳ Creating {BENCHMARK_TABLE} with {BENCHMARK_ROWS:,} rows...")
+    create_benchmark_table(BENCHMARK_ROWS)
+
+    same = fetch_rows().astype({"time": "datetime64[us]"}).equals(fetch_frame(QUERY)) \
+        if BENCHMARK_ROWS <= 1000000 else None
+
+    report = {"rows": BENCHMARK_ROWS, "identical_frames": same, "modes": {}}
+    try:
+        for mode in MODES:
+            print(f"⏱️ {mode}...")
+            out = subprocess.run([sys.executable, "-m", "database.fetchReport", mode],
+                                 capture_output=True, text=True, check=True)
+            report["modes"][mode] = json.loads(out.stdout.strip().splitlines()[-1])
+    finally:
+        drop_benchmark_table()
+
+    print(f"\n📊 Fetching {BENCHMARK_ROWS:,} rows into a DataFrame:")
+    print(f"{'mode':<10}{'seconds':>10}{'peak RSS MB':>14}")
+    for mode, entry in report["modes"].items():
+        print(f"{mode:<10}{entry['seconds']:>10.2f}{entry['peak_rss_mb']:>14.1f}")
+    if same is not None:
+        print(f"rows and columnar frames identical: {same}")
+
+    with open(REPORT_PATH, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n📝 Report written to {REPORT_PATH}")
@@ -1,7 +1,18 @@
 import os
+import json
+import time
+import uuid
+import atexit
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 from dotenv import load_dotenv
+import numpy as np
+import pandas as pd
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+from database.queryCache import QueryCache
+from database.sqlParser import parse_sql, to_sql, walk, AGGREGATES
 
 # Load environment variables from .env (assumes .env is in parent folder)
 env_path = Path(__file__).resolve().parent.parent / ".env"
@@ -13,43 +24,610 @@ DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_PORT = os.getenv("DB_PORT", "5432")
 
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "2"))  # connections kept open between queries
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))  # concurrent connections; further callers wait
+DB_POOL_CHECK_AFTER = float(os.getenv("DB_POOL_CHECK_AFTER", "30"))  # idle seconds before a checkout is pinged
+DB_FETCH_BATCH_SIZE = int(os.getenv("DB_FETCH_BATCH_SIZE", "10000"))  # rows per batch for stream_query
 
-def run_query(query: str, return_columns: bool = False):
+# Cost guard for generated queries (see check_query)
+QUERY_TIMEOUT_MS = int(os.getenv("QUERY_TIMEOUT_MS", "30000"))  # statement_timeout for guarded queries
+QUERY_MAX_ROWS = int(os.getenv("QUERY_MAX_ROWS", "1000000"))  # estimated result rows
+QUERY_MAX_COST = float(os.getenv("QUERY_MAX_COST", "2000000"))  # planner cost units
+QUERY_AUTO_LIMIT = os.getenv("QUERY_AUTO_LIMIT", "1") == "1"  # LIMIT large results instead of rejecting them
+
+# Downsampling of oversized results (see downsample_query)
+QUERY_DOWNSAMPLE = os.getenv("QUERY_DOWNSAMPLE", "grid")  # "grid" (aggregate, else sample), "sample" or "off"
+QUERY_DOWNSAMPLE_ROWS = int(os.getenv("QUERY_DOWNSAMPLE_ROWS", "200000"))  # estimated rows that trigger it
+QUERY_GRID_DEGREES = float(os.getenv("QUERY_GRID_DEGREES", "1"))  # latitude/longitude cell size
+QUERY_GRID_DEPTH = float(os.getenv("QUERY_GRID_DEPTH", "50"))  # depth bin in metres
+QUERY_GRID_TIME = os.getenv("QUERY_GRID_TIME", "month")  # date_trunc unit
+QUERY_SAMPLE_SEED = 42  # REPEATABLE seed: the same data gives the same sample
+
+# One pool per process, shared by every Streamlit session (each runs in its own thread)
+_pool = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+_last_used = {}
+
+
+def _get_pool():
+    """Create the pool on first use; a failed attempt is retried on the next call."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadedConnectionPool(
+                    DB_POOL_MIN,
+                    DB_POOL_MAX,
+                    dbname=DB_NAME,
+                    user=DB_USER,
+                    password=DB_PASSWORD,
+                    host=DB_HOST,
+                    port=DB_PORT
+                )
+    return _pool
+
+
+def _healthy(conn, ping=False):
+    """A connection idle for longer than DB_POOL_CHECK_AFTER (or any, with ping=True) is pinged before reuse."""
+    if conn.closed:
+        return False
+    if not ping and time.monotonic() - _last_used.get(id(conn), 0) < DB_POOL_CHECK_AFTER:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1;")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+@contextmanager
+def connection(ping=False):
+    """
+    Check a healthy connection out of the pool and give it back afterwards.
+    Broken connections are closed and replaced with new ones; the open
+    transaction is always rolled back before the connection is reused.
+    ping=True health-checks the connection even if it was used recently.
+    """
+    _slots.acquire()
+    conn = None
+    try:
+        pool = _get_pool()
+        for _ in range(DB_POOL_MAX + 1):
+            conn = pool.getconn()
+            if _healthy(conn, ping):
+                break
+            _last_used.pop(id(conn), None)
+            pool.putconn(conn, close=True)
+            conn = None
+        if conn is None:
+            raise psycopg2.OperationalError("No healthy database connection available")
+        yield conn
+    finally:
+        if conn is not None:
+            if not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    conn.close()
+            _last_used[id(conn)] = time.monotonic()
+            pool.putconn(conn, close=bool(conn.closed))
+            if conn.closed:  # broken, or beyond DB_POOL_MIN idle connections
+                _last_used.pop(id(conn), None)
+        _slots.release()
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+atexit.register(close_pool)
+
+
+# === Result cache ===
+DATA_VERSION_TABLE = "floatchat.data_version"  # bumped by the loaders in preprocessing/CSV_to_SQL.py
+
+
+def data_version():
+    """Current data version, or 0 if nothing has been loaded since versioning was added."""
+    with connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute(f"SELECT version FROM {DATA_VERSION_TABLE} WHERE id = 1;")
+        except psycopg2.errors.UndefinedTable:
+            return 0
+        row = cur.fetchone()
+        cur.close()
+    return row[0] if row else 0
+
+
+# Shared by every session in the process; see database/queryCache.py for the settings
+query_cache = QueryCache(version=data_version)
+
+
+def run_query(query: str, return_columns: bool = False, use_cache: bool = True):
     """
     Execute a SQL query on PostgreSQL and return results.
 
     Args:
         query (str): SQL query string
         return_columns (bool): If True, also return column names
+        use_cache (bool): If True, read-only queries are answered from and
+            stored in the result cache (query_cache)
 
     Returns:
         list of tuples (rows), or (rows, columns) if return_columns=True
     """
+    cached = query_cache.get(query) if use_cache else None
+    if cached is not None:
+        rows, columns = cached
+        return (list(rows), columns) if return_columns else list(rows)
+
     try:
-        # Connect using environment variables
-        conn = psycopg2.connect(
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            host=DB_HOST,
-            port=DB_PORT
-        )
+        for attempt in range(2):
+            # after a dropped connection the other idle ones are suspect too
+            with connection(ping=attempt > 0) as conn:
+                try:
+                    cur = conn.cursor()
+                    cur.execute(query)
 
+                    rows = cur.fetchall()
+                    columns = [desc[0] for desc in cur.description]
+
+                    cur.close()
+                    if use_cache:
+                        query_cache.put(query, (rows, columns))
+                        rows = list(rows)  # callers may modify their copy
+
+                    if return_columns:
+                        return rows, columns
+                    return rows
+                except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                    # the server dropped the connection mid-query: retry once on a fresh one
+                    if not conn.closed or attempt:
+                        raise
+
+    except Exception as e:
+        return f"PostgreSQL Error: {e}"
+
+
+def stream_query(query: str, return_columns: bool = False, batch_size: int = DB_FETCH_BATCH_SIZE,
+                 as_frame: bool = False, timeout_ms: int = None):
+    """
+    Execute a SQL query through a named (server-side) cursor and yield the
+    result in batches, so memory stays bounded whatever the result size. The
+    pooled connection is held until the generator is exhausted or closed.
+
+    Args:
+        query (str): SQL query string (a single SELECT)
+        return_columns (bool): If True, also yield column names
+        batch_size (int): Rows fetched per round trip
+        as_frame (bool): If True, yield DataFrame chunks with column names
+        timeout_ms (int): statement_timeout for the query and each fetch
+
+    Yields:
+        list of tuples per batch, (rows, columns) if return_columns=True,
+        or a DataFrame if as_frame=True. Nothing is yielded for an empty result.
+
+    Raises:
+        psycopg2.Error if the query fails.
+    """
+    with connection() as conn:
+        if timeout_ms:
+            with conn.cursor() as setup:
+                setup.execute("SET LOCAL statement_timeout = %s;", (int(timeout_ms),))
+        cur = conn.cursor(name=f"stream_{uuid.uuid4().hex}")
+        try:
+            cur.execute(query)
+            columns = None
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                if columns is None:
+                    columns = [desc[0] for desc in cur.description]
+                if as_frame:
+                    yield pd.DataFrame(rows, columns=columns)
+                elif return_columns:
+                    yield rows, columns
+                else:
+                    yield rows
+        finally:
+            try:
+                cur.close()
+            except psycopg2.Error:
+                pass  # the transaction is rolled back when the connection is returned
+
+
+# === Cost guard (EXPLAIN-based admission control) ===
+def explain_query(query: str):
+    """
+    Planner estimates for a query without running it: the top plan node's
+    estimated rows and total cost, and the tables read with a sequential scan.
+
+    Raises:
+        psycopg2.Error if the query cannot be planned.
+    """
+    with connection() as conn:
         cur = conn.cursor()
-        cur.execute(query)
+        cur.execute("SET LOCAL statement_timeout = %s;", (QUERY_TIMEOUT_MS,))
+        cur.execute(f"EXPLAIN (FORMAT JSON) {query.strip().rstrip(';')};")
+        plan = cur.fetchone()[0]
+        cur.close()
+    return plan_summary(plan)
+
 
-        rows = cur.fetchall()
-        columns = [desc[0] for desc in cur.description] if return_columns else None
+def plan_summary(plan):
+    """Estimated rows, total cost and sequentially scanned tables of an EXPLAIN (FORMAT JSON) result."""
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    root = plan[0]["Plan"]
 
+    seq_scans, nodes = [], [root]
+    while nodes:
+        node = nodes.pop()
+        if node.get("Node Type") == "Seq Scan":
+            seq_scans.append(node.get("Relation Name"))
+        nodes.extend(node.get("Plans", []))
+    return {"rows": int(root["Plan Rows"]), "cost": float(root["Total Cost"]),
+            "seq_scans": sorted(set(seq_scans))}
+
+
+def check_query(query: str, max_rows: int = QUERY_MAX_ROWS, max_cost: float = QUERY_MAX_COST,
+                auto_limit: bool = QUERY_AUTO_LIMIT, downsample: str = QUERY_DOWNSAMPLE,
+                downsample_rows: int = QUERY_DOWNSAMPLE_ROWS):
+    """
+    Decide from EXPLAIN estimates whether a generated query may run.
+
+    A query estimated to return more than downsample_rows rows is rewritten
+    into a grid aggregate or a sample (see downsample_query) unless
+    downsample="off". A query still estimated to return more than max_rows
+    rows is wrapped in a LIMIT (auto_limit=True) or rejected; a query whose
+    estimated cost, after any rewrite, is above max_cost is rejected.
+    Estimates come from the planner's statistics and can be off, so queries
+    that are admitted still run with statement_timeout = QUERY_TIMEOUT_MS.
+
+    Returns:
+        dict with "decision" ("run", "limit" or "reject"), "query" (the query
+        to execute), "full_query" (the query as generated), "downsampled"
+        (None, "grid" or "sample"), "estimated_rows", "estimated_cost",
+        "full_estimated_rows", "seq_scans", "reasons" (list of str) and
+        "message" (a sentence for the UI)
+    """
+    query = query.strip().rstrip(";")
+    result = {"decision": "run", "query": query, "full_query": query, "downsampled": None,
+              "estimated_rows": None, "estimated_cost": None, "full_estimated_rows": None,
+              "seq_scans": [], "reasons": [], "timeout_ms": QUERY_TIMEOUT_MS}
+    try:
+        plan = explain_query(query)
+    except psycopg2.Error as e:
+        error = str(e).strip().splitlines()[0]
+        result.update(decision="reject", reasons=[f"the query could not be planned: {error}"])
+        result["message"] = "Query rejected: " + result["reasons"][0]
+        return result
+    result.update(estimated_rows=plan["rows"], estimated_cost=plan["cost"], seq_scans=plan["seq_scans"],
+                  full_estimated_rows=plan["rows"])
+
+    if downsample != "off" and plan["rows"] > downsample_rows:
+        full_rows = plan["rows"]
+        rewritten, how = downsample_query(query, full_rows, downsample, downsample_rows)
+        try:
+            if rewritten is not None:
+                plan = explain_query(rewritten)
+                if how == "grid" and plan["rows"] > max_rows:
+                    # a grid too fine for the data: a sample beats cutting it off with a LIMIT
+                    sampled = sample_query(query, full_rows, downsample_rows)
+                    if sampled is not None:
+                        rewritten, how, plan = sampled, "sample", explain_query(sampled)
+                result.update(query=rewritten, downsampled=how, estimated_rows=plan["rows"],
+                              estimated_cost=plan["cost"])
+                query = rewritten
+        except psycopg2.Error as e:
+            print(f"⚠️ Could not downsample the query: {str(e).strip().splitlines()[0]}")
+
+    if plan["rows"] > max_rows:
+        result["reasons"].append(f"about {plan['rows']:,} rows estimated (limit {max_rows:,})")
+        if auto_limit:
+            limited = f"SELECT * FROM ({query}) AS result LIMIT {int(max_rows)}"
+            try:
+                plan = explain_query(limited)
+            except psycopg2.Error as e:
+                plan["cost"] = float("inf")
+                error = str(e).strip().splitlines()[0]
+                result["reasons"].append(f"the limited query could not be planned: {error}")
+            result.update(decision="limit", query=limited, estimated_cost=plan["cost"],
+                          estimated_rows=min(result["estimated_rows"], max_rows))
+        else:
+            result["decision"] = "reject"
+
+    if plan["cost"] > max_cost:
+        result["decision"] = "reject"
+        scans = f", full scan of {', '.join(plan['seq_scans'])}" if plan["seq_scans"] else ""
+        result["reasons"].append(f"estimated cost {plan['cost']:,.0f} (limit {max_cost:,.0f}{scans})")
+
+    reasons = "; ".join(result["reasons"])
+    if result["decision"] == "reject":
+        result["message"] = (f"Query rejected: {reasons}. "
+                             "Narrow it down with a depth, latitude/longitude or time filter.")
+    elif result["downsampled"]:
+        result["message"] = downsample_message(result["downsampled"], result["full_estimated_rows"],
+                                               downsample_rows)
+        if result["decision"] == "limit":
+            result["message"] += f" Limited to the first {int(max_rows):,} rows: {reasons}."
+    elif result["decision"] == "limit":
+        result["message"] = f"Result limited to the first {int(max_rows):,} rows: {reasons}."
+    else:
+        result["message"] = (f"Estimated {plan['rows']:,} rows at cost {plan['cost']:,.0f}; "
+                             f"running with a {QUERY_TIMEOUT_MS / 1000:g} s timeout.")
+    return result
+
+
+# === Columnar fetch (binary COPY decoded straight into NumPy arrays) ===
+# Result columns are cast on the server to fixed-width binary types (float8, or
+# timestamp as int8 microseconds since 2000-01-01), with NULLs replaced by NaN /
+# -infinity. Every row then has the same byte layout and the whole COPY stream
+# is decoded with one structured np.frombuffer per block, without creating a
+# Python object per cell.
+
+FLOAT_TYPES = {700, 701, 1700}  # float4, float8, numeric
+INT_TYPES = {20, 21, 23}  # int8, int2, int4
+TIME_TYPES = {1082: "::timestamp", 1114: "", 1184: " AT TIME ZONE 'UTC'"}  # date, timestamp, timestamptz
+COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+PG_EPOCH_US = 946684800000000  # 2000-01-01 in microseconds since 1970-01-01
+
+
+class _FixedRowSink:
+    """File-like target for copy_expert that decodes fixed-size binary COPY rows as they arrive."""
+
+    def __init__(self, n_columns, block_size=1 << 23):
+        fields = [("n", ">i2")]
+        for i in range(n_columns):
+            fields += [(f"l{i}", ">i4"), (f"v{i}", ">i8")]
+        self.dtype = np.dtype(fields)
+        self.n_columns = n_columns
+        self.block_size = block_size
+        self.pending = bytearray()
+        self.header_done = False
+        self.blocks = []
+
+    def write(self, data):
+        self.pending += data
+        if len(self.pending) >= self.block_size:
+            self._decode()
+
+    def _decode(self):
+        if not self.header_done:
+            if len(self.pending) < 19:
+                return
+            if bytes(self.pending[:11]) != COPY_SIGNATURE:
+                raise ValueError("Unexpected COPY BINARY header")
+            ext = int.from_bytes(self.pending[15:19], "big")
+            del self.pending[:19 + ext]
+            self.header_done = True
+        n_rows = len(self.pending) // self.dtype.itemsize
+        if n_rows:
+            size = n_rows * self.dtype.itemsize
+            block = np.frombuffer(bytes(self.pending[:size]), dtype=self.dtype)
+            del self.pending[:size]
+            if not ((block["n"] == self.n_columns).all()
+                    and all((block[f"l{i}"] == 8).all() for i in range(self.n_columns))):
+                raise ValueError("Unexpected row layout in COPY BINARY stream")
+            self.blocks.append(block)
+
+    def finish(self):
+        self._decode()
+        if bytes(self.pending) != b"\xff\xff":
+            raise ValueError("Truncated COPY BINARY stream")
+        if not self.blocks:
+            return np.empty(0, dtype=self.dtype)
+        return np.concatenate(self.blocks)
+
+
+def fetch_columns(query: str, timeout_ms: int = None):
+    """
+    Execute a SQL query and return its result as typed columns: a dict of
+    column name -> NumPy array (float64 for numeric columns, int64 for integer
+    columns without NULLs, datetime64[us] for timestamps, NaN/NaT for NULLs).
+    Results with other column types (text, boolean, ...) or duplicate column
+    names are fetched row by row instead, with numeric columns still as float64.
+    Repeated names get a suffix (avg, avg_1, ...), so no column is lost.
+    timeout_ms sets statement_timeout for the query.
+
+    Raises:
+        psycopg2.Error if the query fails.
+    """
+    inner = query.strip().rstrip(";")
+    with connection() as conn:
+        cur = conn.cursor()
+        if timeout_ms:
+            cur.execute("SET LOCAL statement_timeout = %s;", (int(timeout_ms),))
+        cur.execute(f"SELECT * FROM ({inner}) AS result LIMIT 0;")
+        columns = [(desc[0], desc[1]) for desc in cur.description]
+        names = [name for name, _ in columns]
+        supported = FLOAT_TYPES | INT_TYPES | set(TIME_TYPES)
+        if len(set(names)) != len(names) or any(oid not in supported for _, oid in columns):
+            return _fetch_columns_by_row(cur, inner, columns)
+
+        select = []
+        for name, oid in columns:
+            col = '"' + name.replace('"', '""') + '"'
+            if oid in TIME_TYPES:
+                select.append(f"COALESCE(({col}{TIME_TYPES[oid]})::timestamp, '-infinity')")
+            else:
+                select.append(f"COALESCE({col}::float8, 'NaN')")
+        sink = _FixedRowSink(len(columns))
+        cur.copy_expert(f"COPY (SELECT {', '.join(select)} FROM ({inner}) AS result) TO STDOUT WITH (FORMAT binary)",
+                        sink)
         cur.close()
-        conn.close()
+    rows = sink.finish()
 
-        if return_columns:
-            return rows, columns
-        return rows
+    result = {}
+    for i, (name, oid) in enumerate(columns):
+        raw = rows[f"v{i}"].astype(np.int64)  # native byte order
+        if oid in TIME_TYPES:
+            us = raw
+            invalid = (us == np.iinfo(np.int64).min) | (us == np.iinfo(np.int64).max)  # NULL / +-infinity
+            values = np.where(invalid, 0, us + PG_EPOCH_US).astype("datetime64[us]")
+            values[invalid] = np.datetime64("NaT")
+        else:
+            values = raw.view(np.float64)
+            if oid in INT_TYPES and not np.isnan(values).any():
+                values = values.astype(np.int64)
+        result[name] = values
+    return result
 
-    except Exception as e:
-        return f"PostgreSQL Error: {e}"
+
+def _unique_names(names):
+    """Column names with repeats suffixed: ["avg", "avg"] -> ["avg", "avg_1"]."""
+    taken, unique = set(names), []
+    seen = set()
+    for name in names:
+        if name in seen:
+            n = 1
+            while f"{name}_{n}" in taken:
+                n += 1
+            name = f"{name}_{n}"
+            taken.add(name)
+        seen.add(name)
+        unique.append(name)
+    return unique
+
+
+def _fetch_columns_by_row(cur, query, columns):
+    cur.execute(query)
+    rows = cur.fetchall()
+    cur.close()
+    result = {}
+    names = _unique_names([name for name, _ in columns])
+    for i, (name, (_, oid)) in enumerate(zip(names, columns)):
+        values = [row[i] for row in rows]
+        if oid in FLOAT_TYPES:
+            result[name] = np.array([np.nan if v is None else float(v) for v in values], dtype=np.float64)
+        else:
+            result[name] = pd.Series(values, dtype=object).infer_objects().to_numpy()
+    return result
+
+
+def fetch_frame(query: str, timeout_ms: int = None) -> pd.DataFrame:
+    """Execute a SQL query and return a DataFrame built from typed columns (see fetch_columns)."""
+    return pd.DataFrame(fetch_columns(query, timeout_ms), copy=False)
+
+
+def fetch_arrow(query: str):
+    """Execute a SQL query and return a pyarrow Table built from typed columns (see fetch_columns)."""
+    try:
+        import pyarrow as pa
+    except ImportError as e:
+        raise ImportError("Arrow results need pyarrow: pip install pyarrow") from e
+    return pa.table(fetch_columns(query))
+
+
+# === Downsampling (grid aggregate or sample of an oversized result) ===
+def describe_query(query: str):
+    """(name, type OID) of each column a query returns, without running it."""
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"SELECT * FROM ({query.strip().rstrip(';')}) AS result LIMIT 0;")
+        columns = [(desc[0], desc[1]) for desc in cur.description]
+        cur.close()
+    return columns
+
+
+def grid_query(query: str, degrees: float = QUERY_GRID_DEGREES, depth_bin: float = QUERY_GRID_DEPTH,
+               time_unit: str = QUERY_GRID_TIME):
+    """
+    Rewrite a query into an aggregate over a latitude/longitude/depth/time
+    grid. Rows are grouped by the cell of each of those columns the result
+    has; latitude, longitude and depth report the mean position within the
+    cell, time the start of its period. Every other column gets avg (under
+    its own name), min_<column> and max_<column>, and n_obs counts the rows
+    per cell. Returns None if the result has no grid column or has
+    non-numeric columns.
+    """
+    keys, select = [], []
+    for name, oid in describe_query(query):
+        col = '"' + name.replace('"', '""') + '"'
+        if oid in TIME_TYPES:
+            expr = f"date_trunc('{time_unit}', {col}{TIME_TYPES[oid]})"
+            keys.append(expr)
+            select.append(f"{expr} AS {col}")
+        elif oid not in FLOAT_TYPES | INT_TYPES:
+            return None
+        elif name in ("latitude", "longitude", "depth"):
+            step = depth_bin if name == "depth" else degrees
+            keys.append(f"floor({col}::float8 / {step})")
+            select.append(f"avg({col}::float8) AS {col}")
+        else:
+            select += [f"avg({col}::float8) AS {col}", f'min({col}) AS "min_{name}"', f'max({col}) AS "max_{name}"']
+    if not keys:
+        return None
+    select.append("count(*) AS n_obs")
+    group_by = ", ".join(keys)
+    return (f"SELECT {', '.join(select)} FROM ({query.strip().rstrip(';')}) AS result "
+            f"GROUP BY {group_by} ORDER BY {group_by}")
+
+
+def sample_query(query: str, estimated_rows: int, target_rows: int = QUERY_DOWNSAMPLE_ROWS):
+    """
+    Rewrite a query to read a deterministic row sample (TABLESAMPLE BERNOULLI
+    ... REPEATABLE) of the table in its FROM clause, sized for about
+    target_rows rows. Returns None if the query cannot be parsed, does not
+    read directly from a table, or aggregates (GROUP BY, HAVING, DISTINCT,
+    aggregate functions), whose counts and sums a sample would scale down.
+    """
+    try:
+        statement = parse_sql(query)
+    except ValueError:
+        return None
+    item = statement["from"]
+    if item is None or item["type"] != "table" or estimated_rows <= 0:
+        return None
+    if statement["group_by"] or statement["having"] or statement["distinct"] or any(
+            node["type"] == "function" and node["name"] in AGGREGATES
+            for column in statement["columns"] for node in walk(column["expr"])):
+        return None
+    if any(name == item["table"] for name, _ in statement["with"]):
+        return None  # a CTE cannot be sampled
+    percent = min(100.0, 100.0 * target_rows / estimated_rows)
+    sampled = {**item, "tablesample": f"BERNOULLI ({percent:.6g}) REPEATABLE ({QUERY_SAMPLE_SEED})"}
+    return to_sql({**statement, "from": sampled}) + ";"
+
+
+def downsample_query(query: str, estimated_rows: int, mode: str = QUERY_DOWNSAMPLE,
+                     target_rows: int = QUERY_DOWNSAMPLE_ROWS):
+    """
+    Smaller stand-in for a query estimated to return estimated_rows rows:
+    mode "grid" tries grid_query and falls back to sample_query, mode
+    "sample" uses sample_query only. Returns (query, "grid" or "sample"), or
+    (None, None) if neither applies.
+    """
+    if mode == "grid":
+        try:
+            rewritten = grid_query(query)
+        except psycopg2.Error:
+            rewritten = None
+        if rewritten is not None:
+            return rewritten, "grid"
+    if mode in ("grid", "sample"):
+        rewritten = sample_query(query, estimated_rows, target_rows)
+        if rewritten is not None:
+            return rewritten, "sample"
+    return None, None
+
+
+def downsample_message(how: str, full_rows: int, target_rows: int = QUERY_DOWNSAMPLE_ROWS):
+    if how == "grid":
+        return (f"About {full_rows:,} rows match, so the result is aggregated on a {QUERY_GRID_DEGREES:g}° × "
+                f"{QUERY_GRID_DEGREES:g}° × {QUERY_GRID_DEPTH:g} m × {QUERY_GRID_TIME} grid "
+                "(mean, min and max per cell; n_obs rows each). The full data can be downloaded separately.")
+    return (f"About {full_rows:,} rows match, so the result is a repeatable random sample of about "
+            f"{target_rows:,} rows. The full data can be downloaded separately.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,296 @@
+import os
+import re
+import sys
+import time
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+from decimal import Decimal, InvalidOperation
+import pandas as pd
+
+# Result cache for read-only queries, keyed on normalized SQL text.
+# Entries live in memory under a byte budget with LRU eviction and a TTL, and
+# optionally in a directory of pickles shared by every process (the disk
+# tier). Each entry records the data version it was computed under; the
+# loaders in preprocessing/ bump that version (see mark_data_changed in
+# CSV_to_SQL.py), which invalidates everything cached before the load.
+
+QUERY_CACHE = os.getenv("QUERY_CACHE", "1") == "1"
+QUERY_CACHE_MB = float(os.getenv("QUERY_CACHE_MB", "256"))  # memory budget
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "3600"))  # seconds an entry stays valid
+QUERY_CACHE_DIR = os.getenv("QUERY_CACHE_DIR", "")  # empty = no disk tier
+QUERY_CACHE_DISK_MB = float(os.getenv("QUERY_CACHE_DISK_MB", "1024"))
+QUERY_CACHE_VERSION_CHECK = float(os.getenv("QUERY_CACHE_VERSION_CHECK", "5"))  # seconds between version reads
+
+_TOKEN = re.compile(r"""
+      (?P<space>\s+)
+    | (?P<comment>--[^\n]*|/\*.*?\*/)
+    | (?P<string>(?:[EeBbXxNn]|[Uu]&)?'(?:[^']|'')*')
+    | (?P<dollar>\$(?P<tag>[A-Za-z_]*)\$.*?\$(?P=tag)\$)
+    | (?P<ident>"(?:[^"]|"")*")
+    | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+    | (?P<word>[A-Za-z_][A-Za-z_0-9$]*)
+    | (?P<op>[<>=!~+\-*/%^|&#@?:]+)
+    | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+
+READ_ONLY_STARTS = {"select", "with", "values", "table"}
+WRITE_WORDS = {"insert", "update", "delete", "merge", "into", "create", "alter", "drop", "truncate", "grant",
+               "revoke", "copy", "call", "do", "lock", "set", "vacuum", "analyze", "refresh", "nextval",
+               "setval"}
+VOLATILE_WORDS = {"now", "random", "clock_timestamp", "statement_timestamp", "transaction_timestamp",
+                  "timeofday", "current_date", "current_time", "current_timestamp", "localtime",
+                  "localtimestamp", "gen_random_uuid", "pg_sleep", "txid_current"}
+
+
+def _number(text):
+    """Canonical spelling of a numeric literal that keeps integer and decimal literals apart."""
+    if re.fullmatch(r"\d+", text):
+        return str(int(text))
+    try:
+        value = format(Decimal(text).normalize(), "f")
+    except InvalidOperation:
+        return text
+    return value if "." in value else value + ".0"
+
+
+def tokenize_sql(query: str):
+    """(kind, text) tokens of a query with whitespace and comments dropped."""
+    tokens = []
+    for m in _TOKEN.finditer(query):
+        kind = m.lastgroup if m.lastgroup != "tag" else "dollar"
+        if kind in ("space", "comment"):
+            continue
+        text = m.group(kind)
+        if kind == "word":
+            text = text.lower()  # unquoted identifiers and keywords are case-insensitive
+        elif kind == "number":
+            text = _number(text)
+        tokens.append((kind, text))
+    while tokens and tokens[-1] == ("other", ";"):
+        tokens.pop()
+    return tokens
+
+
+def normalize_sql(query: str) -> str:
+    """
+    Canonical form of a query for cache keys: comments dropped, whitespace
+    collapsed, keywords and unquoted identifiers lower-cased, numeric literals
+    spelled canonically (010 -> 10, 8.50 -> 8.5). String literals and quoted
+    identifiers are kept as written.
+    """
+    return " ".join(text for _, text in tokenize_sql(query))
+
+
+def is_cacheable(query: str) -> bool:
+    """Only read-only queries without volatile functions are cached."""
+    words = [text for kind, text in tokenize_sql(query) if kind == "word"]
+    if not words or words[0] not in READ_ONLY_STARTS:
+        return False
+    return not any(w in WRITE_WORDS or w in VOLATILE_WORDS for w in words)
+
+
+def estimate_size(value) -> int:
+    """Approximate memory footprint in bytes of a cached result."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True, index=True).sum())
+    if isinstance(value, tuple):
+        return sum(estimate_size(v) for v in value)
+    if isinstance(value, list):
+        sample = value[:100]
+        per_item = sum(sys.getsizeof(row) + sum(sys.getsizeof(v) for v in (row if isinstance(row, tuple) else ()))
+                       for row in sample) / len(sample) if sample else 0
+        return int(sys.getsizeof(value) + per_item * len(value))
+    return sys.getsizeof(value)
+
+
+class QueryCache:
+    """
+    LRU cache of query results under a memory budget (max_mb) with a TTL, and
+    an optional disk tier (disk_dir) that survives restarts and is shared
+    between processes. `version` is a callable returning the current data
+    version; it is polled at most every version_check seconds and a change
+    drops every entry computed under an older version.
+    """
+
+    def __init__(self, max_mb=QUERY_CACHE_MB, ttl=QUERY_CACHE_TTL, disk_dir=QUERY_CACHE_DIR,
+                 disk_max_mb=QUERY_CACHE_DISK_MB, version=None, version_check=QUERY_CACHE_VERSION_CHECK,
+                 enabled=QUERY_CACHE):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.ttl = ttl
+        self.disk_dir = disk_dir or None
+        self.disk_max_bytes = int(disk_max_mb * 1024 * 1024)
+        self.version_source = version
+        self.version_check = version_check
+        self.enabled = enabled
+        self.entries = OrderedDict()  # key -> (value, size, created, version)
+        self.bytes = 0
+        self.version = None
+        self.version_checked = 0.0
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "disk_hits": 0, "misses": 0, "puts": 0, "skipped": 0, "evictions": 0,
+                         "expirations": 0, "invalidations": 0}
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @staticmethod
+    def key(query: str, kind: str = "rows") -> str:
+        """Cache key of a query; `kind` separates different shapes of the same result."""
+        return hashlib.sha256(f"{kind}\0{normalize_sql(query)}".encode()).hexdigest()
+
+    def _current_version(self):
+        now = time.monotonic()
+        if self.version_source is not None and now - self.version_checked >= self.version_check:
+            try:
+                version = self.version_source()
+            except Exception:
+                version = self.version  # keep serving under the last known version
+            self.version_checked = now
+            with self.lock:
+                if self.version is not None and version != self.version:
+                    self.counters["invalidations"] += len(self.entries)
+                    self.entries.clear()
+                    self.bytes = 0
+                self.version = version
+        return self.version
+
+    def accepts(self, query: str) -> bool:
+        return self.enabled and is_cacheable(query)
+
+    def get(self, query: str, kind: str = "rows", default=None):
+        """Cached result of `query`, or `default` on a miss."""
+        if not self.accepts(query):
+            return default
+        key = self.key(query, kind)
+        version = self._current_version()
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, size, created, entry_version = entry
+                if now - created <= self.ttl and entry_version == version:
+                    self.entries.move_to_end(key)
+                    self.counters["hits"] += 1
+                    return value
+                del self.entries[key]
+                self.bytes -= size
+                self.counters["expirations" if entry_version == version else "invalidations"] += 1
+
+        entry = self._disk_read(key, version, now)
+        if entry is not None:
+            value, created = entry
+            with self.lock:
+                self.counters["disk_hits"] += 1
+            self._store(key, value, estimate_size(value), created, version)
+            return value
+
+        with self.lock:
+            self.counters["misses"] += 1
+        return default
+
+    def put(self, query: str, value, kind: str = "rows"):
+        """Cache the result of `query`. Results larger than the whole budget are not cached."""
+        if not self.accepts(query):
+            return False
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            with self.lock:
+                self.counters["skipped"] += 1
+            return False
+        key = self.key(query, kind)
+        version = self._current_version()
+        created = time.time()
+        self._store(key, value, size, created, version)
+        self._disk_write(key, value, created, version)
+        with self.lock:
+            self.counters["puts"] += 1
+        return True
+
+    def _store(self, key, value, size, created, version):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self.entries[key] = (value, size, created, version)
+            self.bytes += size
+            while self.bytes > self.max_bytes and len(self.entries) > 1:
+                _, (_, evicted_size, _, _) = self.entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.counters["evictions"] += 1
+
+    # --- disk tier ---
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.pkl")
+
+    def _disk_read(self, key, version, now):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                entry = pickle.load(f)
+        except (OSError, pickle.PickleError, EOFError):
+            return None
+        if now - entry["created"] > self.ttl or entry["version"] != version:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry["value"], entry["created"]
+
+    def _disk_write(self, key, value, created, version):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump({"version": version, "created": created, "value": value}, f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+        self._disk_prune()
+
+    def _disk_prune(self):
+        """Delete the least recently written files until the disk tier fits its budget."""
+        files = []
+        for name in os.listdir(self.disk_dir):
+            if name.endswith(".pkl"):
+                try:
+                    st = os.stat(os.path.join(self.disk_dir, name))
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.disk_dir, name))
+                total -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        """Drop every entry, in memory and on disk."""
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+        if self.disk_dir:
+            for name in os.listdir(self.disk_dir):
+                if name.endswith(".pkl"):
+                    try:
+                        os.remove(os.path.join(self.disk_dir, name))
+                    except OSError:
+                        pass
+
+    def stats(self):
+        """Hit/miss counters plus the current size of the memory tier."""
+        with self.lock:
+            lookups = self.counters["hits"] + self.counters["disk_hits"] + self.counters["misses"]
+            return {**self.counters, "entries": len(self.entries), "bytes": self.bytes,
+                    "hit_rate": (self.counters["hits"] + self.counters["disk_hits"]) / lookups if lookups else 0.0,
+                    "data_version": self.version}
@@ -0,0 +1,286 @@
+import os
+import time
+import pickle
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from dotenv import load_dotenv
+import pandas as pd
+from database.queryCache import estimate_size
+
+# Per-session store of query results, so concurrent users of one process
+# never share a result file. Each result is keyed by (session id, turn id).
+# Results live in memory under one byte budget shared by every session; the
+# least recently used ones are spilled to files in RESULT_STORE_DIR (Parquet
+# when pyarrow is installed, pickle otherwise) and read back on the next
+# access. Entries not accessed for RESULT_STORE_TTL seconds are deleted, in
+# memory and on disk, by a background cleanup thread.
+
+env_path = Path(__file__).resolve().parent.parent / ".env"
+load_dotenv(dotenv_path=env_path)
+
+RESULT_STORE_MB = float(os.getenv("RESULT_STORE_MB", "512"))  # memory budget for all sessions
+RESULT_STORE_TTL = float(os.getenv("RESULT_STORE_TTL", "3600"))  # seconds since last access
+RESULT_STORE_DIR = os.getenv("RESULT_STORE_DIR") or os.path.join(tempfile.gettempdir(), "floatchat_results")
+RESULT_STORE_DISK_MB = float(os.getenv("RESULT_STORE_DISK_MB", "4096"))
+RESULT_STORE_CLEANUP = float(os.getenv("RESULT_STORE_CLEANUP", "60"))  # seconds between cleanup runs
+
+
+def _has_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class ResultStore:
+    """
+    Results (DataFrames) keyed by (session_id, turn_id) under a memory budget
+    (max_mb) with LRU eviction to disk (spill_dir) and a TTL on last access.
+    get() returns the result from memory or restores it from its spill file.
+    """
+
+    def __init__(self, max_mb=RESULT_STORE_MB, ttl=RESULT_STORE_TTL, spill_dir=RESULT_STORE_DIR,
+                 disk_max_mb=RESULT_STORE_DISK_MB, cleanup_interval=RESULT_STORE_CLEANUP):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.ttl = ttl
+        self.spill_dir = spill_dir
+        self.disk_max_bytes = int(disk_max_mb * 1024 * 1024)
+        self.cleanup_interval = cleanup_interval
+        self.parquet = _has_pyarrow()
+        self.entries = OrderedDict()  # key -> (df, size, last_used), least recently used first
+        self.bytes = 0
+        self.spilled = OrderedDict()  # key -> (path, size on disk, last_used), least recently used first
+        self.spilling = {}  # key -> df while its spill file is being written
+        self.lock = threading.Lock()
+        self.cleaner = None
+        self.stop_event = threading.Event()
+        self.counters = {"puts": 0, "hits": 0, "restores": 0, "misses": 0, "spills": 0, "spill_failures": 0,
+                         "expirations": 0, "disk_evictions": 0}
+        os.makedirs(self.spill_dir, exist_ok=True)
+
+    # --- public API ---
+    def put(self, session_id: str, turn_id, df: pd.DataFrame):
+        """Store the result of one turn of a session, replacing an earlier result of the same turn."""
+        key = (str(session_id), str(turn_id))
+        size = estimate_size(df)
+        self._discard_spill(key)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self.spilling.pop(key, None)  # an older result of this turn being written out is dropped
+            self.entries[key] = (df, size, time.time())
+            self.bytes += size
+            self.counters["puts"] += 1
+            evicted = self._over_budget()
+        self._spill(evicted)
+        self.start_cleanup()
+
+    def get(self, session_id: str, turn_id):
+        """Result of a turn, restored from disk if it was spilled; None if it expired or was never stored."""
+        key = (str(session_id), str(turn_id))
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                df, size, _ = entry
+                self.entries[key] = (df, size, now)
+                self.entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return df
+            if key in self.spilling:
+                self.counters["hits"] += 1
+                return self.spilling[key]
+            spilled = self.spilled.pop(key, None)
+            if spilled is None:
+                self.counters["misses"] += 1
+                return None
+
+        path = spilled[0]
+        df = self._read(path)
+        self._remove(path)
+        if df is None:
+            with self.lock:
+                self.counters["misses"] += 1
+            return None
+        with self.lock:
+            self.counters["restores"] += 1
+            if key in self.entries:  # stored again while the file was being read
+                return self.entries[key][0]
+            self.entries[key] = (df, estimate_size(df), now)
+            self.bytes += self.entries[key][1]
+            evicted = self._over_budget(keep=key)
+        self._spill(evicted)
+        return df
+
+    def drop_session(self, session_id: str):
+        """Forget every result of a session, in memory and on disk."""
+        session_id = str(session_id)
+        with self.lock:
+            for key in [k for k in self.entries if k[0] == session_id]:
+                self.bytes -= self.entries.pop(key)[1]
+            paths = [self.spilled.pop(k)[0] for k in list(self.spilled) if k[0] == session_id]
+        for path in paths:
+            self._remove(path)
+
+    def file_path(self, session_id: str, turn_id, suffix: str) -> str:
+        """A private path in the spill directory for files derived from a turn's result (e.g. an export)."""
+        return os.path.join(self.spill_dir, f"{self._name((str(session_id), str(turn_id)))}{suffix}")
+
+    def stats(self):
+        """Counters plus the current size of the memory and disk tiers."""
+        with self.lock:
+            return {**self.counters, "entries": len(self.entries), "bytes": self.bytes,
+                    "spilled": len(self.spilled), "spilled_bytes": sum(s for _, s, _ in self.spilled.values())}
+
+    # --- eviction and spill ---
+    def _over_budget(self, keep=None):
+        """
+        Pop least recently used entries until the memory tier fits its budget
+        (caller holds the lock). A result larger than the whole budget goes
+        straight to disk, except the one being restored (`keep`), which the
+        caller is about to use.
+        """
+        evicted = []
+        for key in list(self.entries):
+            if self.bytes <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            df, size, last_used = self.entries.pop(key)
+            self.bytes -= size
+            self.spilling[key] = df
+            evicted.append((key, df, last_used))
+        return evicted
+
+    def _name(self, key):
+        return hashlib.sha256("\0".join(key).encode()).hexdigest()
+
+    def _spill(self, evicted):
+        for key, df, last_used in evicted:
+            path = self._write(key, df)
+            with self.lock:
+                if self.spilling.get(key) is df:
+                    del self.spilling[key]
+                    if path is not None:
+                        self.spilled[key] = (path, os.path.getsize(path), last_used)
+                        self.counters["spills"] += 1
+                    else:
+                        self.counters["spill_failures"] += 1
+                    path = None  # registered, or nothing was written
+            if path is not None:
+                self._remove(path)  # the turn was stored again while this copy was being written
+        if evicted:
+            self._disk_prune()
+
+    def _write(self, key, df):
+        base = os.path.join(self.spill_dir, self._name(key))
+        if self.parquet:
+            try:
+                df.to_parquet(f"{base}.tmp", index=False)
+                os.replace(f"{base}.tmp", f"{base}.parquet")
+                return f"{base}.parquet"
+            except (ValueError, TypeError, OSError, ImportError):
+                pass  # e.g. object columns pyarrow cannot type; pickle keeps them as they are
+        try:
+            with open(f"{base}.tmp", "wb") as f:
+                pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(f"{base}.tmp", f"{base}.pkl")
+            return f"{base}.pkl"
+        except (OSError, pickle.PicklingError) as e:
+            print(f"⚠️ Could not spill a result to disk: {e}")
+            self._remove(f"{base}.tmp")
+            return None
+
+    @staticmethod
+    def _read(path):
+        try:
+            if path.endswith(".parquet"):
+                return pd.read_parquet(path)
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except (OSError, ValueError, pickle.UnpicklingError, EOFError) as e:
+            print(f"⚠️ Could not restore a spilled result: {e}")
+            return None
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _discard_spill(self, key):
+        with self.lock:
+            spilled = self.spilled.pop(key, None)
+        if spilled is not None:
+            self._remove(spilled[0])
+
+    def _disk_prune(self):
+        """Delete the least recently used spill files until the disk tier fits its budget."""
+        removed = []
+        with self.lock:
+            total = sum(size for _, size, _ in self.spilled.values())
+            while total > self.disk_max_bytes and self.spilled:
+                _, (path, size, _) = self.spilled.popitem(last=False)
+                total -= size
+                removed.append(path)
+                self.counters["disk_evictions"] += 1
+        for path in removed:
+            self._remove(path)
+
+    # --- expiry ---
+    def cleanup(self):
+        """Delete results not accessed for `ttl` seconds, and spill files no entry refers to that are as old."""
+        now = time.time()
+        with self.lock:
+            expired = [k for k, (_, _, last_used) in self.entries.items() if now - last_used > self.ttl]
+            for key in expired:
+                self.bytes -= self.entries.pop(key)[1]
+            expired_spills = [k for k, (_, _, last_used) in self.spilled.items() if now - last_used > self.ttl]
+            paths = [self.spilled.pop(k)[0] for k in expired_spills]
+            known = {path for path, _, _ in self.spilled.values()}
+            self.counters["expirations"] += len(expired) + len(expired_spills)
+        for path in paths:
+            self._remove(path)
+
+        # files left behind by a previous process, or exports (see file_path) nobody downloaded
+        try:
+            names = os.listdir(self.spill_dir)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.spill_dir, name)
+            if path in known:
+                continue
+            try:
+                if now - os.stat(path).st_mtime > self.ttl:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def start_cleanup(self):
+        """Run cleanup() every cleanup_interval seconds in a daemon thread (once per store)."""
+        with self.lock:
+            if self.cleaner is not None or self.cleanup_interval <= 0:
+                return
+            self.cleaner = threading.Thread(target=self._cleanup_loop, name="result-store-cleanup", daemon=True)
+        self.cleaner.start()
+
+    def _cleanup_loop(self):
+        while not self.stop_event.wait(self.cleanup_interval):
+            try:
+                self.cleanup()
+            except Exception as e:
+                print(f"⚠️ Result store cleanup failed: {e}")
+
+    def close(self):
+        """Stop the cleanup thread."""
+        self.stop_event.set()
+
+
+result_store = ResultStore()
@@ -0,0 +1,713 @@
+import re
+import difflib
+from database.queryCache import tokenize_sql
+
+# Parser and validator for the SQL the LLM generates, run before anything is
+# sent to PostgreSQL. It covers the read-only subset the agents use: one
+# SELECT (optionally with WITH, DISTINCT [ON], a subquery in FROM, WHERE,
+# GROUP BY, HAVING, ORDER BY, LIMIT, OFFSET) over a single table, with the
+# usual expressions, casts, CASE, EXTRACT and an allowlist of functions.
+# Anything outside it (several statements, writes, joins, set operations,
+# window functions, unknown tables, columns or functions) raises ValueError
+# with a message meant to be handed back to the LLM for a repair.
+#
+# The AST is plain dicts with a "type" key; to_sql renders any node back to
+# SQL, so downstream stages (MapAgent) rewrite queries without re-parsing.
+
+RESERVED = {
+    "select", "from", "where", "group", "by", "having", "order", "limit", "offset", "as", "and", "or", "not",
+    "between", "in", "is", "like", "ilike", "asc", "desc", "nulls", "on", "join", "inner", "left", "right",
+    "full", "cross", "natural", "union", "intersect", "except", "then", "when", "else", "end", "case", "over",
+    "window", "fetch", "for", "into", "with", "distinct", "all", "null", "true", "false", "using", "lateral",
+    "returning", "values", "cast", "extract", "similar", "any", "some", "exists",
+}
+OPERATORS = {"=", "<>", "!=", "<", ">", "<=", ">=", "+", "-", "*", "/", "%", "^", "::", "||"}
+COMPARISONS = {"=", "<>", "!=", "<", ">", "<=", ">="}
+
+AGGREGATES = {"avg", "min", "max", "sum", "count", "stddev", "stddev_pop", "stddev_samp", "variance", "var_pop",
+              "var_samp", "corr", "regr_slope", "regr_intercept", "bool_and", "bool_or"}
+FUNCTIONS = AGGREGATES | {
+    "round", "abs", "floor", "ceil", "ceiling", "sqrt", "power", "ln", "log", "exp", "sign", "trunc", "mod",
+    "greatest", "least", "coalesce", "nullif", "width_bucket", "random", "radians", "degrees", "sin", "cos",
+    "asin", "acos", "atan2", "date_trunc", "date_part", "to_char", "to_date", "to_timestamp", "make_date", "age",
+    "now", "lower", "upper", "length", "concat", "date",
+}
+CURRENT = {"current_date", "current_time", "current_timestamp", "localtime", "localtimestamp"}
+TYPED_LITERALS = {"date", "time", "timestamp", "timestamptz", "interval"}
+TYPE_NAMES = {"date", "time", "timestamp", "timestamptz", "interval", "numeric", "decimal", "real", "float",
+              "float4", "float8", "double", "int", "integer", "int2", "int4", "int8", "bigint", "smallint", "text",
+              "varchar", "char", "character", "boolean", "bool"}
+TYPE_WORDS = {"precision", "with", "without", "time", "zone", "varying"}
+
+
+def _split_operators(tokens):
+    """Split runs of operator characters the tokenizer glued together ("<-" in "x<-5")."""
+    out = []
+    for kind, text in tokens:
+        if kind != "op" or text in OPERATORS:
+            out.append((kind, text))
+            continue
+        while text:
+            op = next((text[:n] for n in (2, 1) if text[:n] in OPERATORS), text)  # unknown: the parser rejects it
+            out.append(("op", op))
+            text = text[len(op):]
+    return out
+
+
+def _ident(name):
+    """An identifier as SQL, quoted only when it has to be."""
+    if re.fullmatch(r"[a-z_][a-z0-9_$]*", name) and name not in RESERVED:
+        return name
+    return '"' + name.replace('"', '""') + '"'
+
+
+class _Parser:
+    def __init__(self, query):
+        self.tokens = _split_operators(tokenize_sql(query))
+        self.pos = 0
+
+    # --- token helpers ---
+    def peek(self, offset=0):
+        i = self.pos + offset
+        return self.tokens[i] if i < len(self.tokens) else (None, None)
+
+    def next(self):
+        token = self.peek()
+        if token[0] is None:
+            raise ValueError("The query ends unexpectedly.")
+        self.pos += 1
+        return token
+
+    def at_word(self, *words, offset=0):
+        kind, text = self.peek(offset)
+        return kind == "word" and text in words
+
+    def at(self, text, offset=0):
+        kind, token = self.peek(offset)
+        return kind in ("op", "other") and token == text
+
+    def accept_word(self, *words):
+        if self.at_word(*words):
+            return self.next()[1]
+        return None
+
+    def accept(self, text):
+        if self.at(text):
+            self.pos += 1
+            return True
+        return False
+
+    def expect_word(self, word):
+        if not self.accept_word(word):
+            raise ValueError(f'Expected {word.upper()} {self.where()}.')
+
+    def expect(self, text):
+        if not self.accept(text):
+            raise ValueError(f'Expected "{text}" {self.where()}.')
+
+    def where(self):
+        kind, text = self.peek()
+        return "at the end of the query" if kind is None else f'before "{text}"'
+
+    def name(self):
+        kind, text = self.peek()
+        if kind == "ident":
+            self.pos += 1
+            return text[1:-1].replace('""', '"')
+        if kind == "word" and text not in RESERVED:
+            self.pos += 1
+            return text
+        raise ValueError(f"Expected a name {self.where()}.")
+
+    # --- statements ---
+    def statement(self):
+        if self.peek()[0] is None:
+            raise ValueError("The query is empty.")
+        if not self.at_word("select", "with"):
+            raise ValueError(f'Only read-only SELECT queries are allowed, not "{self.peek()[1].upper()}".')
+        statement = self.select()
+        if self.peek()[0] is not None:
+            if self.at(";"):
+                raise ValueError("Only one SQL statement is allowed.")
+            if self.at_word("union", "intersect", "except"):
+                raise ValueError("UNION, INTERSECT and EXCEPT are not supported; use a single SELECT.")
+            raise ValueError(f"Unexpected text {self.where()}.")
+        return statement
+
+    def select(self):
+        ctes = []
+        if self.accept_word("with"):
+            if self.at_word("recursive"):
+                raise ValueError("WITH RECURSIVE is not supported.")
+            while True:
+                name = self.name()
+                self.expect_word("as")
+                self.expect("(")
+                ctes.append((name, self.select()))
+                self.expect(")")
+                if not self.accept(","):
+                    break
+        self.expect_word("select")
+        distinct, distinct_on = bool(self.accept_word("distinct")), None
+        if distinct and self.accept_word("on"):
+            self.expect("(")
+            distinct_on = self.expr_list()
+            self.expect(")")
+        elif not distinct:
+            self.accept_word("all")
+        columns = [self.select_item()]
+        while self.accept(","):
+            columns.append(self.select_item())
+        if self.at_word("into"):
+            raise ValueError("SELECT INTO is not allowed; queries must be read-only.")
+
+        statement = {"type": "select", "with": ctes, "distinct": distinct, "distinct_on": distinct_on,
+                     "columns": columns, "from": None, "where": None, "group_by": [], "having": None,
+                     "order_by": [], "limit": None, "offset": None}
+        if self.accept_word("from"):
+            statement["from"] = self.from_item()
+        if self.accept_word("where"):
+            statement["where"] = self.expr()
+        if self.accept_word("group"):
+            self.expect_word("by")
+            statement["group_by"] = self.expr_list()
+        if self.accept_word("having"):
+            statement["having"] = self.expr()
+        if self.accept_word("window") or self.at_word("over"):
+            raise ValueError("Window functions are not supported.")
+        if self.accept_word("order"):
+            self.expect_word("by")
+            statement["order_by"] = [self.order_item()]
+            while self.accept(","):
+                statement["order_by"].append(self.order_item())
+        for _ in range(2):  # LIMIT and OFFSET, in either order
+            if statement["limit"] is None and self.accept_word("limit"):
+                statement["limit"] = "all" if self.accept_word("all") else self.expr()
+            elif statement["offset"] is None and self.accept_word("offset"):
+                statement["offset"] = self.expr()
+                self.accept_word("row", "rows")
+        if self.at_word("for"):
+            raise ValueError("Locking clauses (FOR UPDATE/SHARE) are not allowed; queries must be read-only.")
+        return statement
+
+    def select_item(self):
+        if self.accept("*"):
+            return {"expr": {"type": "star", "table": None}, "alias": None}
+        if self.peek()[0] in ("word", "ident") and self.at(".", 1) and self.at("*", 2):
+            table = self.name()
+            self.pos += 2
+            return {"expr": {"type": "star", "table": table}, "alias": None}
+        return {"expr": self.expr(), "alias": self.alias()}
+
+    def alias(self):
+        if self.accept_word("as"):
+            return self.name()
+        kind, text = self.peek()
+        if kind == "ident" or (kind == "word" and text not in RESERVED):
+            return self.name()
+        return None
+
+    def from_item(self):
+        if self.accept("("):
+            query = self.select()
+            self.expect(")")
+            item = {"type": "subquery", "query": query, "table": None}
+        else:
+            parts = [self.name()]
+            while self.accept("."):
+                parts.append(self.name())
+            item = {"type": "table", "table": ".".join(parts)}
+        if self.at_word("tablesample"):
+            raise ValueError("TABLESAMPLE is not supported.")
+        item["alias"] = self.alias()
+        if item["type"] == "subquery" and item["alias"] is None:
+            raise ValueError("A subquery in FROM needs an alias.")
+        if self.at(",") or self.at_word("join", "inner", "left", "right", "full", "cross", "natural"):
+            raise ValueError("Only one table can be queried; joins are not supported.")
+        return item
+
+    def order_item(self):
+        item = {"expr": self.expr(), "direction": self.accept_word("asc", "desc"), "nulls": None}
+        if self.accept_word("nulls"):
+            item["nulls"] = self.accept_word("first", "last")
+            if item["nulls"] is None:
+                raise ValueError(f"Expected FIRST or LAST {self.where()}.")
+        return item
+
+    def expr_list(self):
+        items = [self.expr()]
+        while self.accept(","):
+            items.append(self.expr())
+        return items
+
+    # --- expressions, lowest precedence first ---
+    def expr(self):
+        left = self.conjunction()
+        while self.accept_word("or"):
+            left = {"type": "binary", "op": "or", "left": left, "right": self.conjunction()}
+        return left
+
+    def conjunction(self):
+        left = self.negation()
+        while self.accept_word("and"):
+            left = {"type": "binary", "op": "and", "left": left, "right": self.negation()}
+        return left
+
+    def negation(self):
+        if self.accept_word("not"):
+            return {"type": "unary", "op": "not", "expr": self.negation()}
+        return self.predicate()
+
+    def predicate(self):
+        left = self.additive()
+        while True:
+            kind, text = self.peek()
+            if kind == "op" and text in COMPARISONS:
+                self.pos += 1
+                left = {"type": "binary", "op": text, "left": left, "right": self.additive()}
+                continue
+            negated = self.at_word("not") and self.at_word("between", "in", "like", "ilike", offset=1)
+            if negated:
+                self.pos += 1
+            if self.accept_word("between"):
+                low = self.additive()
+                self.expect_word("and")
+                left = {"type": "between", "expr": left, "low": low, "high": self.additive(), "not": negated}
+            elif self.accept_word("in"):
+                self.expect("(")
+                if self.at_word("select", "with"):
+                    left = {"type": "in", "expr": left, "items": None, "query": self.select(), "not": negated}
+                else:
+                    left = {"type": "in", "expr": left, "items": self.expr_list(), "query": None, "not": negated}
+                self.expect(")")
+            elif self.at_word("like", "ilike"):
+                op = self.next()[1]
+                left = {"type": "binary", "op": f"not {op}" if negated else op, "left": left,
+                        "right": self.additive()}
+            elif self.accept_word("is"):
+                is_not = bool(self.accept_word("not"))
+                value = self.accept_word("null", "true", "false")
+                if value is None:
+                    raise ValueError(f"Expected NULL, TRUE or FALSE after IS {self.where()}.")
+                left = {"type": "is", "expr": left, "not": is_not, "value": value}
+            else:
+                return left
+
+    def additive(self):
+        left = self.multiplicative()
+        while self.peek()[0] == "op" and self.peek()[1] in ("+", "-", "||"):
+            op = self.next()[1]
+            left = {"type": "binary", "op": op, "left": left, "right": self.multiplicative()}
+        return left
+
+    def multiplicative(self):
+        left = self.power()
+        while self.peek()[0] == "op" and self.peek()[1] in ("*", "/", "%"):
+            op = self.next()[1]
+            left = {"type": "binary", "op": op, "left": left, "right": self.power()}
+        return left
+
+    def power(self):
+        left = self.unary()
+        while self.accept("^"):
+            left = {"type": "binary", "op": "^", "left": left, "right": self.unary()}
+        return left
+
+    def unary(self):
+        if self.peek()[0] == "op" and self.peek()[1] in ("-", "+"):
+            op = self.next()[1]
+            return {"type": "unary", "op": op, "expr": self.unary()}
+        node = self.primary()
+        while self.accept("::"):
+            node = {"type": "cast", "expr": node, "to": self.type_name()}
+        return node
+
+    def type_name(self):
+        kind, text = self.peek()
+        if kind != "word" or text not in TYPE_NAMES:
+            raise ValueError(f"Expected a type name {self.where()}.")
+        words = [self.next()[1]]
+        while self.at_word(*TYPE_WORDS):
+            words.append(self.next()[1])
+        name = " ".join(words)
+        if self.accept("("):
+            args = [self.next()[1]]
+            while self.accept(","):
+                args.append(self.next()[1])
+            self.expect(")")
+            name += f"({', '.join(args)})"
+        return name
+
+    def primary(self):
+        kind, text = self.peek()
+        if kind in ("number", "string"):
+            self.pos += 1
+            return {"type": "literal", "value": text}
+        if kind == "dollar":
+            raise ValueError("Dollar-quoted strings are not supported.")
+        if self.accept("("):
+            if self.at_word("select", "with"):
+                node = {"type": "subquery", "query": self.select()}
+            else:
+                node = {"type": "paren", "expr": self.expr()}
+            self.expect(")")
+            return node
+        if kind == "ident":
+            return self.column()
+        if kind is None:
+            raise ValueError("The query ends unexpectedly.")
+        if kind != "word":
+            raise ValueError(f"Unexpected text {self.where()}.")
+
+        if text in ("null", "true", "false"):
+            self.pos += 1
+            return {"type": "literal", "value": text.upper()}
+        if text in CURRENT:
+            self.pos += 1
+            return {"type": "keyword", "name": text}
+        if text in TYPED_LITERALS and self.peek(1)[0] == "string":
+            self.pos += 2
+            return {"type": "typed", "type_name": text, "value": self.tokens[self.pos - 1][1]}
+        if text == "case":
+            return self.case()
+        if text == "cast":
+            self.pos += 1
+            self.expect("(")
+            node = self.expr()
+            self.expect_word("as")
+            node = {"type": "cast", "expr": node, "to": self.type_name()}
+            self.expect(")")
+            return node
+        if text == "extract":
+            self.pos += 1
+            self.expect("(")
+            field_kind, field = self.next()
+            if field_kind == "string":
+                field = field.strip("'").lower()
+            self.expect_word("from")
+            node = {"type": "extract", "field": field, "expr": self.expr()}
+            self.expect(")")
+            return node
+        if text == "exists":
+            raise ValueError("EXISTS subqueries are not supported.")
+        if self.at("(", 1):
+            return self.function()
+        if text in RESERVED:
+            raise ValueError(f"Unexpected {text.upper()} {self.where_after()}.")
+        return self.column()
+
+    def where_after(self):
+        kind, text = self.peek(1)
+        return "at the end of the query" if kind is None else f'before "{text}"'
+
+    def column(self):
+        parts = [self.name()]
+        while self.accept("."):
+            parts.append(self.name())
+        if len(parts) > 3:
+            raise ValueError(f'Invalid column reference "{".".join(parts)}".')
+        return {"type": "column", "table": ".".join(parts[:-1]) or None, "name": parts[-1]}
+
+    def function(self):
+        name = self.next()[1]
+        self.expect("(")
+        node = {"type": "function", "name": name, "args": [], "distinct": False, "star": False}
+        if self.accept("*"):
+            node["star"] = True
+        elif not self.at(")"):
+            node["distinct"] = bool(self.accept_word("distinct"))
+            node["args"] = self.expr_list()
+        self.expect(")")
+        if self.at_word("over", "filter", "within"):
+            raise ValueError(f"{self.peek()[1].upper()} clauses (window and ordered-set aggregates) are not supported.")
+        return node
+
+    def case(self):
+        self.expect_word("case")
+        node = {"type": "case", "operand": None if self.at_word("when") else self.expr(), "whens": [], "else": None}
+        while self.accept_word("when"):
+            condition = self.expr()
+            self.expect_word("then")
+            node["whens"].append((condition, self.expr()))
+        if not node["whens"]:
+            raise ValueError(f"Expected WHEN {self.where()}.")
+        if self.accept_word("else"):
+            node["else"] = self.expr()
+        self.expect_word("end")
+        return node
+
+
+def parse_sql(query: str):
+    """AST of a single read-only SELECT; raises ValueError if the query is outside the supported subset."""
+    return _Parser(query).statement()
+
+
+# === Rendering ===
+def to_sql(node) -> str:
+    """SQL text of an AST node (a whole statement or any expression)."""
+    t = node["type"]
+    if t == "select":
+        return _select_sql(node)
+    if t == "literal":
+        return node["value"]
+    if t == "keyword":
+        return node["name"].upper()
+    if t == "typed":
+        return f"{node['type_name'].upper()} {node['value']}"
+    if t == "column":
+        return ".".join(_ident(part) for part in (node["table"].split(".") if node["table"] else [])) + \
+            ("." if node["table"] else "") + _ident(node["name"])
+    if t == "star":
+        return f"{_ident(node['table'])}.*" if node["table"] else "*"
+    if t == "function":
+        args = "*" if node["star"] else ", ".join(to_sql(a) for a in node["args"])
+        return f"{node['name']}({'DISTINCT ' if node['distinct'] else ''}{args})"
+    if t == "paren":
+        return f"({to_sql(node['expr'])})"
+    if t == "subquery":
+        return f"({to_sql(node['query'])})"
+    if t == "unary":
+        if node["op"] == "not":
+            return f"NOT {to_sql(node['expr'])}"
+        operand = to_sql(node["expr"])
+        # "- -x" must not become "--x", which starts a comment
+        return f"{node['op']} {operand}" if operand[:1] in ("-", "+") else f"{node['op']}{operand}"
+    if t == "binary":
+        op = node["op"].upper() if node["op"][0].isalpha() else node["op"]
+        return f"{to_sql(node['left'])} {op} {to_sql(node['right'])}"
+    if t == "between":
+        return (f"{to_sql(node['expr'])} {'NOT ' if node['not'] else ''}BETWEEN "
+                f"{to_sql(node['low'])} AND {to_sql(node['high'])}")
+    if t == "in":
+        inner = to_sql(node["query"]) if node["query"] else ", ".join(to_sql(i) for i in node["items"])
+        return f"{to_sql(node['expr'])} {'NOT ' if node['not'] else ''}IN ({inner})"
+    if t == "is":
+        return f"{to_sql(node['expr'])} IS {'NOT ' if node['not'] else ''}{node['value'].upper()}"
+    if t == "cast":
+        return f"{to_sql(node['expr'])}::{node['to']}"
+    if t == "extract":
+        return f"EXTRACT({node['field'].upper()} FROM {to_sql(node['expr'])})"
+    if t == "case":
+        parts = ["CASE"] + ([to_sql(node["operand"])] if node["operand"] else [])
+        parts += [f"WHEN {to_sql(c)} THEN {to_sql(r)}" for c, r in node["whens"]]
+        parts += [f"ELSE {to_sql(node['else'])}"] if node["else"] else []
+        return " ".join(parts + ["END"])
+    raise ValueError(f"Cannot render node {t}")
+
+
+def from_sql(item) -> str:
+    """SQL of a FROM item (table or subquery, with its alias and a "tablesample" clause if one was added)."""
+    source = ".".join(_ident(p) for p in item["table"].split(".")) if item["type"] == "table" \
+        else f"({to_sql(item['query'])})"
+    source += f" AS {_ident(item['alias'])}" if item["alias"] else ""
+    return source + (f" TABLESAMPLE {item['tablesample']}" if item.get("tablesample") else "")
+
+
+def _select_sql(s):
+    parts = []
+    if s["with"]:
+        parts.append("WITH " + ", ".join(f"{_ident(name)} AS ({to_sql(q)})" for name, q in s["with"]))
+    head = "SELECT"
+    if s["distinct"]:
+        head += " DISTINCT"
+        if s["distinct_on"]:
+            head += f" ON ({', '.join(to_sql(e) for e in s['distinct_on'])})"
+    parts.append(head + " " + ", ".join(
+        to_sql(c["expr"]) + (f" AS {_ident(c['alias'])}" if c["alias"] else "") for c in s["columns"]))
+    if s["from"]:
+        parts.append(f"FROM {from_sql(s['from'])}")
+    if s["where"]:
+        parts.append(f"WHERE {to_sql(s['where'])}")
+    if s["group_by"]:
+        parts.append("GROUP BY " + ", ".join(to_sql(e) for e in s["group_by"]))
+    if s["having"]:
+        parts.append(f"HAVING {to_sql(s['having'])}")
+    if s["order_by"]:
+        parts.append("ORDER BY " + ", ".join(
+            to_sql(o["expr"]) + (f" {o['direction'].upper()}" if o["direction"] else "") +
+            (f" NULLS {o['nulls'].upper()}" if o["nulls"] else "") for o in s["order_by"]))
+    if s["limit"] is not None:
+        parts.append(f"LIMIT {'ALL' if s['limit'] == 'all' else to_sql(s['limit'])}")
+    if s["offset"] is not None:
+        parts.append(f"OFFSET {to_sql(s['offset'])}")
+    return " ".join(parts)
+
+
+# === Validation ===
+def _children(node):
+    """Direct sub-expressions of an expression node (subqueries are not descended into)."""
+    t = node["type"]
+    if t in ("paren", "unary", "cast", "extract", "is"):
+        return [node["expr"]]
+    if t == "binary":
+        return [node["left"], node["right"]]
+    if t == "between":
+        return [node["expr"], node["low"], node["high"]]
+    if t == "in":
+        return [node["expr"]] + (node["items"] or [])
+    if t == "function":
+        return node["args"]
+    if t == "case":
+        children = [node["operand"]] if node["operand"] else []
+        for condition, result in node["whens"]:
+            children += [condition, result]
+        return children + ([node["else"]] if node["else"] else [])
+    return []
+
+
+def walk(node):
+    """Every expression node under `node`, itself included, without entering subqueries."""
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        yield current
+        stack.extend(_children(current))
+
+
+def conjuncts(expr):
+    """The top-level AND-ed conditions of a WHERE expression."""
+    if expr is None:
+        return []
+    if expr["type"] == "binary" and expr["op"] == "and":
+        return conjuncts(expr["left"]) + conjuncts(expr["right"])
+    if expr["type"] == "paren" and expr["expr"]["type"] == "binary" and expr["expr"]["op"] == "and":
+        return conjuncts(expr["expr"])
+    return [expr]
+
+
+def number_value(node):
+    """Value of a numeric literal (with an optional sign), or None."""
+    sign = 1
+    while node["type"] == "unary" and node["op"] in ("-", "+"):
+        sign = -sign if node["op"] == "-" else sign
+        node = node["expr"]
+    if node["type"] == "literal":
+        try:
+            return sign * float(node["value"])
+        except ValueError:
+            return None
+    return None
+
+
+def _same_table(name, table):
+    """Whether a FROM name refers to the configured table (schema optional on either side)."""
+    given, expected = name.lower().split("."), table.lower().split(".")
+    return given[-1] == expected[-1] and (len(given) == 1 or len(expected) == 1 or given[-2] == expected[-2])
+
+
+def _unknown_column(name, available):
+    close = difflib.get_close_matches(name, available, n=1, cutoff=0.7)
+    hint = f' (did you mean "{close[0]}"?)' if close else ""
+    return ValueError(f'Unknown column "{name}"{hint}. Available columns: {", ".join(available)}.')
+
+
+def _check_expr(expr, available, qualifiers, table, columns, ctes, aggregates_allowed=True, where="query"):
+    for node in walk(expr):
+        t = node["type"]
+        if t == "column":
+            if node["table"] and node["table"].split(".")[-1] not in qualifiers:
+                raise ValueError(f'Unknown table or alias "{node["table"]}" in {where}.')
+            if node["name"] not in available:
+                raise _unknown_column(node["name"], available)
+        elif t == "function":
+            if node["name"] not in FUNCTIONS:
+                raise ValueError(f'Function "{node["name"]}" is not allowed.')
+            if node["name"] in AGGREGATES and not aggregates_allowed:
+                raise ValueError(f"Aggregate functions like {node['name']}() are not allowed in {where}; "
+                                 "use HAVING or a subquery.")
+        elif t == "subquery":
+            _check_select(node["query"], table, columns, ctes, outer=available)
+        elif t == "in" and node["query"]:
+            _check_select(node["query"], table, columns, ctes, outer=available)
+
+
+def _output_name(item):
+    if item["alias"]:
+        return item["alias"]
+    expr = item["expr"]
+    while expr["type"] == "cast":
+        expr = expr["expr"]
+    if expr["type"] == "column":
+        return expr["name"]
+    if expr["type"] == "function":
+        return expr["name"]
+    return "?column?"
+
+
+def _check_select(statement, table, columns, ctes, outer=()):
+    """Validate a SELECT and return the names of the columns it outputs."""
+    ctes = dict(ctes)
+    for name, query in statement["with"]:
+        ctes[name] = _check_select(query, table, columns, ctes)
+
+    source, qualifiers = [], set()
+    item = statement["from"]
+    if item is not None:
+        if item["type"] == "subquery":
+            source = _check_select(item["query"], table, columns, ctes)
+        elif "." not in item["table"] and item["table"] in ctes:
+            source = ctes[item["table"]]
+            qualifiers.add(item["table"])
+        elif _same_table(item["table"], table):
+            source = list(columns)
+            qualifiers.add(item["table"].split(".")[-1])
+        else:
+            raise ValueError(f'Unknown table "{item["table"]}"; the only table is "{table}".')
+        if item["alias"]:
+            qualifiers.add(item["alias"])
+    available = list(source) + [c for c in outer if c not in source]
+
+    outputs = []
+    for column in statement["columns"]:
+        expr = column["expr"]
+        if expr["type"] == "star":
+            if expr["table"] and expr["table"] not in qualifiers:
+                raise ValueError(f'Unknown table or alias "{expr["table"]}".')
+            outputs += source
+            continue
+        _check_expr(expr, available, qualifiers, table, columns, ctes, where="SELECT")
+        outputs.append(_output_name(column))
+
+    aliased = available + [name for name in outputs if name not in available]
+    if statement["where"] is not None:
+        _check_expr(statement["where"], available, qualifiers, table, columns, ctes,
+                    aggregates_allowed=False, where="WHERE")
+    for expr in statement["distinct_on"] or []:
+        _check_expr(expr, aliased, qualifiers, table, columns, ctes, where="DISTINCT ON")
+    for expr in statement["group_by"]:
+        _check_expr(expr, aliased, qualifiers, table, columns, ctes, aggregates_allowed=False, where="GROUP BY")
+    if statement["having"] is not None:
+        _check_expr(statement["having"], available, qualifiers, table, columns, ctes, where="HAVING")
+    for order in statement["order_by"]:
+        _check_expr(order["expr"], aliased, qualifiers, table, columns, ctes, where="ORDER BY")
+    for clause in ("limit", "offset"):
+        value = statement[clause]
+        if value is not None and value != "all" and number_value(value) is None:
+            raise ValueError(f"{clause.upper()} must be a number.")
+    return outputs
+
+
+def validate_sql(query: str, table: str, columns):
+    """
+    Parse `query` and check it against the schema: a single read-only SELECT
+    over `table` using only `columns` and allowed functions. Returns the AST;
+    raises ValueError with an explanation otherwise.
+    """
+    statement = parse_sql(query)
+    _check_select(statement, table, list(columns), {})
+    return statement
+
+
+if __name__ == "__main__":
+    # Round trip: rendering a parsed query and parsing it again gives the same AST
+    examples = [
+        "SELECT time, - -temperature AS neg FROM t WHERE depth = 10",
+        "SELECT time, -(-temperature), +-salinity FROM t WHERE latitude > - -5 AND longitude BETWEEN -80 AND -60",
+        "SELECT DATE(time) AS day, avg(temperature) FROM t WHERE EXTRACT(YEAR FROM time) = 2020 GROUP BY 1",
+    ]
+    for example in examples:
+        statement = parse_sql(example)
+        rendered = to_sql(statement)
+        assert "--" not in rendered, rendered
+        assert parse_sql(rendered) == statement, rendered
+        print(f"✅ {rendered}")
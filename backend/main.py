@@ -1,8 +1,9 @@
 import streamlit as st
-from agents.Query import SQLagent
+from agents.Orchestrator import answerRequest
+from agents.Query import export_full_csv, SQL_SOURCES
 from agents.SummaringAgent import summarizeTable
 from agents.Plotting import plotGraphs
-from agents.MapAgent import generateMap
+from database.resultStore import result_store
 import os
 import pandas as pd
 import json
@@ -454,30 +455,74 @@ st.markdown(trans["markdown"])
 # Initialize session state
 if "messages" not in st.session_state:
     st.session_state.messages = []
+# results are kept in the shared result store under this session's id
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
 
 # Chat Messages Container with proper scrolling
 chat_container = st.container()
 with chat_container:
     st.markdown('<div class="chat-messages-container">', unsafe_allow_html=True)
-    for msg in st.session_state.messages:
+    for i, msg in enumerate(st.session_state.messages):
         with st.chat_message(msg["role"]):
             st.markdown(msg["content"])
             # Display additional content like maps, dataframes, etc., if present
             if msg["role"] == "assistant" and "map_html" in msg:
                 st.subheader(trans["sql_header"])
                 st.code(msg.get("sql_query", ""), language="sql")
+                if msg.get("sql_source"):
+                    st.caption(SQL_SOURCES[msg["sql_source"]])
+                if msg.get("downsampled"):
+                    st.info(msg["guard_message"])
                 st.subheader(trans["map_header"])
                 st.components.v1.html(msg["map_html"], height=500, scrolling=True)
                 if "df" in msg:
                     st.subheader(trans["data_header"])
                     st.dataframe(msg["df"], use_container_width=True)
                     st.markdown(trans["total_entries"].format(n=msg["n"]))
-                    st.download_button(
-                        label=trans["download"],
-                        data=msg["csv_data"],
-                        file_name="dataExtracted.csv",
-                        mime="text/csv"
-                    )
+                    # the CSV is only built when asked for, and from the result store on every render,
+                    # so the session keeps no copy of the data outside the store's budget
+                    if not msg.get("csv_ready") and st.button(
+                            trans.get("prepare_csv", "Prepare CSV download"), key=f"csv_{i}"):
+                        msg["csv_ready"] = True
+                    if msg.get("csv_ready"):
+                        data = result_store.get(st.session_state.session_id, msg["turn"])
+                        if data is not None:
+                            st.download_button(
+                                label=trans["download"],
+                                data=data.to_csv(index=False, date_format="%Y-%m-%d %H:%M:%S").encode(),
+                                file_name="dataExtracted.csv",
+                                mime="text/csv",
+                                key=f"download_{i}"
+                            )
+                        else:
+                            msg["csv_ready"] = False
+                            st.warning(trans.get("result_expired",
+                                                 "This result has expired. Please run the query again."))
+                    if msg.get("downsampled"):
+                        # the full result is only fetched when asked for; the export stays on disk in the
+                        # result store's directory (removed with the store's expired files)
+                        full_path = result_store.file_path(st.session_state.session_id, msg["turn"], ".full.csv")
+                        if not msg.get("full_ready") and st.button(
+                                trans.get("prepare_full", "Prepare full data download"), key=f"full_{i}"):
+                            with st.spinner(trans.get("preparing_full", "Exporting the full data...")):
+                                msg["full_ready"] = export_full_csv(msg["full_query"], full_path) is not None
+                            if not msg["full_ready"]:
+                                st.error(trans["query_failed"])
+                        if msg.get("full_ready"):
+                            if os.path.exists(full_path):
+                                with open(full_path, "rb") as f:
+                                    st.download_button(
+                                        label=trans.get("download_full", "Download full data CSV"),
+                                        data=f,
+                                        file_name="dataFull.csv",
+                                        mime="text/csv",
+                                        key=f"download_full_{i}"
+                                    )
+                            else:
+                                msg["full_ready"] = False
+                                st.warning(trans.get("result_expired",
+                                                     "This result has expired. Please run the query again."))
                 if "summary" in msg and msg["summary"]:
                     st.subheader(trans["summary_header"])
                     st.write(msg["summary"])
@@ -521,57 +566,63 @@ if user_input:
         with st.chat_message("assistant"):
             # Single spinner for all backend processing
             with st.spinner("Processing..."):  # can be "Processing your request..."
-                sql_query = SQLagent(user_input)
+                sql_query = answerRequest(user_input)
+                guard = sql_query.get("guard") if sql_query else None
 
                 if sql_query and sql_query.get("result"):
                     st.success(trans["success"])
+                    if guard and guard["downsampled"]:
+                        st.info(guard["message"])
+                    elif guard and guard["decision"] == "limit":
+                        st.warning(guard["message"])
                     sql_string = sql_query["sql_query"]
 
-                    map_html = generateMap(sql_string)
-
-                    csv_path = os.path.join(project_root, "dataExtracted.csv")
-
-                    if os.path.exists(csv_path):
-                        df = pd.read_csv(csv_path)
-                        n = len(df)
-                        if n > 10:
-                            top = df.head(5)
-                            bottom = df.tail(5)
-                            sep = pd.DataFrame([["..." for _ in df.columns]], columns=df.columns)
-                            combined_df = pd.concat([top, sep, bottom], ignore_index=True)
-                        elif n > 5:
-                            top = df.head(5)
-                            bottom = df.tail(n - 5)
-                            sep = pd.DataFrame([["..." for _ in df.columns]], columns=df.columns)
-                            combined_df = pd.concat([top, sep, bottom], ignore_index=True)
-                        else:
-                            combined_df = df
-
-                        with open(csv_path, "rb") as f:
-                            csv_data = f.read()
-
-                        # Summarize and plot inside the same spinner
-                        summary, visualizations = summarizeTable(user_input, csv_path)
-                        figures = plotGraphs(csv_path, visualizations)
-
-                        # Append assistant message
-                        st.session_state.messages.append({
-                            "role": "assistant",
-                            "content": trans.get("assistant_content", "Data processed successfully"),
-                            "sql_query": sql_string,
-                            "map_html": map_html,
-                            "df": combined_df,
-                            "n": n,
-                            "csv_data": csv_data,
-                            "summary": summary,
-                            "figures": figures
-                        })
+                    map_html = sql_query["map_html"]
+
+                    df = sql_query["data"]
+                    turn = len(st.session_state.messages)
+                    # a copy: `df` is also held by the query cache, and spilling a shared frame frees nothing
+                    result_store.put(st.session_state.session_id, turn, df.copy())
+                    n = len(df)
+                    if n > 10:
+                        top = df.head(5)
+                        bottom = df.tail(5)
+                        sep = pd.DataFrame([["..." for _ in df.columns]], columns=df.columns)
+                        combined_df = pd.concat([top, sep, bottom], ignore_index=True)
+                    elif n > 5:
+                        top = df.head(5)
+                        bottom = df.tail(n - 5)
+                        sep = pd.DataFrame([["..." for _ in df.columns]], columns=df.columns)
+                        combined_df = pd.concat([top, sep, bottom], ignore_index=True)
                     else:
-                        st.error(trans["csv_not_found"])
-                        st.session_state.messages.append({
-                            "role": "assistant",
-                            "content": trans["csv_not_found"]
-                        })
+                        combined_df = df
+
+                    # Summarize and plot inside the same spinner
+                    summary, visualizations = summarizeTable(user_input, df)
+                    figures = plotGraphs(df, visualizations)
+
+                    # Append assistant message
+                    st.session_state.messages.append({
+                        "role": "assistant",
+                        "content": trans.get("assistant_content", "Data processed successfully"),
+                        "sql_query": sql_string,
+                        "sql_source": sql_query["sql_source"],
+                        "map_html": map_html,
+                        "df": combined_df,
+                        "n": n,
+                        "turn": turn,
+                        "summary": summary,
+                        "figures": figures,
+                        "downsampled": guard["downsampled"],
+                        "guard_message": guard["message"],
+                        "full_query": guard["full_query"]
+                    })
+                elif guard and guard["decision"] == "reject":
+                    st.error(guard["message"])
+                    st.session_state.messages.append({
+                        "role": "assistant",
+                        "content": f"{guard['message']}\n\n```sql\n{sql_query['sql_query']}\n```"
+                    })
                 else:
                     st.error(trans["query_failed"])
                     st.session_state.messages.append({
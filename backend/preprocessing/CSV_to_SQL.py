@@ -1,16 +1,19 @@
+import io
 import os
+import time
 import pandas as pd
 from tqdm import tqdm
 from pathlib import Path
 from dotenv import load_dotenv
 import psycopg2
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datasetIO import read_chunks, split_dataset, read_piece_chunks
 
 env_path = Path(__file__).resolve().parent.parent / ".env"
 load_dotenv(dotenv_path=env_path)
 
 # === Config ===
-CSV_FILE = input("Enter CSV file path: ").strip()
-
 DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
@@ -20,99 +23,375 @@ DB_PORT = os.getenv("DB_PORT", "5432")
 SCHEMA_NAME = "floatchat"
 tableName = os.getenv("TABLE_NAME")
 TABLE_NAME = f"{SCHEMA_NAME}.{tableName}"
+DATA_VERSION_TABLE = f"{SCHEMA_NAME}.data_version"  # read by the query result cache (database/queryCache.py)
 BATCH_SIZE = 1000
 CHUNK_SIZE = 10000  # Number of rows per chunk from CSV
+LOAD_MODE = os.getenv("LOAD_MODE", "copy")  # "copy" (COPY FROM STDIN) or "insert" (executemany)
+LOAD_WORKERS = int(os.getenv("LOAD_WORKERS", "1"))  # >1 = parallel load into a staging table, then swap
+PIECES_PER_WORKER = 4  # input pieces per worker, for load balancing
+TABLE_LAYOUT = os.getenv("TABLE_LAYOUT", "partitioned")  # "partitioned" (by year of time) or "flat"
+PARTITION_FIRST_YEAR = int(os.getenv("PARTITION_FIRST_YEAR", "1997"))  # first Argo floats
+PARTITION_LAST_YEAR = int(os.getenv("PARTITION_LAST_YEAR", str(datetime.now().year + 1)))
+TABLE_STORAGE = os.getenv("TABLE_STORAGE", "numeric")  # "numeric" (NUMERIC(10,4)) or "compact" (REAL/SMALLINT)
+
+COLUMNS = ["time", "latitude", "longitude", "depth", "temperature", "salinity"]
+NUMERIC_COLUMNS = ["latitude", "longitude", "depth", "temperature", "salinity"]
+
+# Column types per storage mode. "compact" keeps 4-decimal values in REAL
+# (float4 round-trips them exactly for the coordinate, temperature and
+# salinity ranges we store) and the 10 m depth bins in SMALLINT metres.
+STORAGE_TYPES = {
+    "numeric": {col: "NUMERIC(10,4)" for col in NUMERIC_COLUMNS},
+    "compact": {"latitude": "REAL", "longitude": "REAL", "depth": "SMALLINT", "temperature": "REAL",
+                "salinity": "REAL"},
+}
+
+
+def connect():
+    return psycopg2.connect(
+        dbname=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        host=DB_HOST,
+        port=DB_PORT
+    )
+
+
+def column_definitions(storage=TABLE_STORAGE):
+    types = STORAGE_TYPES[storage]
+    return ",\n        ".join(["time TIMESTAMP"] + [f"{col} {types[col]}" for col in NUMERIC_COLUMNS])
+
+
+def cast_columns(storage=TABLE_STORAGE):
+    """SELECT list converting the columns of an existing table to `storage` types."""
+    types = STORAGE_TYPES[storage]
+    # REAL -> NUMERIC goes through float8 so values keep all 4 decimals
+    via = "::float8" if storage == "numeric" else ""
+    return ", ".join(["time"] + [f"{col}{via}::{types[col]} AS {col}" for col in NUMERIC_COLUMNS])
+
+
+def create_table(cur, table=TABLE_NAME, layout=TABLE_LAYOUT, storage=TABLE_STORAGE):
+    """Create schema and table (idempotent)."""
+    cur.execute(f"CREATE SCHEMA IF NOT EXISTS {SCHEMA_NAME};")
+    partition_by = " PARTITION BY RANGE (time)" if layout == "partitioned" else ""
+    cur.execute(f"""
+    CREATE TABLE IF NOT EXISTS {table} (
+        {column_definitions(storage)}
+    ){partition_by};
+    """)
+    if layout == "partitioned":
+        create_partitions(cur, table)
+
+
+def create_partitions(cur, table=TABLE_NAME):
+    """
+    Create one partition per year from PARTITION_FIRST_YEAR to PARTITION_LAST_YEAR
+    (<table>_y<year>), plus <table>_default for NULL or out-of-range times.
+    Missing years are added to an existing partitioned table; a year whose rows
+    already sit in the default partition is left there.
+    """
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = %s::regclass;", (table,))
+    if cur.fetchone()[0] != "p":
+        tqdm.write(f"⚠️ {table} already exists as a flat table; reload it with LOAD_WORKERS > 1 "
+                   f"to switch to the partitioned layout.")
+        return
+
+    for year in range(PARTITION_FIRST_YEAR, PARTITION_LAST_YEAR + 1):
+        cur.execute("SAVEPOINT add_partition;")
+        try:
+            cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table}_y{year} PARTITION OF {table}
+                FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01');
+            """)
+            cur.execute("RELEASE SAVEPOINT add_partition;")
+        except psycopg2.Error as e:
+            cur.execute("ROLLBACK TO SAVEPOINT add_partition;")
+            tqdm.write(f"⚠️ Could not add partition for {year}: {e}")
+    cur.execute(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT;")
+
+
+def build_indexes(conn, table=TABLE_NAME):
+    """
+    Build the indexes that match the queries SQLagent generates, then ANALYZE:
+      - BRIN on time, for time ranges (tiny; rows arrive in time order per file)
+      - B-tree on (depth, latitude, longitude), for depth = N plus lat/lon BETWEEN
+      - GiST on the PostGIS point, when PostGIS is available
+    On a partitioned table every index is built on each partition.
+    """
+    name = table.split(".", 1)[1]
+    cur = conn.cursor()
+    started = time.perf_counter()
+    cur.execute(f"CREATE INDEX IF NOT EXISTS {name}_time_brin ON {table} USING brin (time);")
+    cur.execute(f"CREATE INDEX IF NOT EXISTS {name}_depth_lat_lon_idx ON {table} (depth, latitude, longitude);")
+    conn.commit()
+
+    cur.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'postgis';")
+    if cur.fetchone():
+        try:
+            cur.execute("CREATE EXTENSION IF NOT EXISTS postgis;")
+            cur.execute(f"""
+            CREATE INDEX IF NOT EXISTS {name}_geom_gist ON {table}
+                USING gist (ST_SetSRID(ST_MakePoint(longitude::float8, latitude::float8), 4326));
+            """)
+            conn.commit()
+        except psycopg2.Error as e:
+            conn.rollback()
+            tqdm.write(f"⚠️ Skipping the spatial index: {e}")
+    else:
+        tqdm.write("ℹ️ PostGIS is not available; skipping the spatial index.")
+
+    cur.execute(f"ANALYZE {table};")
+    conn.commit()
+    cur.close()
+    print(f"🗂️ Indexes built and {table} analyzed in {time.perf_counter() - started:.1f}s")
+
+
+def bump_data_version(cur):
+    """Increment the data version in the caller's transaction; cached query results from before become stale."""
+    cur.execute(f"""
+    CREATE TABLE IF NOT EXISTS {DATA_VERSION_TABLE} (
+        id SMALLINT PRIMARY KEY CHECK (id = 1),
+        version BIGINT NOT NULL,
+        changed_at TIMESTAMP NOT NULL
+    );
+    """)
+    cur.execute(f"""
+    INSERT INTO {DATA_VERSION_TABLE} (id, version, changed_at) VALUES (1, 1, now())
+    ON CONFLICT (id) DO UPDATE SET version = {DATA_VERSION_TABLE}.version + 1, changed_at = now();
+    """)
+
+
+def mark_data_changed(conn):
+    """Record that the table's contents changed, invalidating cached query results."""
+    cur = conn.cursor()
+    bump_data_version(cur)
+    conn.commit()
+    cur.close()
+
+
+def prepare_chunk(chunk, storage=TABLE_STORAGE):
+    """Check the required columns and round numeric values."""
+    if not set(COLUMNS).issubset(chunk.columns):
+        raise ValueError(f"Missing columns. Found: {list(chunk.columns)}")
+
+    for col in NUMERIC_COLUMNS:
+        chunk[col] = chunk[col].round(4)
+    if storage == "compact":
+        # SMALLINT input must not carry a ".0"
+        chunk["depth"] = chunk["depth"].round().astype("Int64")
+    return chunk
+
+
+def insert_chunk(conn, cur, chunk, table=TABLE_NAME):
+    """
+    Insert a chunk with executemany, committing every BATCH_SIZE rows.
+    A failing batch is rolled back and reported; the rest still load.
+    Returns (rows loaded, rows failed).
+    """
+    # NaN -> None so missing values load as NULL, the same as with COPY
+    numeric = chunk[NUMERIC_COLUMNS].astype(object).where(chunk[NUMERIC_COLUMNS].notnull(), None)
+    times = [t.to_pydatetime() if pd.notnull(t) else None for t in chunk["time"]]
+    rows = [(t, *values) for t, values in zip(times, numeric.itertuples(index=False))]
 
-# === Connect to PostgreSQL ===
-conn = psycopg2.connect(
-    dbname=DB_NAME,
-    user=DB_USER,
-    password=DB_PASSWORD,
-    host=DB_HOST,
-    port=DB_PORT
-)
-cur = conn.cursor()
-
-# === Create schema and table (idempotent) ===
-cur.execute(f"CREATE SCHEMA IF NOT EXISTS {SCHEMA_NAME};")
-cur.execute(f"""
-CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
-    time TIMESTAMP,
-    latitude NUMERIC(10,4),
-    longitude NUMERIC(10,4),
-    depth NUMERIC(10,4),
-    temperature NUMERIC(10,4),
-    salinity NUMERIC(10,4)
-);
-""")
-conn.commit()
-
-# === Process CSV in chunks ===
-rows_batch = []
-
-try:
-    for chunk in tqdm(pd.read_csv(CSV_FILE, parse_dates=["time"], chunksize=CHUNK_SIZE), desc="Processing CSV",
-                      unit="chunk"):
-        # Ensure required columns exist
-        required_cols = {"time", "latitude", "longitude", "depth", "temperature", "salinity"}
-        if not required_cols.issubset(chunk.columns):
-            raise ValueError(f"Missing columns. Found: {list(chunk.columns)}")
-
-        # Round numeric values
-        for col in ["latitude", "longitude", "depth", "temperature", "salinity"]:
-            chunk[col] = chunk[col].round(4)
-
-        # Add rows to batch
-        for row in chunk.itertuples(index=False):
-            rows_batch.append((
-                row.time.to_pydatetime() if pd.notnull(row.time) else None,
-                row.latitude,
-                row.longitude,
-                row.depth,
-                row.temperature,
-                row.salinity
-            ))
-
-            # Insert batch if full
-            if len(rows_batch) >= BATCH_SIZE:
-                try:
-                    cur.executemany(f"""
-                        INSERT INTO {TABLE_NAME} (time, latitude, longitude, depth, temperature, salinity)
-                        VALUES (%s, %s, %s, %s, %s, %s)
-                    """, rows_batch)
-                    conn.commit()
-                    rows_batch = []
-                except Exception as batch_err:
-                    conn.rollback()
-                    tqdm.write(f"⚠️ Batch insert failed: {batch_err}")
-
-except Exception as e:
-    print(f"❌ Error processing CSV: {e}")
-
-# Insert remaining rows
-if rows_batch:
+    loaded = failed = 0
+    for start in range(0, len(rows), BATCH_SIZE):
+        rows_batch = rows[start:start + BATCH_SIZE]
+        try:
+            cur.executemany(f"""
+                INSERT INTO {table} (time, latitude, longitude, depth, temperature, salinity)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, rows_batch)
+            conn.commit()
+            loaded += len(rows_batch)
+        except Exception as batch_err:
+            conn.rollback()
+            failed += len(rows_batch)
+            tqdm.write(f"⚠️ Batch insert failed: {batch_err}")
+    return loaded, failed
+
+
+def copy_chunk(conn, cur, chunk, table=TABLE_NAME):
+    """
+    Stream a chunk into COPY ... FROM STDIN through an in-memory CSV buffer.
+    The chunk is one batch: it is committed on success, or rolled back and
+    reported on failure without stopping the load.
+    Returns (rows loaded, rows failed).
+    """
+    buffer = io.StringIO()
+    chunk[COLUMNS].to_csv(buffer, index=False, header=False, date_format="%Y-%m-%d %H:%M:%S")
+    buffer.seek(0)
     try:
-        cur.executemany(f"""
-            INSERT INTO {TABLE_NAME} (time, latitude, longitude, depth, temperature, salinity)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """, rows_batch)
+        cur.copy_expert(f"COPY {table} ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
         conn.commit()
-    except Exception as final_err:
+        return len(chunk), 0
+    except Exception as batch_err:
+        conn.rollback()
+        tqdm.write(f"⚠️ Batch COPY failed: {batch_err}")
+        return 0, len(chunk)
+
+
+LOADERS = {
+    "copy": copy_chunk,
+    "insert": insert_chunk,
+}
+
+
+def load_file(conn, cur, path, mode=LOAD_MODE, table=TABLE_NAME):
+    """Load a CSV file or Parquet dataset chunk by chunk. Returns (rows loaded, rows failed)."""
+    load_chunk = LOADERS[mode]
+    loaded = failed = 0
+    for chunk in tqdm(read_chunks(path, CHUNK_SIZE, parse_dates=["time"]), desc="Processing CSV", unit="chunk"):
+        ok, bad = load_chunk(conn, cur, prepare_chunk(chunk), table)
+        loaded += ok
+        failed += bad
+    return loaded, failed
+
+
+# === Parallel load into a staging table ===
+def load_piece(path, piece, mode, table):
+    """Worker entry point: load one piece of the input over the worker's own connection."""
+    load_chunk = LOADERS[mode]
+    conn = connect()
+    cur = conn.cursor()
+    started = time.perf_counter()
+    loaded = failed = 0
+    try:
+        for chunk in read_piece_chunks(path, piece, CHUNK_SIZE, parse_dates=["time"]):
+            ok, bad = load_chunk(conn, cur, prepare_chunk(chunk), table)
+            loaded += ok
+            failed += bad
+    finally:
+        cur.close()
+        conn.close()
+    return os.getpid(), loaded, failed, time.perf_counter() - started
+
+
+def swap_tables(conn, staging, table=TABLE_NAME):
+    """
+    Atomically replace `table` with `staging` (both schema-qualified). The
+    staging table's partitions and indexes are renamed along with it, so the
+    next load can create a fresh staging table under the same names. The data
+    version is bumped in the same transaction.
+    """
+    table_name = table.split(".", 1)[1]
+    staging_name = staging.split(".", 1)[1]
+    old = f"{table}_old"
+    cur = conn.cursor()
+    cur.execute(f"DROP TABLE IF EXISTS {old};")
+    cur.execute(f"ALTER TABLE IF EXISTS {table} RENAME TO {table_name}_old;")
+    cur.execute(f"DROP TABLE IF EXISTS {old};")
+    cur.execute(f"ALTER TABLE {staging} RENAME TO {table_name};")
+
+    cur.execute("""
+        SELECT c.relname, c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = %s AND c.relkind IN ('r', 'p', 'i', 'I') AND starts_with(c.relname, %s);
+    """, (SCHEMA_NAME, f"{staging_name}_"))
+    for relname, relkind in cur.fetchall():
+        kind = "INDEX" if relkind in ("i", "I") else "TABLE"
+        renamed = table_name + relname[len(staging_name):]
+        cur.execute(f'ALTER {kind} {SCHEMA_NAME}."{relname}" RENAME TO "{renamed}";')
+    bump_data_version(cur)
+    conn.commit()
+    cur.close()
+
+
+def load_parallel(conn, path, workers, mode=LOAD_MODE, table=TABLE_NAME):
+    """
+    Split the input into pieces and load them concurrently, one connection per
+    worker process, into a fresh staging table. The staging table replaces
+    `table` only if its row count reconciles with what the workers loaded;
+    readers keep seeing the old table until then.
+    Returns (rows loaded, rows failed).
+    """
+    staging = f"{table}_staging"
+    cur = conn.cursor()
+    cur.execute(f"DROP TABLE IF EXISTS {staging};")
+    create_table(cur, staging)
+    conn.commit()
+
+    pieces = split_dataset(path, workers * PIECES_PER_WORKER)
+    per_worker = {}
+    loaded = failed = 0
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(load_piece, path, piece, mode, staging) for piece in pieces]
+        for future in tqdm(as_completed(futures), total=len(futures), desc=f"Loading pieces ({workers} workers)",
+                           unit="piece"):
+            pid, ok, bad, seconds = future.result()
+            stats = per_worker.setdefault(pid, [0, 0, 0.0])
+            stats[0] += ok
+            stats[1] += bad
+            stats[2] += seconds
+            loaded += ok
+            failed += bad
+    elapsed = time.perf_counter() - started
+
+    print("\n⚙️ Per-worker throughput:")
+    for i, (pid, (ok, bad, seconds)) in enumerate(sorted(per_worker.items()), start=1):
+        rate = ok / seconds if seconds else 0
+        print(f"  worker {i} (pid {pid}): {ok} rows in {seconds:.1f}s → {rate:,.0f} rows/s ({bad} failed)")
+    print(f"  total: {loaded} rows in {elapsed:.1f}s → {loaded / elapsed if elapsed else 0:,.0f} rows/s")
+
+    cur.execute(f"SELECT COUNT(*) FROM {staging};")
+    staged = cur.fetchone()[0]
+    print("\n🧮 Row-count reconciliation:")
+    print(f"  rows read from input:  {loaded + failed}")
+    print(f"  rows loaded by workers: {loaded}")
+    print(f"  rows in failed batches: {failed}")
+    print(f"  rows in {staging}: {staged}")
+    cur.close()
+
+    if staged != loaded:
+        print(f"❌ Staging count does not match loaded rows; leaving {staging} in place and {table} untouched.")
+        return loaded, failed
+    if failed:
+        print(f"⚠️ {failed} rows failed to load; swapping in the rows that did.")
+
+    build_indexes(conn, staging)
+    swap_tables(conn, staging, table)
+    print(f"🔁 Swapped {staging} into place as {table}")
+    return loaded, failed
+
+
+if __name__ == "__main__":
+    CSV_FILE = input("Enter CSV file or Parquet dataset path: ").strip()
+
+    if LOAD_MODE not in LOADERS:
+        raise ValueError(f"Unknown LOAD_MODE '{LOAD_MODE}'. Use one of: {list(LOADERS)}")
+
+    # === Connect to PostgreSQL ===
+    conn = connect()
+    cur = conn.cursor()
+
+    create_table(cur)
+    conn.commit()
+
+    # === Process CSV in chunks ===
+    try:
+        if LOAD_WORKERS > 1:
+            loaded, failed = load_parallel(conn, CSV_FILE, LOAD_WORKERS)
+        else:
+            loaded, failed = load_file(conn, cur, CSV_FILE)
+            build_indexes(conn)
+            mark_data_changed(conn)
+        print(f"\n📥 Rows loaded: {loaded}, rows in failed batches: {failed}")
+    except Exception as e:
+        print(f"❌ Error processing CSV: {e}")
         conn.rollback()
-        print(f"⚠️ Final batch insert failed: {final_err}")
+        mark_data_changed(conn)  # batches committed before the error are visible to queries
 
-print(f"\n🎉 Finished! Data inserted into PostgreSQL table `{TABLE_NAME}`")
+    print(f"\n🎉 Finished! Data inserted into PostgreSQL table `{TABLE_NAME}`")
 
-query = f"SELECT * FROM {TABLE_NAME} LIMIT 5;"
-df = pd.read_sql(query, conn)
+    query = f"SELECT * FROM {TABLE_NAME} LIMIT 5;"
+    df = pd.read_sql(query, conn)
 
-print("\n📊 First 5 rows:")
-print(df)
+    print("\n📊 First 5 rows:")
+    print(df)
 
-query_count = f"SELECT COUNT(*) FROM {TABLE_NAME};"
-total_rows = pd.read_sql(query_count, conn).iloc[0, 0]
-print(f"\n✅ Total rows in table: {total_rows}")
+    query_count = f"SELECT COUNT(*) FROM {TABLE_NAME};"
+    total_rows = pd.read_sql(query_count, conn).iloc[0, 0]
+    print(f"\n✅ Total rows in table: {total_rows}")
 
-# Close cursor and connection
-cur.close()
-conn.close()
+    # Close cursor and connection
+    cur.close()
+    conn.close()
@@ -1,25 +1,208 @@
+import os
+import json
+import math
+import numpy as np
 import pandas as pd
+from datetime import datetime
+from tqdm import tqdm
+from datasetIO import read_chunks
 
-# === Load CSV ===
-file_path = input("Enter CSV file path: ")
-df = pd.read_csv(file_path)
-
-# === Convert time column to datetime if exists ===
-if 'time' in df.columns:
-    df['time'] = pd.to_datetime(df['time'], errors='coerce')  # Invalid dates become NaT
-
-# === Basic Info ===
-print("=== Basic Info ===")
-print(f"Number of rows: {df.shape[0]}")
-print(f"Number of columns: {df.shape[1]}")
-print(f"Column names: {list(df.columns)}")
-print("\nNumber of nulls in each column:")
-print(df.isnull().sum())
-
-# === Min and Max Values ===
-print("\n=== Min and Max Values ===")
-for col in df.columns:
-    if pd.api.types.is_numeric_dtype(df[col]) or pd.api.types.is_datetime64_any_dtype(df[col]):
-        print(f"{col} -> Min: {df[col].min()}, Max: {df[col].max()}")
+# Streaming profiler for the intermediate dataset (CSV file or Parquet dataset).
+# One pass over the data in chunks, with memory bounded by the chunk size and
+# a fixed-size quantile sample per column. Results go to a stats catalog
+# (<dataset>.stats.json) that other components can read instead of scanning.
+
+CHUNK_SIZE = 100000
+QUANTILE_SAMPLE = 100000  # values kept per column for approximate quantiles
+QUANTILES = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+STATS_SUFFIX = ".stats.json"
+
+
+class ColumnProfile:
+    """
+    Running statistics of one column: null count, min/max, mean/std (merged
+    per chunk with Chan's parallel variance update) and a uniform random
+    sample for quantiles. The sample keeps the values with the smallest random
+    keys seen so far, so it stays uniform however the chunks are sized.
+    """
+
+    def __init__(self, name, sample_size=QUANTILE_SAMPLE, seed=0):
+        self.name = name
+        self.kind = None  # "numeric", "datetime" or "other", decided by the first chunk
+        self.count = 0
+        self.nulls = 0
+        self.min = None
+        self.max = None
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.sample_size = sample_size
+        self.rng = np.random.default_rng(seed)
+        self.keys = np.empty(0)
+        self.sample = np.empty(0)
+
+    def update(self, series):
+        if self.kind is None:
+            if pd.api.types.is_datetime64_any_dtype(series):
+                self.kind = "datetime"
+            elif pd.api.types.is_numeric_dtype(series):
+                self.kind = "numeric"
+            else:
+                self.kind = "other"
+
+        if self.kind == "datetime":
+            series = pd.to_datetime(series, errors="coerce")
+        elif self.kind == "numeric":
+            series = pd.to_numeric(series, errors="coerce")
+
+        nulls = int(series.isna().sum())
+        self.nulls += nulls
+        if self.kind == "other":
+            self.count += len(series) - nulls
+            return
+
+        values = series.dropna()
+        if self.kind == "datetime":
+            values = (values - pd.Timestamp(0)).dt.total_seconds()  # seconds since the epoch
+        values = values.to_numpy(dtype=float)
+        n = len(values)
+        if not n:
+            return
+
+        chunk_min, chunk_max = values.min(), values.max()
+        self.min = chunk_min if self.min is None else min(self.min, chunk_min)
+        self.max = chunk_max if self.max is None else max(self.max, chunk_max)
+
+        chunk_mean = values.mean()
+        chunk_m2 = ((values - chunk_mean) ** 2).sum()
+        total = self.count + n
+        delta = chunk_mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += chunk_m2 + delta ** 2 * self.count * n / total
+        self.count = total
+
+        self.keys = np.concatenate([self.keys, self.rng.random(n)])
+        self.sample = np.concatenate([self.sample, values])
+        if len(self.keys) > self.sample_size:
+            keep = np.argpartition(self.keys, self.sample_size)[:self.sample_size]
+            self.keys = self.keys[keep]
+            self.sample = self.sample[keep]
+
+    def _value(self, x):
+        if x is None:
+            return None
+        if self.kind == "datetime":
+            return pd.Timestamp(x, unit="s").isoformat()
+        return float(x)
+
+    def to_dict(self):
+        stats = {"kind": self.kind, "count": int(self.count), "nulls": self.nulls}
+        if self.kind == "other" or not self.count:
+            return stats
+        std = math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else None
+        stats.update({
+            "min": self._value(self.min),
+            "max": self._value(self.max),
+            "mean": self._value(self.mean),
+            # seconds for datetime columns
+            "std": std,
+            "quantiles": {f"p{round(q * 100):02d}": self._value(v)
+                          for q, v in zip(QUANTILES, np.quantile(self.sample, QUANTILES))},
+            # exact when every value fitted in the sample
+            "quantiles_exact": self.count <= self.sample_size,
+        })
+        return stats
+
+
+def profile_dataset(path, chunksize=CHUNK_SIZE):
+    """Profile a CSV file or Parquet dataset in one chunked pass."""
+    profiles = {}
+    rows = 0
+    for chunk in tqdm(read_chunks(path, chunksize), desc="Profiling", unit="chunk"):
+        if "time" in chunk.columns:
+            chunk["time"] = pd.to_datetime(chunk["time"], errors="coerce")  # Invalid dates become NaT
+        rows += len(chunk)
+        for col in chunk.columns:
+            profiles.setdefault(col, ColumnProfile(col)).update(chunk[col])
+
+    return {
+        "source": os.path.abspath(path),
+        "fingerprint": source_fingerprint(path),
+        "profiled_at": datetime.now().isoformat(timespec="seconds"),
+        "rows": rows,
+        "columns": {name: profile.to_dict() for name, profile in profiles.items()},
+    }
+
+
+# === Stats catalog ===
+def stats_path_for(path):
+    return str(path).rstrip("/\\") + STATS_SUFFIX
+
+
+def source_fingerprint(path):
+    """Size and modification time of a CSV file, or of all files of a Parquet dataset."""
+    if not os.path.isdir(path):
+        st = os.stat(path)
+        return {"files": 1, "size": st.st_size, "mtime": st.st_mtime_ns}
+    files = size = mtime = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            if name.endswith(".parquet"):
+                st = os.stat(os.path.join(root, name))
+                files += 1
+                size += st.st_size
+                mtime = max(mtime, st.st_mtime_ns)
+    return {"files": files, "size": size, "mtime": mtime}
+
+
+def write_catalog(path, stats):
+    """Write the stats catalog next to the dataset (atomic replace)."""
+    catalog_path = stats_path_for(path)
+    tmp_path = catalog_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(stats, f, indent=2)
+    os.replace(tmp_path, catalog_path)
+    return catalog_path
+
+
+def read_catalog(path):
+    """Stats for a dataset, or None if there is no catalog or the data changed since."""
+    catalog_path = stats_path_for(path)
+    if not os.path.exists(catalog_path) or not os.path.exists(path):
+        return None
+    with open(catalog_path) as f:
+        stats = json.load(f)
+    if stats.get("fingerprint") != source_fingerprint(path):
+        return None
+    return stats
+
+
+if __name__ == "__main__":
+    file_path = input("Enter CSV file or Parquet dataset path: ").strip()
+    stats = read_catalog(file_path)
+    if stats is None:
+        stats = profile_dataset(file_path)
+        print(f"📝 Stats catalog written to {write_catalog(file_path, stats)}")
     else:
-        print(f"{col} -> Non-numeric/categorical column")
+        print(f"📚 Using stats catalog from {stats['profiled_at']} ({stats_path_for(file_path)})")
+
+    # === Basic Info ===
+    print("\n=== Basic Info ===")
+    print(f"Number of rows: {stats['rows']}")
+    print(f"Number of columns: {len(stats['columns'])}")
+    print(f"Column names: {list(stats['columns'])}")
+    print("\nNumber of nulls in each column:")
+    for col, col_stats in stats["columns"].items():
+        print(f"{col:<12} {col_stats['nulls']}")
+
+    # === Min, Max, Mean, Std and Quantiles ===
+    print("\n=== Min and Max Values ===")
+    for col, col_stats in stats["columns"].items():
+        if col_stats["kind"] == "other":
+            print(f"{col} -> Non-numeric/categorical column")
+        elif not col_stats["count"]:
+            print(f"{col} -> No values")
+        else:
+            print(f"{col} -> Min: {col_stats['min']}, Max: {col_stats['max']}, "
+                  f"Mean: {col_stats['mean']}, Std: {col_stats['std']}")
+            approx = "" if col_stats["quantiles_exact"] else " (approx.)"
+            print(f"    quantiles{approx}: {col_stats['quantiles']}")
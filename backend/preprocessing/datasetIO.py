@@ -0,0 +1,271 @@
+import io
+import os
+import json
+import shutil
+import pandas as pd
+
+# Shared reader/writer for the intermediate dataset produced by nc_to_CSV.py.
+# Two formats are supported:
+#   - csv:     a single text file (data.csv)
+#   - parquet: a directory of Parquet files partitioned as year=YYYY/depth_band=NNN
+# pyarrow is only imported when a Parquet dataset is actually used.
+
+COLUMNS = ["time", "latitude", "longitude", "depth", "temperature", "salinity"]
+DEPTH_BAND = 100  # metres of 10 m depth bins grouped into one partition
+MAX_PARTITIONS = 100000
+
+# Names starting with "_" are skipped by pyarrow's dataset discovery
+STAGING_DIR = "_staging"
+COMPACT_TMP = "_compacted.tmp"
+COMPACT_MARKER = "_compacting.json"
+
+
+def _arrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.dataset as pads
+    except ImportError as e:
+        raise ImportError("Parquet support needs pyarrow: pip install pyarrow") from e
+    return pa, pads
+
+
+def is_parquet(path):
+    """A Parquet dataset is either a directory or a single *.parquet file."""
+    return os.path.isdir(path) or str(path).endswith(".parquet")
+
+
+def _schema():
+    pa, _ = _arrow()
+    return pa.schema([
+        ("time", pa.timestamp("s")),
+        ("latitude", pa.float64()),
+        ("longitude", pa.float64()),
+        ("depth", pa.int32()),
+        ("temperature", pa.float64()),
+        ("salinity", pa.float64()),
+        ("year", pa.int32()),
+        ("depth_band", pa.int32()),
+        ("file_id", pa.int64()),  # manifest id of the source NetCDF file
+    ])
+
+
+def _partitioning():
+    pa, pads = _arrow()
+    return pads.partitioning(pa.schema([("year", pa.int32()), ("depth_band", pa.int32())]), flavor="hive")
+
+
+def write_parquet(df, dataset_dir, part_name):
+    """
+    Write converter rows into the partitioned dataset. Every call writes its own
+    files, named part-<part_name>-<n>.parquet, so concurrent writers never clash
+    and files inside a partition sort in write order. Files are written under
+    _staging/ (which readers ignore) and moved into place once complete, so a
+    killed writer never leaves a truncated file in a partition.
+    """
+    pa, pads = _arrow()
+    df = df.copy()
+    df["time"] = pd.to_datetime(df["time"], errors="coerce")
+    df["year"] = df["time"].dt.year.astype("Int32")
+    df["depth_band"] = (df["depth"] // DEPTH_BAND * DEPTH_BAND).astype("int32")
+    if "file_id" not in df.columns:
+        df["file_id"] = None
+    table = pa.Table.from_pandas(df[COLUMNS + ["year", "depth_band", "file_id"]], schema=_schema(),
+                                 preserve_index=False)
+
+    staging = os.path.join(dataset_dir, STAGING_DIR, part_name)
+    pads.write_dataset(
+        table,
+        staging,
+        format="parquet",
+        partitioning=_partitioning(),
+        basename_template=f"part-{part_name}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+        max_partitions=MAX_PARTITIONS,
+    )
+    for root, _, files in os.walk(staging):
+        target = os.path.join(dataset_dir, os.path.relpath(root, staging))
+        for f in files:
+            os.makedirs(target, exist_ok=True)
+            os.replace(os.path.join(root, f), os.path.join(target, f))
+    shutil.rmtree(staging, ignore_errors=True)
+
+
+def _finish_compaction(root):
+    """Roll an interrupted compaction of one partition forward or back."""
+    marker = os.path.join(root, COMPACT_MARKER)
+    tmp_path = os.path.join(root, COMPACT_TMP)
+    if not os.path.exists(marker):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return
+    if os.path.exists(tmp_path):
+        # stopped before the swap: the old parts are still authoritative
+        os.remove(tmp_path)
+    else:
+        # stopped after the swap: the listed parts are already in part-0
+        with open(marker) as f:
+            for name in json.load(f):
+                path = os.path.join(root, name)
+                if os.path.exists(path):
+                    os.remove(path)
+    os.remove(marker)
+
+
+def compact_partitions(dataset_dir, live_ids=None):
+    """
+    Rewrite every partition directory holding several part files as a single
+    file, concatenating the parts in file-name (i.e. write) order. When
+    `live_ids` is given, rows whose file_id is not in it (files that were
+    re-ingested, or rows from an interrupted run) are dropped as well.
+    """
+    pa, _ = _arrow()
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    shutil.rmtree(os.path.join(dataset_dir, STAGING_DIR), ignore_errors=True)
+
+    live = pa.array(sorted(live_ids), type=pa.int64()) if live_ids is not None else None
+    for root, _, files in os.walk(dataset_dir):
+        _finish_compaction(root)
+        parts = sorted(f for f in os.listdir(root) if f.endswith(".parquet"))
+        if not parts:
+            continue
+        paths = [os.path.join(root, f) for f in parts]
+
+        dirty = False
+        if live is not None:
+            for path in paths:
+                ids = pq.read_table(path, columns=["file_id"], partitioning=None).column("file_id")
+                if not pc.all(pc.is_in(ids, value_set=live)).as_py():
+                    dirty = True
+                    break
+        if len(parts) < 2 and not dirty:
+            continue
+
+        table = pa.concat_tables([pq.read_table(p, partitioning=None) for p in paths])
+        if live is not None:
+            table = table.filter(pc.is_in(table.column("file_id"), value_set=live))
+
+        # new file -> marker naming what it supersedes -> swap -> delete the rest
+        compacted = "part-0.parquet"
+        if table.num_rows:
+            pq.write_table(table, os.path.join(root, COMPACT_TMP))
+        superseded = [f for f in parts if f != compacted or not table.num_rows]
+        marker = os.path.join(root, COMPACT_MARKER)
+        with open(marker + ".tmp", "w") as f:
+            json.dump(superseded, f)
+        os.replace(marker + ".tmp", marker)
+        if table.num_rows:
+            os.replace(os.path.join(root, COMPACT_TMP), os.path.join(root, compacted))
+        _finish_compaction(root)
+        if not os.listdir(root):
+            os.rmdir(root)
+
+
+def _partition_filter(years=None, depths=None):
+    _, pads = _arrow()
+    expr = None
+    if years is not None:
+        expr = pads.field("year").isin(list(years))
+    if depths is not None:
+        depths = list(depths)
+        bands = sorted({d // DEPTH_BAND * DEPTH_BAND for d in depths})
+        depth_expr = pads.field("depth_band").isin(bands) & pads.field("depth").isin(depths)
+        expr = depth_expr if expr is None else expr & depth_expr
+    return expr
+
+
+def open_dataset(path):
+    _, pads = _arrow()
+    return pads.dataset(path, format="parquet", partitioning=_partitioning())
+
+
+def read_chunks(path, chunksize, columns=None, years=None, depths=None, **csv_kwargs):
+    """
+    Yield DataFrames of at most `chunksize` rows from either format.
+
+    For Parquet, `years`/`depths` prune whole partitions before any file is
+    opened (depths via their depth band). Extra keyword arguments are passed
+    to pd.read_csv for CSV input.
+    """
+    if not is_parquet(path):
+        yield from pd.read_csv(path, chunksize=chunksize, usecols=columns, **csv_kwargs)
+        return
+
+    columns = columns or COLUMNS
+    dataset = open_dataset(path)
+    scanner = dataset.scanner(columns=columns, filter=_partition_filter(years, depths), batch_size=chunksize)
+    for batch in scanner.to_batches():
+        if batch.num_rows:
+            yield batch.to_pandas()
+
+
+def read_frame(path, columns=None, years=None, depths=None, **csv_kwargs):
+    """Load the whole dataset (or the selected partitions) into one DataFrame."""
+    if not is_parquet(path):
+        return pd.read_csv(path, usecols=columns, **csv_kwargs)
+    columns = columns or COLUMNS
+    table = open_dataset(path).to_table(columns=columns, filter=_partition_filter(years, depths))
+    return table.to_pandas()
+
+
+# === Splitting a dataset into independently readable pieces ===
+class _RangeFile(io.RawIOBase):
+    """Read-only view of bytes [start, end) of an open binary file."""
+
+    def __init__(self, f, start, end):
+        self.f = f
+        self.end = end
+        f.seek(start)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), self.end - self.f.tell())
+        if n <= 0:
+            return 0
+        data = self.f.read(n)
+        b[:len(data)] = data
+        return len(data)
+
+
+def split_dataset(path, n_pieces):
+    """
+    Split a dataset into at most n_pieces pieces that can be read in parallel:
+    line-aligned byte ranges of a CSV file, or groups of Parquet files.
+    """
+    if is_parquet(path):
+        files = sorted(open_dataset(path).files)
+        size = -(-len(files) // n_pieces) if files else 1
+        return [("parquet", files[i:i + size]) for i in range(0, len(files), size)]
+
+    total = os.path.getsize(path)
+    with open(path, "rb") as f:
+        f.readline()  # header
+        bounds = [f.tell()]
+        for i in range(1, n_pieces):
+            target = max(total * i // n_pieces, bounds[-1])
+            f.seek(target)
+            if target > bounds[0]:
+                f.readline()  # move to the start of the next line
+            bounds.append(min(f.tell(), total))
+    bounds.append(total)
+    return [("csv", start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def read_piece_chunks(path, piece, chunksize, **csv_kwargs):
+    """Yield DataFrames of at most `chunksize` rows from one piece returned by split_dataset."""
+    if piece[0] == "parquet":
+        _, pads = _arrow()
+        dataset = pads.dataset(piece[1], format="parquet")
+        for batch in dataset.scanner(columns=COLUMNS, batch_size=chunksize).to_batches():
+            if batch.num_rows:
+                yield batch.to_pandas()
+        return
+
+    _, start, end = piece
+    with open(path, "rb") as f:
+        names = f.readline().decode().strip().split(",")
+        stream = io.BufferedReader(_RangeFile(f, start, end))
+        yield from pd.read_csv(stream, header=None, names=names, chunksize=chunksize, **csv_kwargs)
@@ -0,0 +1,113 @@
+import json
+import time
+import statistics
+from CSV_to_SQL import connect, TABLE_NAME
+
+# Before/after timings for the query shapes SQLagent produces (see the prompt
+# rules in agents/Query.py). "Before" is a flat, unindexed copy of the table in
+# a temporary table; "after" is the table as loaded (partitioned + indexed).
+
+REPEATS = 5
+REPORT_PATH = "index_report.json"
+
+# Arabian Sea, the example region used in agents/Query.py
+REGION = {"lat_min": 0, "lat_max": 25, "lon_min": 50, "lon_max": 78}
+
+QUERIES = {
+    # rules 1-3 and 7: requested column + time, region from a place name, default depth
+    "region_year_default_depth": """
+        SELECT time, salinity FROM {table}
+        WHERE latitude BETWEEN {lat_min} AND {lat_max} AND longitude BETWEEN {lon_min} AND {lon_max}
+          AND depth = 10 AND time BETWEEN '{year}-01-01' AND '{year}-12-31'
+    """,
+    # rule 6: aggregations named avg_<column>
+    "monthly_avg_year": """
+        SELECT date_trunc('month', time) AS time, AVG(temperature) AS avg_temperature FROM {table}
+        WHERE depth = 10 AND time >= '{year}-01-01' AND time < '{next_year}-01-01'
+        GROUP BY 1 ORDER BY 1
+    """,
+    "month_default_depth": """
+        SELECT time, temperature FROM {table}
+        WHERE depth = 10 AND time BETWEEN '{year}-03-01' AND '{year}-03-31'
+    """,
+    "region_all_years": """
+        SELECT time, temperature, salinity FROM {table}
+        WHERE latitude BETWEEN {lat_min} AND {lat_max} AND longitude BETWEEN {lon_min} AND {lon_max}
+          AND depth = 10
+    """,
+    "region_depth_range_year": """
+        SELECT time, depth, temperature FROM {table}
+        WHERE latitude BETWEEN {lat_min} AND {lat_max} AND longitude BETWEEN {lon_min} AND {lon_max}
+          AND depth BETWEEN 0 AND 500 AND time BETWEEN '{year}-01-01' AND '{year}-12-31'
+    """,
+}
+
+
+def plan_summary(cur, sql):
+    """Scan node types and number of relations scanned, from EXPLAIN."""
+    cur.execute(f"EXPLAIN (FORMAT JSON) {sql}")
+    nodes, relations = set(), set()
+    stack = [cur.fetchone()[0][0]["Plan"]]
+    while stack:
+        node = stack.pop()
+        if "Relation Name" in node:
+            nodes.add(node["Node Type"])
+            relations.add(node["Relation Name"])
+        stack.extend(node.get("Plans", []))
+    return sorted(nodes), len(relations)
+
+
+def time_query(cur, sql):
+    timings = []
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        cur.execute(sql)
+        rows = len(cur.fetchall())
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), rows
+
+
+def run_report(conn, table=TABLE_NAME):
+    cur = conn.cursor()
+    # busiest year, so the time-filtered queries return rows
+    cur.execute(f"SELECT EXTRACT(YEAR FROM time)::int FROM {table} WHERE time IS NOT NULL "
+                f"GROUP BY 1 ORDER BY COUNT(*) DESC LIMIT 1;")
+    row = cur.fetchone()
+    year = row[0] if row else 2014
+    params = dict(REGION, year=year, next_year=year + 1)
+
+    print("⏳ Copying the table into an unindexed baseline...")
+    cur.execute(f"CREATE TEMP TABLE index_baseline AS SELECT * FROM {table};")
+    cur.execute("ANALYZE index_baseline;")
+
+    report = {"table": table, "year": year, "region": REGION, "repeats": REPEATS, "queries": {}}
+    for name, template in QUERIES.items():
+        entry = {}
+        for label, target in (("before", "index_baseline"), ("after", table)):
+            sql = template.format(table=target, **params)
+            ms, rows = time_query(cur, sql)
+            nodes, relations = plan_summary(cur, sql)
+            entry[label] = {"ms": round(ms, 2), "rows": rows, "scans": nodes, "relations": relations}
+        entry["speedup"] = round(entry["before"]["ms"] / entry["after"]["ms"], 1) if entry["after"]["ms"] else None
+        report["queries"][name] = entry
+
+    cur.execute("DROP TABLE index_baseline;")
+    cur.close()
+    return report
+
+
+if __name__ == "__main__":
+    conn = connect()
+    report = run_report(conn)
+    conn.close()
+
+    print(f"\n📊 Median of {REPEATS} runs on {report['table']} (year {report['year']}):")
+    print(f"{'query':<28}{'before ms':>11}{'after ms':>11}{'speedup':>9}  after plan")
+    for name, entry in report["queries"].items():
+        before, after = entry["before"], entry["after"]
+        print(f"{name:<28}{before['ms']:>11.1f}{after['ms']:>11.1f}{entry['speedup'] or 0:>8.1f}x  "
+              f"{', '.join(after['scans'])} on {after['relations']} relation(s)")
+
+    with open(REPORT_PATH, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n📝 Report written to {REPORT_PATH}")
@@ -0,0 +1,138 @@
+import os
+import json
+import hashlib
+
+# Journal of NetCDF files that made it into the intermediate dataset.
+# One JSON object per line, appended as soon as a file's rows are committed,
+# so an interrupted run loses at most the batch that was in flight. When a
+# path appears more than once the last line wins.
+
+MANIFEST_SUFFIX = ".manifest.jsonl"
+
+
+def manifest_path_for(output):
+    return str(output).rstrip("/\\") + MANIFEST_SUFFIX
+
+
+def file_hash(path, block_size=1 << 20):
+    """SHA-256 of a file's content, read in 1 MiB blocks."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def file_stat(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+class IngestManifest:
+    """
+    Tracks path, size, mtime and content hash of every ingested file, plus
+    where its rows live: a byte range of the CSV output, or a file_id stored
+    with the rows of the Parquet dataset.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.next_id = 1
+        if os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        with open(self.path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # a torn last line from an interrupted write
+                    continue
+                if "next_id" in entry:
+                    self.next_id = max(self.next_id, entry["next_id"])
+                    continue
+                self.entries[entry["path"]] = entry
+                self.next_id = max(self.next_id, entry.get("file_id", 0) + 1)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def plan(self, nc_files):
+        """
+        Sort files into new / changed / unchanged, and list manifest paths that
+        no longer exist on disk. Size and mtime decide first; a file whose
+        stat changed is only re-ingested if its content hash changed too.
+        """
+        report = {"new": [], "changed": [], "unchanged": [], "removed": []}
+        for nc_file in nc_files:
+            entry = self.entries.get(nc_file)
+            if entry is None:
+                report["new"].append(nc_file)
+                continue
+            size, mtime = file_stat(nc_file)
+            if entry["size"] == size and entry["mtime"] == mtime:
+                report["unchanged"].append(nc_file)
+                continue
+            if file_hash(nc_file) == entry["sha256"]:
+                # touched but identical: refresh the stat so we don't hash it again
+                self.record([dict(entry, size=size, mtime=mtime)])
+                report["unchanged"].append(nc_file)
+            else:
+                report["changed"].append(nc_file)
+
+        seen = set(nc_files)
+        report["removed"] = [p for p in self.entries if p not in seen]
+        return report
+
+    def allocate_ids(self, n):
+        """
+        Reserve n file ids. The reservation is journaled before any rows are
+        written, so ids held by rows of an interrupted run are never reused.
+        """
+        first = self.next_id
+        self.next_id += n
+        self._append([{"next_id": self.next_id}])
+        return list(range(first, first + n))
+
+    def record(self, entries):
+        """Append committed files to the journal."""
+        for entry in entries:
+            self.entries[entry["path"]] = entry
+        self._append(entries)
+
+    def _append(self, lines):
+        if not lines:
+            return
+        with open(self.path, "a") as f:
+            for line in lines:
+                f.write(json.dumps(line) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def forget(self, paths):
+        """Drop entries (e.g. files whose old rows were purged) from the journal."""
+        for path in paths:
+            self.entries.pop(path, None)
+        self.rewrite()
+
+    def live_ids(self):
+        return {e["file_id"] for e in self.entries.values()}
+
+    def csv_end(self):
+        """End offset of the last committed CSV range, or None if nothing is committed."""
+        ends = [e["offset"] + e["length"] for e in self.entries.values() if "offset" in e]
+        return max(ends) if ends else None
+
+    def rewrite(self):
+        """Rewrite the journal with one line per file (atomic replace)."""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps({"next_id": self.next_id}) + "\n")
+            for entry in self.entries.values():
+                f.write(json.dumps(entry) + "\n")
+        os.replace(tmp_path, self.path)
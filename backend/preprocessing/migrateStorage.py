@@ -0,0 +1,65 @@
+from CSV_to_SQL import (connect, create_table, build_indexes, swap_tables, cast_columns, STORAGE_TYPES,
+                        TABLE_NAME, TABLE_LAYOUT)
+
+# Rewrites an existing table with another column storage ("numeric" or
+# "compact", see STORAGE_TYPES in CSV_to_SQL.py). The copy is built in a
+# staging table, indexed, checked, and swapped in; readers keep using the old
+# table until the swap.
+
+
+def current_storage(cur, table=TABLE_NAME):
+    schema_name, table_name = table.split(".", 1)
+    cur.execute("""
+        SELECT data_type FROM information_schema.columns
+        WHERE table_schema = %s AND table_name = %s AND column_name = 'depth';
+    """, (schema_name, table_name))
+    row = cur.fetchone()
+    if row is None:
+        raise ValueError(f"Table {table} not found")
+    return "compact" if row[0] == "smallint" else "numeric"
+
+
+def migrate_storage(conn, storage, table=TABLE_NAME, layout=TABLE_LAYOUT):
+    """Convert `table` to `storage` types. Returns the number of rows copied."""
+    if storage not in STORAGE_TYPES:
+        raise ValueError(f"Unknown storage '{storage}'. Use one of: {list(STORAGE_TYPES)}")
+
+    cur = conn.cursor()
+    if storage == "compact":
+        cur.execute(f"SELECT COUNT(*) FROM {table} WHERE depth <> ROUND(depth) OR ABS(depth) > 32767;")
+        bad = cur.fetchone()[0]
+        if bad:
+            raise ValueError(f"{bad} rows have depths that do not fit SMALLINT metres; not migrating.")
+
+    staging = f"{table}_staging"
+    cur.execute(f"DROP TABLE IF EXISTS {staging};")
+    create_table(cur, staging, layout, storage)
+    cur.execute(f"INSERT INTO {staging} SELECT {cast_columns(storage)} FROM {table};")
+    copied = cur.rowcount
+    conn.commit()
+
+    cur.execute(f"SELECT COUNT(*) FROM {table};")
+    expected = cur.fetchone()[0]
+    cur.close()
+    if copied != expected:
+        raise RuntimeError(f"Copied {copied} of {expected} rows; leaving {staging} in place and {table} untouched.")
+
+    build_indexes(conn, staging)
+    swap_tables(conn, staging, table)
+    return copied
+
+
+if __name__ == "__main__":
+    conn = connect()
+    cur = conn.cursor()
+    storage = current_storage(cur)
+    cur.close()
+    print(f"📦 {TABLE_NAME} currently uses {storage} storage")
+
+    target = input(f"Convert to which storage {list(STORAGE_TYPES)}: ").strip()
+    if target == storage:
+        print("Nothing to do.")
+    else:
+        rows = migrate_storage(conn, target)
+        print(f"✅ {TABLE_NAME} rewritten with {target} storage ({rows} rows)")
+    conn.close()
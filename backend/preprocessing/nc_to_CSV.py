@@ -1,24 +1,40 @@
 import os
 import glob
+import json
+import time
+import shutil
+import tempfile
 import pandas as pd
 import numpy as np
 from tqdm import tqdm
+from pathlib import Path
+from dotenv import load_dotenv
 from datetime import datetime, timedelta
 from netCDF4 import Dataset
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datasetIO import COLUMNS, write_parquet, compact_partitions
+from ingestManifest import IngestManifest, manifest_path_for, file_hash, file_stat
 
-# === Config ===
-NC_DIR = input("Enter the directory where NC data is located: ")
-if not os.path.exists(NC_DIR):
-    raise FileNotFoundError(f"NC data directory {NC_DIR} not found")
+env_path = Path(__file__).resolve().parent.parent / ".env"
+load_dotenv(dotenv_path=env_path)
 
+# === Config ===
+OUTPUT_FORMAT = os.getenv("NC_OUTPUT_FORMAT", "csv")  # "csv" or "parquet"
 OUTPUT_CSV = "data.csv"
+OUTPUT_PARQUET = "data_parquet"  # partitioned as year=YYYY/depth_band=NNN
+CONVERTER = os.getenv("NC_CONVERTER", "vectorized")  # "vectorized" or "loop"
+WORKERS = int(os.getenv("NC_WORKERS", "1"))  # 1 = sequential, 0 = one per CPU core
+FILES_PER_TASK = int(os.getenv("NC_FILES_PER_TASK", "16"))  # files per worker task / shard
+INCREMENTAL = os.getenv("NC_INCREMENTAL", "1") == "1"  # 0 = rebuild everything from scratch
+
+JULD_BASE = datetime(1950, 1, 1)
 
 
 def juld_to_datetime(val):
     """Convert JULD to 'YYYY-MM-DD HH:MM:SS' (auto-detect unit)."""
     if val is None or np.isnan(val):
         return None
-    base = datetime(1950, 1, 1)
+    base = JULD_BASE
     v = float(val)
 
     try:
@@ -56,66 +72,420 @@ def assign_depth_bin(pres_val, step=10, tol=1):
     return None
 
 
-# Remove old CSV if exists
-if os.path.exists(OUTPUT_CSV):
-    os.remove(OUTPUT_CSV)
+# === Per-cell conversion (reference implementation) ===
+def convert_file_loop(nc_file):
+    """Convert one NetCDF file to a DataFrame by visiting every N_PROF x N_LEVELS cell."""
+    ds = Dataset(nc_file, "r")
 
-# Find all .nc files
-nc_files = glob.glob(os.path.join(NC_DIR, "**", "*.nc"), recursive=True)
-print(f"📂 Found {len(nc_files)} NetCDF files")
+    n_prof = len(ds.dimensions.get("N_PROF", [0]))
+    n_levels = len(ds.dimensions.get("N_LEVELS", [0]))
 
-with tqdm(total=len(nc_files), desc="Processing files", unit="file") as pbar:
-    for nc_file in nc_files:
-        try:
-            ds = Dataset(nc_file, "r")
-
-            n_prof = len(ds.dimensions.get("N_PROF", [0]))
-            n_levels = len(ds.dimensions.get("N_LEVELS", [0]))
-
-            rows = []
-            for p in range(n_prof):
-                juld_val = juld_to_datetime(ds.variables["JULD"][p]) if "JULD" in ds.variables else None
-                lat_val = float(ds.variables["LATITUDE"][p]) if "LATITUDE" in ds.variables else None
-                lon_val = float(ds.variables["LONGITUDE"][p]) if "LONGITUDE" in ds.variables else None
-
-                for l in range(n_levels):
-                    pres_val = ds.variables["PRES"][p, l] if "PRES" in ds.variables else np.nan
-                    temp_val = ds.variables["TEMP"][p, l] if "TEMP" in ds.variables else np.nan
-                    psal_val = ds.variables["PSAL"][p, l] if "PSAL" in ds.variables else np.nan
-
-                    if np.isnan(pres_val) and np.isnan(temp_val) and np.isnan(psal_val):
-                        continue
-
-                    # Round values
-                    lat_val_r = round(safe_float(lat_val), 5) if lat_val is not None else None
-                    lon_val_r = round(safe_float(lon_val), 5) if lon_val is not None else None
-                    pres_val_r = round(safe_float(pres_val), 5) if not np.isnan(safe_float(pres_val)) else None
-                    temp_val_r = round(safe_float(temp_val), 5) if not np.isnan(safe_float(temp_val)) else None
-                    psal_val_r = round(safe_float(psal_val), 5) if not np.isnan(safe_float(psal_val)) else None
-
-                    # Assign depth bin
-                    depth_bin = assign_depth_bin(pres_val_r)
-
-                    if depth_bin is not None:
-                        rows.append({
-                            "time": juld_val,
-                            "latitude": lat_val_r,
-                            "longitude": lon_val_r,
-                            "depth": depth_bin,  # ✅ depth instead of pressure
-                            "temperature": temp_val_r,
-                            "salinity": psal_val_r,
-                        })
-
-            ds.close()
-
-            # Append to CSV
-            if rows:
-                df = pd.DataFrame(rows, columns=["time", "latitude", "longitude", "depth", "temperature", "salinity"])
-                df.to_csv(OUTPUT_CSV, mode="a", header=not os.path.exists(OUTPUT_CSV), index=False)
+    rows = []
+    for p in range(n_prof):
+        juld_val = juld_to_datetime(ds.variables["JULD"][p]) if "JULD" in ds.variables else None
+        lat_val = float(ds.variables["LATITUDE"][p]) if "LATITUDE" in ds.variables else None
+        lon_val = float(ds.variables["LONGITUDE"][p]) if "LONGITUDE" in ds.variables else None
+
+        for l in range(n_levels):
+            pres_val = ds.variables["PRES"][p, l] if "PRES" in ds.variables else np.nan
+            temp_val = ds.variables["TEMP"][p, l] if "TEMP" in ds.variables else np.nan
+            psal_val = ds.variables["PSAL"][p, l] if "PSAL" in ds.variables else np.nan
+
+            if np.isnan(pres_val) and np.isnan(temp_val) and np.isnan(psal_val):
+                continue
+
+            # Round values
+            lat_val_r = round(safe_float(lat_val), 5) if lat_val is not None else None
+            lon_val_r = round(safe_float(lon_val), 5) if lon_val is not None else None
+            pres_val_r = round(safe_float(pres_val), 5) if not np.isnan(safe_float(pres_val)) else None
+            temp_val_r = round(safe_float(temp_val), 5) if not np.isnan(safe_float(temp_val)) else None
+            psal_val_r = round(safe_float(psal_val), 5) if not np.isnan(safe_float(psal_val)) else None
+
+            # Assign depth bin
+            depth_bin = assign_depth_bin(pres_val_r)
+
+            if depth_bin is not None:
+                rows.append({
+                    "time": juld_val,
+                    "latitude": lat_val_r,
+                    "longitude": lon_val_r,
+                    "depth": depth_bin,  # ✅ depth instead of pressure
+                    "temperature": temp_val_r,
+                    "salinity": psal_val_r,
+                })
+
+    ds.close()
+    return pd.DataFrame(rows, columns=COLUMNS)
+
+
+# === Vectorized conversion ===
+def read_variable(ds, name, shape):
+    """
+    Read a whole variable once as float64, with masked cells set to NaN.
+    Missing variables come back as an all-NaN array of the requested shape.
+    """
+    if name not in ds.variables:
+        return np.full(shape, np.nan)
+    index = tuple(slice(0, n) for n in shape)
+    values = ds.variables[name][index]
+    return np.ma.filled(np.ma.asarray(values).astype(np.float64), np.nan)
+
+
+def round_array(values, ndigits=5):
+    """
+    Element-wise equivalent of Python's round(x, ndigits) for a float64 array.
+
+    np.round scales, rounds half-to-even and scales back. For values that came
+    from float32 the scaling is exact, so the result matches Python bit for bit.
+    Wider inputs can land on a false tie after scaling; those few cells are
+    re-rounded with Python's correctly rounded round().
+    """
+    rounded = np.round(values, ndigits)
+    scaled = values * 10.0 ** ndigits
+    near_tie = np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5) < 1e-6
+    near_tie &= np.isfinite(values)
+    for idx in zip(*np.nonzero(near_tie)):
+        rounded[idx] = round(float(values[idx]), ndigits)
+    return rounded
+
+
+def depth_bins(pres, step=10, tol=1):
+    """Vectorized assign_depth_bin: returns (bins, valid_mask)."""
+    bins = np.rint(pres / step) * step
+    valid = np.abs(pres - bins) <= tol
+    return bins, valid
+
+
+# JULD unit -> (lower threshold, microseconds per unit), checked in this order
+JULD_UNITS = [
+    (1e15, 1),  # microseconds
+    (1e12, 1000),  # milliseconds
+    (1e9, 1000000),  # seconds
+    (-np.inf, 86400000000),  # days
+]
+
+
+def juld_array_to_strings(values):
+    """
+    Vectorized juld_to_datetime over a 1-D float array.
+
+    Mirrors how datetime.timedelta turns a float into whole microseconds: the
+    integer part is scaled exactly, the fractional part once in floating point,
+    and the leftover fraction is rounded half-to-even against the running total.
+    Values outside years 1000-9999 are handed to juld_to_datetime so the
+    strftime formatting stays identical.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(values.shape, None, dtype=object)
+    finite = np.isfinite(values)
+    if not finite.any():
+        return out
+
+    factor = np.zeros(values.shape, dtype=np.int64)
+    remaining = finite.copy()
+    for threshold, us_per_unit in JULD_UNITS:
+        pick = remaining & (values > threshold)
+        factor[pick] = us_per_unit
+        remaining &= ~pick
+
+    base = np.datetime64(JULD_BASE, "us")
+    lower = (np.datetime64("1000-01-01T00:00:00", "us") - base).astype(np.int64)
+    upper = (np.datetime64("9999-12-31T23:59:59.999999", "us") - base).astype(np.int64)
+
+    approx = values * factor
+    fast = finite & (approx > lower - 1e6) & (approx < upper + 1e6)
+
+    v = np.where(fast, values, 0.0)
+    f = np.where(fast, factor, 0)
+    frac, whole = np.modf(v)
+    total = whole.astype(np.int64) * f
+    frac_frac, frac_whole = np.modf(f.astype(np.float64) * frac)
+    total += frac_whole.astype(np.int64)
+
+    adjust = np.rint(frac_frac).astype(np.int64)
+    tie = np.abs(frac_frac) == 0.5
+    odd = (total % 2) != 0
+    adjust[tie] = np.where(odd[tie], np.sign(frac_frac[tie]), 0).astype(np.int64)
+    total += adjust
+
+    in_range = fast & (total >= lower) & (total <= upper)
+    stamps = (base + total[in_range].astype("timedelta64[us]")).astype("datetime64[s]")
+    out[in_range] = np.char.replace(np.datetime_as_string(stamps, unit="s"), "T", " ").tolist()
+
+    for idx in np.nonzero(finite & ~in_range)[0]:
+        out[idx] = juld_to_datetime(values[idx])
+    return out
+
+
+def convert_file_vectorized(nc_file):
+    """
+    Convert one NetCDF file to a DataFrame using whole-array NumPy operations.
+    Produces the same rows, in the same order, as convert_file_loop.
+    """
+    ds = Dataset(nc_file, "r")
+    try:
+        n_prof = len(ds.dimensions.get("N_PROF", [0]))
+        n_levels = len(ds.dimensions.get("N_LEVELS", [0]))
+
+        if "PRES" not in ds.variables:
+            return pd.DataFrame(columns=COLUMNS)
+
+        pres = read_variable(ds, "PRES", (n_prof, n_levels))
+        temp = read_variable(ds, "TEMP", (n_prof, n_levels))
+        psal = read_variable(ds, "PSAL", (n_prof, n_levels))
+        juld = read_variable(ds, "JULD", (n_prof,))
+        lat = read_variable(ds, "LATITUDE", (n_prof,))
+        lon = read_variable(ds, "LONGITUDE", (n_prof,))
+    finally:
+        ds.close()
 
+    bins, keep = depth_bins(round_array(pres))
+    prof_idx, level_idx = np.nonzero(keep)
+
+    times = juld_array_to_strings(juld)
+
+    return pd.DataFrame({
+        "time": times[prof_idx],
+        "latitude": round_array(lat)[prof_idx],
+        "longitude": round_array(lon)[prof_idx],
+        "depth": bins[prof_idx, level_idx].astype(np.int64),  # ✅ depth instead of pressure
+        "temperature": round_array(temp[prof_idx, level_idx]),
+        "salinity": round_array(psal[prof_idx, level_idx]),
+    }, columns=COLUMNS)
+
+
+CONVERTERS = {
+    "loop": convert_file_loop,
+    "vectorized": convert_file_vectorized,
+}
+
+
+# === Batch drivers ===
+def shard_path(shard_dir, task_id):
+    return os.path.join(shard_dir, f"shard_{task_id:06d}.csv")
+
+
+def convert_batch(task_id, items, out_dir, converter, output_format="csv", part_prefix=""):
+    """
+    Worker entry point: convert a batch of (path, file_id) items and write
+    their rows either to the task's own header-less CSV shard or as the task's
+    own files in the Parquet dataset. Returns one manifest entry per converted
+    file; errors are returned instead of printed so the parent can report them
+    through tqdm.
+    """
+    convert_file = CONVERTERS[converter]
+    path = shard_path(out_dir, task_id)
+    entries, frames, errors = [], [], []
+    for nc_file, file_id in items:
+        try:
+            size, mtime = file_stat(nc_file)
+            sha256 = file_hash(nc_file)
+            df = convert_file(nc_file)
         except Exception as e:
-            tqdm.write(f"❌ Error processing {os.path.basename(nc_file)}: {e}")
+            errors.append(f"❌ Error processing {os.path.basename(nc_file)}: {e}")
+            continue
+
+        entry = {"path": nc_file, "size": size, "mtime": mtime, "sha256": sha256,
+                 "file_id": file_id, "rows": len(df)}
+        if output_format == "parquet":
+            if not df.empty:
+                frames.append(df.assign(file_id=file_id))
+        else:
+            length = 0
+            if not df.empty:
+                before = os.path.getsize(path) if os.path.exists(path) else 0
+                df.to_csv(path, mode="a", header=False, index=False)
+                length = os.path.getsize(path) - before
+            entry["length"] = length
+        entries.append(entry)
+
+    if frames:
+        write_parquet(pd.concat(frames, ignore_index=True), out_dir, f"{part_prefix}{task_id:06d}")
+    return len(items), entries, errors
+
+
+def copy_range(src, dst, length, block_size=1 << 20):
+    while length > 0:
+        block = src.read(min(block_size, length))
+        if not block:
+            break
+        dst.write(block)
+        length -= len(block)
+
+
+def commit_shard(shard_dir, task_id, entries, output_csv, manifest):
+    """Append one shard to the CSV output, then journal its files with their byte ranges."""
+    if not os.path.exists(output_csv):
+        with open(output_csv, "wb") as out:
+            out.write((",".join(COLUMNS) + os.linesep).encode())
+
+    path = shard_path(shard_dir, task_id)
+    offset = os.path.getsize(output_csv)
+    if os.path.exists(path):
+        with open(path, "rb") as src, open(output_csv, "ab") as out:
+            shutil.copyfileobj(src, out)
+            out.flush()
+            os.fsync(out.fileno())
+        os.remove(path)
+
+    for entry in entries:
+        entry["offset"] = offset
+        offset += entry["length"]
+    manifest.record(entries)
+
+
+def recover_csv(output_csv, manifest):
+    """Drop rows appended after the last journaled file (left behind by an interrupted run)."""
+    if not os.path.exists(output_csv):
+        return
+    end = manifest.csv_end()
+    if end is None:
+        # nothing journaled yet (e.g. the first batch was interrupted): only the header belongs
+        with open(output_csv, "rb") as f:
+            header = f.readline()
+        if not header.endswith(b"\n"):
+            os.remove(output_csv)  # not even a complete header; commit_shard writes a new one
+            return
+        end = len(header)
+    if os.path.getsize(output_csv) > end:
+        print("🩹 Removing rows from an interrupted run...")
+        with open(output_csv, "r+b") as f:
+            f.truncate(end)
+
+
+def purge_csv_rows(output_csv, manifest, paths):
+    """Rewrite the CSV without the byte ranges of `paths`, and move the remaining ranges."""
+    stale = set(paths)
+    live = sorted((e for p, e in manifest.entries.items() if p not in stale), key=lambda e: e["offset"])
+    tmp_path = output_csv + ".tmp"
+    with open(output_csv, "rb") as src, open(tmp_path, "wb") as dst:
+        dst.write(src.readline())  # header
+        for entry in live:
+            src.seek(entry["offset"])
+            entry["offset"] = dst.tell()
+            copy_range(src, dst, entry["length"])
+    os.replace(tmp_path, output_csv)
+    manifest.forget(paths)
+
+
+def process_batched(nc_files, converter, output, output_format, workers, manifest,
+                    files_per_task=FILES_PER_TASK):
+    """
+    Convert files in fixed-size batches, across a process pool when workers > 1.
+    CSV shards are committed to the output strictly in batch order, so the
+    result is the same as a sequential run over the same file list. Parquet
+    batches write straight into the partitioned dataset under run- and
+    batch-numbered names. Each committed batch is journaled in the manifest,
+    which is what lets an interrupted run resume.
+
+    Returns (entries, number of failed files).
+    """
+    items = list(zip(nc_files, manifest.allocate_ids(len(nc_files))))
+    batches = [items[i:i + files_per_task] for i in range(0, len(items), files_per_task)]
+    if output_format == "parquet":
+        out_dir = output
+    else:
+        out_dir = tempfile.mkdtemp(prefix="nc_shards_", dir=os.path.dirname(os.path.abspath(output)))
+    part_prefix = f"{int(time.time()):010d}-"
+
+    committed, failed = [], 0
+    pending, next_task = {}, 0
+
+    def handle(task_id, n_done, entries, errors):
+        nonlocal next_task, failed
+        for err in errors:
+            tqdm.write(err)
+        failed += len(errors)
+        pbar.update(n_done)
+        if output_format == "parquet":
+            manifest.record(entries)
+            committed.extend(entries)
+            return
+        pending[task_id] = entries
+        while next_task in pending:
+            ready = pending.pop(next_task)
+            commit_shard(out_dir, next_task, ready, output, manifest)
+            committed.extend(ready)
+            next_task += 1
+
+    desc = f"Processing files ({workers} workers)" if workers > 1 else "Processing files"
+    try:
+        with tqdm(total=len(nc_files), desc=desc, unit="file") as pbar:
+            if workers > 1:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    futures = {
+                        executor.submit(convert_batch, task_id, batch, out_dir, converter, output_format,
+                                        part_prefix): task_id
+                        for task_id, batch in enumerate(batches)
+                    }
+                    for future in as_completed(futures):
+                        handle(futures[future], *future.result())
+            else:
+                for task_id, batch in enumerate(batches):
+                    handle(task_id, *convert_batch(task_id, batch, out_dir, converter, output_format,
+                                                   part_prefix))
+    finally:
+        if output_format == "csv":
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+    if output_format == "parquet":
+        print("🔗 Compacting partitions...")
+        compact_partitions(output, live_ids=manifest.live_ids())
+    return committed, failed
+
+
+if __name__ == "__main__":
+    NC_DIR = input("Enter the directory where NC data is located: ")
+    if not os.path.exists(NC_DIR):
+        raise FileNotFoundError(f"NC data directory {NC_DIR} not found")
+
+    if CONVERTER not in CONVERTERS:
+        raise ValueError(f"Unknown NC_CONVERTER '{CONVERTER}'. Use one of: {list(CONVERTERS)}")
+    if OUTPUT_FORMAT not in ("csv", "parquet"):
+        raise ValueError(f"Unknown NC_OUTPUT_FORMAT '{OUTPUT_FORMAT}'. Use 'csv' or 'parquet'")
+    workers = WORKERS if WORKERS > 0 else os.cpu_count()
+    output = OUTPUT_PARQUET if OUTPUT_FORMAT == "parquet" else OUTPUT_CSV
+    manifest_path = manifest_path_for(output)
+
+    # Start from scratch unless we have a manifest to continue from
+    if not INCREMENTAL or not os.path.exists(manifest_path):
+        if os.path.isdir(output):
+            shutil.rmtree(output)
+        elif os.path.exists(output):
+            os.remove(output)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+    manifest = IngestManifest(manifest_path)
+
+    # Find all .nc files (sorted so every run sees the same order)
+    nc_files = sorted(os.path.abspath(f) for f in glob.glob(os.path.join(NC_DIR, "**", "*.nc"), recursive=True))
+    print(f"📂 Found {len(nc_files)} NetCDF files (converter: {CONVERTER}, format: {OUTPUT_FORMAT})")
+
+    # Skip files flagged by the last verifyNC.py inspection (imported here: verifyNC imports this module)
+    from verifyNC import malformed_files
+    malformed = malformed_files(NC_DIR)
+    if malformed:
+        nc_files = [f for f in nc_files if f not in malformed]
+        print(f"🚫 Skipping {len(malformed)} files flagged as malformed by verifyNC.py")
+
+    plan = manifest.plan(nc_files)
+    print(f"📋 Manifest: {len(plan['new'])} new, {len(plan['changed'])} changed, "
+          f"{len(plan['unchanged'])} unchanged (skipped), {len(plan['removed'])} no longer on disk (rows kept)")
+
+    if OUTPUT_FORMAT == "csv":
+        recover_csv(output, manifest)
+        if plan["changed"]:
+            purge_csv_rows(output, manifest, plan["changed"])
+    else:
+        manifest.forget(plan["changed"])  # their old rows are dropped at compaction
+
+    todo = sorted(plan["new"] + plan["changed"])
+    committed, failed = process_batched(todo, CONVERTER, output, OUTPUT_FORMAT, workers, manifest)
+    manifest.rewrite()
 
-        pbar.update(1)
+    report = dict(plan, failed=sorted(set(todo) - {e["path"] for e in committed}), malformed=sorted(malformed))
+    with open(output.rstrip("/\\") + ".report.json", "w") as f:
+        json.dump(report, f, indent=2)
 
-print(f"\n🎉 Finished! Data saved to {OUTPUT_CSV}")
+    print(f"\n🎉 Finished! {len(committed)} files processed, {failed} failed, "
+          f"{len(plan['unchanged'])} skipped. Data saved to {output}")
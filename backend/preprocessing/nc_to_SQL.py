@@ -0,0 +1,113 @@
+import os
+import glob
+import time
+import itertools
+from collections import deque
+import pandas as pd
+from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor
+from nc_to_CSV import CONVERTERS, CONVERTER, WORKERS
+from verifyNC import malformed_files
+from CSV_to_SQL import (connect, create_table, build_indexes, mark_data_changed, prepare_chunk, copy_chunk,
+                        TABLE_NAME)
+
+# Streams NetCDF files straight into PostgreSQL:
+#   read + convert profiles  ->  re-batch rows  ->  COPY FROM STDIN
+# Every stage is a generator, so at most a few files' worth of rows is held
+# in memory at any time and nothing is written to disk as text.
+
+# === Config ===
+BATCH_ROWS = int(os.getenv("STREAM_BATCH_ROWS", "50000"))  # rows per COPY batch
+
+
+def convert_files(nc_files, converter=CONVERTER, workers=1):
+    """
+    Stage 1: yield one DataFrame per NetCDF file, in file order.
+    With workers > 1 files are converted in a process pool, keeping at most
+    2 * workers files in flight so memory stays bounded. Failed files are
+    reported through tqdm and skipped.
+    """
+    convert_file = CONVERTERS[converter]
+    with tqdm(total=len(nc_files), desc="Converting files", unit="file") as pbar:
+        if workers <= 1:
+            for nc_file in nc_files:
+                try:
+                    yield convert_file(nc_file)
+                except Exception as e:
+                    tqdm.write(f"❌ Error processing {os.path.basename(nc_file)}: {e}")
+                pbar.update(1)
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            files = iter(nc_files)
+            window = deque((f, executor.submit(convert_file, f)) for f in itertools.islice(files, 2 * workers))
+            while window:
+                nc_file, future = window.popleft()
+                next_file = next(files, None)
+                if next_file is not None:
+                    window.append((next_file, executor.submit(convert_file, next_file)))
+                try:
+                    yield future.result()
+                except Exception as e:
+                    tqdm.write(f"❌ Error processing {os.path.basename(nc_file)}: {e}")
+                pbar.update(1)
+
+
+def rebatch(frames, batch_rows=BATCH_ROWS):
+    """Stage 2: regroup per-file DataFrames into batches of about batch_rows rows."""
+    buffer, buffered = [], 0
+    for df in frames:
+        if df.empty:
+            continue
+        buffer.append(df)
+        buffered += len(df)
+        if buffered >= batch_rows:
+            yield pd.concat(buffer, ignore_index=True)
+            buffer, buffered = [], 0
+    if buffer:
+        yield pd.concat(buffer, ignore_index=True)
+
+
+def bulk_load(conn, cur, batches, table=TABLE_NAME):
+    """Stage 3: COPY every batch into the table. Returns (rows loaded, rows failed)."""
+    loaded = failed = 0
+    for batch in batches:
+        ok, bad = copy_chunk(conn, cur, prepare_chunk(batch), table)
+        loaded += ok
+        failed += bad
+    return loaded, failed
+
+
+if __name__ == "__main__":
+    NC_DIR = input("Enter the directory where NC data is located: ")
+    if not os.path.exists(NC_DIR):
+        raise FileNotFoundError(f"NC data directory {NC_DIR} not found")
+
+    workers = WORKERS if WORKERS > 0 else os.cpu_count()
+    nc_files = sorted(os.path.abspath(f) for f in glob.glob(os.path.join(NC_DIR, "**", "*.nc"), recursive=True))
+    print(f"📂 Found {len(nc_files)} NetCDF files (converter: {CONVERTER}, workers: {workers})")
+
+    malformed = malformed_files(NC_DIR)
+    if malformed:
+        nc_files = [f for f in nc_files if f not in malformed]
+        print(f"🚫 Skipping {len(malformed)} files flagged as malformed by verifyNC.py")
+
+    conn = connect()
+    cur = conn.cursor()
+    create_table(cur)
+    conn.commit()
+
+    started = time.perf_counter()
+    loaded, failed = bulk_load(conn, cur, rebatch(convert_files(nc_files, CONVERTER, workers)))
+    elapsed = time.perf_counter() - started
+
+    print(f"\n📥 Rows loaded: {loaded}, rows in failed batches: {failed} "
+          f"({loaded / elapsed if elapsed else 0:,.0f} rows/s)")
+    build_indexes(conn)
+    mark_data_changed(conn)
+
+    cur.execute(f"SELECT COUNT(*) FROM {TABLE_NAME};")
+    print(f"✅ Total rows in table: {cur.fetchone()[0]}")
+
+    cur.close()
+    conn.close()
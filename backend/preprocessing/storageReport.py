@@ -0,0 +1,85 @@
+import json
+import time
+import statistics
+import pandas as pd
+from CSV_to_SQL import connect, column_definitions, cast_columns, STORAGE_TYPES, NUMERIC_COLUMNS, TABLE_NAME
+
+# Compares the "numeric" and "compact" column storage on a copy of the table:
+# on-disk size, a full-table aggregate scan, and the Python side of fetching
+# every row into a float DataFrame (driver decoding + the astype(float) the
+# agents apply to Decimal columns).
+
+REPEATS = 3
+REPORT_PATH = "storage_report.json"
+
+SCAN_QUERY = """
+    SELECT COUNT(*), AVG(temperature), AVG(salinity), MIN(latitude), MAX(longitude), MAX(depth) FROM {table}
+"""
+
+
+def median_ms(fn):
+    timings = []
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def fetch_and_convert(cur, table):
+    """Time fetching all rows and turning them into a float DataFrame separately."""
+    fetch, convert = [], []
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        cur.execute(f"SELECT * FROM {table};")
+        rows = cur.fetchall()
+        columns = [desc[0] for desc in cur.description]
+        fetched = time.perf_counter()
+        df = pd.DataFrame(rows, columns=columns)
+        for col in NUMERIC_COLUMNS:
+            df[col] = df[col].astype(float)
+        fetch.append((fetched - started) * 1000)
+        convert.append((time.perf_counter() - fetched) * 1000)
+    return statistics.median(fetch), statistics.median(convert)
+
+
+def run_report(conn, table=TABLE_NAME):
+    cur = conn.cursor()
+    report = {"table": table, "repeats": REPEATS, "storage": {}}
+    for storage in STORAGE_TYPES:
+        copy = f"storage_{storage}"
+        print(f"⏳ Copying {table} with {storage} storage...")
+        cur.execute(f"CREATE TEMP TABLE {copy} ({column_definitions(storage)});")
+        cur.execute(f"INSERT INTO {copy} SELECT {cast_columns(storage)} FROM {table};")
+        cur.execute(f"ANALYZE {copy};")
+        cur.execute(f"SELECT COUNT(*), pg_total_relation_size('{copy}') FROM {copy};")
+        rows, size = cur.fetchone()
+        scan_ms = median_ms(lambda: (cur.execute(SCAN_QUERY.format(table=copy)), cur.fetchall()))
+        fetch_ms, convert_ms = fetch_and_convert(cur, copy)
+        report["storage"][storage] = {
+            "rows": rows,
+            "bytes": size,
+            "bytes_per_row": round(size / rows, 1) if rows else None,
+            "scan_ms": round(scan_ms, 2),
+            "fetch_ms": round(fetch_ms, 2),
+            "convert_ms": round(convert_ms, 2),
+        }
+        cur.execute(f"DROP TABLE {copy};")
+    cur.close()
+    return report
+
+
+if __name__ == "__main__":
+    conn = connect()
+    report = run_report(conn)
+    conn.close()
+
+    print(f"\n📊 Median of {REPEATS} runs on {report['table']}:")
+    print(f"{'storage':<10}{'size MB':>10}{'B/row':>8}{'scan ms':>10}{'fetch ms':>10}{'convert ms':>12}")
+    for storage, entry in report["storage"].items():
+        print(f"{storage:<10}{entry['bytes'] / 1e6:>10.1f}{entry['bytes_per_row'] or 0:>8.1f}"
+              f"{entry['scan_ms']:>10.1f}{entry['fetch_ms']:>10.1f}{entry['convert_ms']:>12.1f}")
+
+    with open(REPORT_PATH, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n📝 Report written to {REPORT_PATH}")
@@ -1,11 +1,166 @@
+import os
+import re
+import glob
+import numpy as np
+import pandas as pd
 import xarray as xr
+from tqdm import tqdm
+from netCDF4 import Dataset
+from concurrent.futures import ProcessPoolExecutor
+from nc_to_CSV import juld_to_datetime, WORKERS
+from ingestManifest import file_stat
 
-# Open the NetCDF file
-file_name = input("Enter the nc files path: ")
-ds = xr.open_dataset(file_name)
+# Header-only audit of a directory of NetCDF files. Each file is opened for
+# its metadata only; besides the header, just the 1-D per-profile JULD,
+# LATITUDE and LONGITUDE vectors are read for the extents. The
+# (N_PROF, N_LEVELS) data arrays are never loaded. The summary table is
+# written to <NC_DIR>/nc_inspection.csv, and the converters skip the files it
+# flags as malformed.
 
-# Display general info about the dataset
-print(ds)
+INSPECTION_REPORT = "nc_inspection.csv"
+FILES_PER_TASK = 64
 
-# List all variables
-print("Variables:", list(ds.data_vars))
\ No newline at end of file
+PROFILE_DIMS = ("N_PROF",)
+LEVEL_DIMS = ("N_PROF", "N_LEVELS")
+VARIABLES = {
+    # name: (expected dimensions, required by the converter)
+    "PRES": (LEVEL_DIMS, True),
+    "TEMP": (LEVEL_DIMS, False),
+    "PSAL": (LEVEL_DIMS, False),
+    "JULD": (PROFILE_DIMS, True),
+    "LATITUDE": (PROFILE_DIMS, True),
+    "LONGITUDE": (PROFILE_DIMS, True),
+}
+JULD_BASE_PATTERN = re.compile(r"since\s+1950-01-01")
+
+
+def _extent(ds, name):
+    """(min, max) of a 1-D variable ignoring fill values, or (None, None)."""
+    values = np.ma.asarray(ds.variables[name][:]).astype(np.float64)
+    values = np.ma.filled(values, np.nan)
+    values = values[np.isfinite(values)]
+    if not values.size:
+        return None, None
+    return float(values.min()), float(values.max())
+
+
+def inspect_file(nc_file):
+    """
+    Summarise one file from its header. `problems` make the file malformed
+    (the converter would fail or misread it); `warnings` are reported only.
+    """
+    size, mtime = file_stat(nc_file)
+    row = {"path": nc_file, "size": size, "mtime": mtime}
+    problems, warnings = [], []
+    try:
+        ds = Dataset(nc_file, "r")
+    except Exception as e:
+        row.update(ok=False, problems=f"cannot open: {e}", warnings="")
+        return row
+
+    try:
+        for dim in LEVEL_DIMS:
+            row[dim.lower()] = len(ds.dimensions[dim]) if dim in ds.dimensions else None
+            if row[dim.lower()] is None:
+                problems.append(f"missing dimension {dim}")
+        if row["n_prof"] == 0:
+            warnings.append("no profiles")
+
+        for name, (dims, required) in VARIABLES.items():
+            present = name in ds.variables
+            row[f"has_{name.lower()}"] = present
+            if not present:
+                (problems if required else warnings).append(f"missing {name}")
+            elif ds.variables[name].dimensions != dims:
+                problems.append(f"{name} has dimensions {ds.variables[name].dimensions}, expected {dims}")
+
+        units = getattr(ds.variables["JULD"], "units", "") if row["has_juld"] else ""
+        row["juld_units"] = units
+        if units and not JULD_BASE_PATTERN.search(units):
+            problems.append(f"JULD units '{units}' are not relative to 1950-01-01")
+
+        if not problems:
+            row["lat_min"], row["lat_max"] = _extent(ds, "LATITUDE")
+            row["lon_min"], row["lon_max"] = _extent(ds, "LONGITUDE")
+            juld_min, juld_max = _extent(ds, "JULD")
+            row["time_min"] = juld_to_datetime(juld_min) if juld_min is not None else None
+            row["time_max"] = juld_to_datetime(juld_max) if juld_max is not None else None
+            if row["lat_min"] is not None and (row["lat_min"] < -90 or row["lat_max"] > 90):
+                warnings.append("latitude out of range")
+            if row["lon_min"] is not None and (row["lon_min"] < -180 or row["lon_max"] > 180):
+                warnings.append("longitude out of range")
+            if juld_min is None:
+                warnings.append("no valid JULD")
+    except Exception as e:
+        problems.append(f"unreadable header: {e}")
+    finally:
+        ds.close()
+
+    row.update(ok=not problems, problems="; ".join(problems), warnings="; ".join(warnings))
+    return row
+
+
+def inspect_directory(nc_dir, workers=1):
+    """Inspect every .nc file under nc_dir, in a process pool if workers > 1."""
+    nc_files = sorted(os.path.abspath(f) for f in glob.glob(os.path.join(nc_dir, "**", "*.nc"), recursive=True))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            rows = list(tqdm(executor.map(inspect_file, nc_files, chunksize=FILES_PER_TASK),
+                             total=len(nc_files), desc=f"Inspecting files ({workers} workers)", unit="file"))
+    else:
+        rows = [inspect_file(f) for f in tqdm(nc_files, desc="Inspecting files", unit="file")]
+
+    columns = ["path", "ok", "problems", "warnings", "n_prof", "n_levels"] + \
+              [f"has_{name.lower()}" for name in VARIABLES] + \
+              ["juld_units", "lat_min", "lat_max", "lon_min", "lon_max", "time_min", "time_max", "size", "mtime"]
+    return pd.DataFrame(rows, columns=columns).astype({"n_prof": "Int64", "n_levels": "Int64"})
+
+
+def report_path_for(nc_dir):
+    return os.path.join(nc_dir, INSPECTION_REPORT)
+
+
+def malformed_files(nc_dir):
+    """
+    Paths flagged as malformed by the last inspection of nc_dir. A file that
+    changed on disk since it was inspected is not skipped.
+    """
+    path = report_path_for(nc_dir)
+    if not os.path.exists(path):
+        return set()
+    report = pd.read_csv(path, usecols=["path", "ok", "size", "mtime"])
+    skipped = set()
+    for nc_file, size, mtime in report.loc[~report["ok"], ["path", "size", "mtime"]].itertuples(index=False):
+        if os.path.exists(nc_file) and file_stat(nc_file) == (size, mtime):
+            skipped.add(nc_file)
+    return skipped
+
+
+if __name__ == "__main__":
+    target = input("Enter the nc file or directory path: ").strip()
+
+    if os.path.isfile(target):
+        # Single file: show its structure (opened lazily, no data loaded)
+        ds = xr.open_dataset(target)
+        print(ds)
+        print("Variables:", list(ds.data_vars))
+        ds.close()
+    else:
+        workers = WORKERS if WORKERS > 0 else os.cpu_count()
+        report = inspect_directory(target, workers)
+        report.to_csv(report_path_for(target), index=False)
+
+        bad = report[~report["ok"]]
+        print(f"\n📋 Inspected {len(report)} files: {len(report) - len(bad)} ok, {len(bad)} malformed, "
+              f"{(report['warnings'].fillna('') != '').sum()} with warnings")
+        if len(report):
+            good = report[report["ok"]]
+            print(f"  profiles: {int(good['n_prof'].sum())}, levels per profile: "
+                  f"{good['n_levels'].min()}–{good['n_levels'].max()}")
+            print(f"  latitude: {good['lat_min'].min()} to {good['lat_max'].max()}, "
+                  f"longitude: {good['lon_min'].min()} to {good['lon_max'].max()}")
+            print(f"  time: {good['time_min'].dropna().min()} to {good['time_max'].dropna().max()}")
+            print(f"  JULD units: {sorted(report['juld_units'].fillna('').unique())}")
+        for nc_file, problems in bad[["path", "problems"]].itertuples(index=False):
+            print(f"❌ {os.path.basename(nc_file)}: {problems}")
+        print(f"\n📝 Summary table written to {report_path_for(target)}; malformed files will be skipped by the converter")